@@ -1,18 +1,61 @@
+import os
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 import matplotlib.pyplot as plt
-import os
-from mdtools.plotting_class import FilePlotting
+from mdtools.stat_quantities import StatQ
+from mdtools.state_properties import StateProperties
+from mdtools.jobs import JobRunner
+
+"""
+The analyses run in a pool of worker processes, so the window stays
+responsive while large logs are loaded. The finished arrays are polled from
+the Tk main loop, which is the only thread drawing with matplotlib. Results
+are cached per (sim, rho, T, n, A), so going back to a state point that was
+already analysed draws at once. Changing a parameter cancels the jobs that
+were asked for with the old parameters.
+"""
 
 LARGE_FONT = ("Verdana", 10)
+# Time between two polls of the finished jobs, in ms
+POLL_INTERVAL = 50
+
+
+# Button text: (analysis, function drawing its result with the draw_*
+# methods of StatQ and StateProperties)
+BUTTONS = {
+    "U": ("energies", lambda q, sp, res, label:
+          sp.draw_energy(res["time"], res["U"], label, "U")),
+    "K": ("energies", lambda q, sp, res, label:
+          sp.draw_energy(res["time"], res["K"], label, "K")),
+    "U+K": ("energies", lambda q, sp, res, label:
+            sp.draw_energy(res["time"], res["U+K"], label, "U+K")),
+    "All": ("energies", lambda q, sp, res, label:
+            sp.draw_energies(res["time"], res["U"], res["K"], res["U+K"])),
+    "RDF": ("rdf", lambda q, sp, res, label:
+            q.draw_rdf(res["r"], res["g"], label)),
+    "MSD": ("msd", lambda q, sp, res, label:
+            q.draw_msd(res["time"], res["msd"],
+                       f"{label} D: {res['D']:.4f}")),
+    "VAF": ("vaf", lambda q, sp, res, label:
+            q.draw_vaf(res["time"], res["cr"], label)),
+    "D vs a": ("diffusion", lambda q, sp, res, label:
+               q.draw_diffusion(res["a"], res["D"], label, res["D_err"])),
+    "Pc": ("pc", lambda q, sp, res, label:
+           sp.draw_pc(res["time"], res["Pc"], label)),
+    "Vel dist": ("vel_dist", lambda q, sp, res, label:
+                 q.draw_vel_dist(res["density"], res["component_edges"],
+                                 res["speed_edges"], res["scale"], label)),
+}
 
 
 class MDAnalysis(tk.Tk):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, workers=0, **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
         tk.Tk.wm_title(self, "Analysis of MD simulations")
         container = ttk.Frame(self, width=200, height=200)
+        container.pack(fill="both", expand=True)
 
+        self.runner = JobRunner(workers)
         self.frames = {}
 
         for F in (MainPage, PageOne):
@@ -21,148 +64,177 @@ class MDAnalysis(tk.Tk):
             frame.grid(row=0, column=0, sticky="nsew")
 
         self.show_frame(MainPage)
+        self.protocol("WM_DELETE_WINDOW", self.close)
 
     def show_frame(self, cont):
         frame = self.frames[cont]
         frame.tkraise()
 
+    def close(self):
+        self.runner.shutdown()
+        self.destroy()
+
 
 class MainPage(tk.Frame):
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
-        self.particles = tk.IntVar()
-        self.steps = tk.IntVar()
+        self.runner = controller.runner
+        # Button text of every job that is waiting for its result
+        self.pending = {}
+
+        self.steps = tk.IntVar(value=10000)
+        self.particles = tk.IntVar(value=1000)
+        self.rho = tk.DoubleVar(value=0.5)
+        self.t = tk.DoubleVar(value=0.5)
+        self.a = tk.DoubleVar(value=0.5)
+        self.n = tk.IntVar(value=12)
+        self.sim_name = tk.StringVar(value="")
+        self.data_dir = tk.StringVar(value=os.getcwd())
+        self.a_list = tk.StringVar(value="0.25, 0.5, 0.75, 1.0")
 
         # Entry fields
-        # self. included in these 2 variables because otherwise it was not working
-        self.steps.set(10000)
-        __steps_label = ttk.Label(text="N(steps)")
-        __steps_label.grid(row=0, column=6)
-        __steps = ttk.Entry(textvariable=self.steps, width=6)
-        __steps.grid(row=0, column=7, pady=5)
-
-        self.particles.set(1000)
-        __particles_label = ttk.Label(text="Particles")
-        __particles_label.grid(row=0, column=8)
-        __particles = ttk.Entry(textvariable=self.particles, width=4)
-        __particles.grid(row=0, column=9, pady=5)
-
-        rho = tk.DoubleVar()
-        rho.set(0.5)
-        __rho_label = ttk.Label(text="\u03C1")
-        __rho_label.grid(row=0, column=10)
-        __rho = ttk.Entry(textvariable=rho, width=6)
-        __rho.grid(row=0, column=11, pady=5)
-
-        t = tk.DoubleVar()
-        t.set(0.5)
-        __t_label = ttk.Label(text="T")
-        __t_label.grid(row=0, column=12)
-        __t = ttk.Entry(textvariable=t, width=6)
-        __t.grid(row=0, column=13, pady=5)
-
-        a = tk.DoubleVar()
-        a.set(0.5)
-        __a_label = ttk.Label(text="a")
-        __a_label.grid(row=0, column=14)
-        __a = ttk.Entry(textvariable=a, width=6)
-        __a.grid(row=0, column=15, pady=5)
-
-        n = tk.IntVar()
-        n.set(12)
-        __n_label = ttk.Label(text="n")
-        __n_label.grid(row=0, column=16)
-        __n = ttk.Entry(textvariable=n, width=2)
-        __n.grid(row=0, column=17, pady=5)
-
-        obj = FilePlotting(self.steps.get(), self.particles.get())
-        os.chdir('../../Archives of Data/')
+        entries = (("N(steps)", self.steps, 6), ("Particles", self.particles, 6),
+                   ("ρ", self.rho, 6), ("T", self.t, 6),
+                   ("a", self.a, 6), ("n", self.n, 3))
+        for i, (text, var, width) in enumerate(entries):
+            ttk.Label(self, text=text).grid(row=0, column=6 + 2 * i)
+            ttk.Entry(self, textvariable=var, width=width).grid(
+                row=0, column=7 + 2 * i, pady=5)
+
+        ttk.Label(self, text="Sim name").grid(row=1, column=6)
+        ttk.Entry(self, textvariable=self.sim_name, width=12).grid(
+            row=1, column=7, columnspan=2, pady=5)
+        ttk.Label(self, text="Data").grid(row=1, column=9)
+        ttk.Entry(self, textvariable=self.data_dir, width=30).grid(
+            row=1, column=10, columnspan=6, pady=5)
+        ttk.Button(self, text="Browse", command=self.browse).grid(
+            row=1, column=16, columnspan=2)
+        ttk.Label(self, text="a list").grid(row=2, column=6)
+        ttk.Entry(self, textvariable=self.a_list, width=20).grid(
+            row=2, column=7, columnspan=4, pady=5)
+
+        # Jobs asked for with other parameters are no longer wanted
+        for var in (self.steps, self.particles, self.rho, self.t, self.a,
+                    self.n, self.sim_name, self.data_dir, self.a_list):
+            var.trace_add("write", self.parameters_changed)
 
         # Buttons
         # plotting entries
-        energies_label = ttk.Label(text="Energies", font=LARGE_FONT)
+        energies_label = ttk.Label(self, text="Energies", font=LARGE_FONT)
         energies_label.grid(row=0, column=0, columnspan=2, pady=5)
 
-        stat_label = ttk.Label(text="Statistical Analysis", font=LARGE_FONT)
+        stat_label = ttk.Label(self, text="Statistical Analysis",
+                               font=LARGE_FONT)
         stat_label.grid(row=0, column=3, columnspan=3, pady=5)
+        self.grid_columnconfigure(2, minsize=20)
 
-        # todo: this is a hack. find better sol'n
-        empty_label = ttk.Label(text=" ")
-        empty_label.grid(row=0, column=2)
-        self.grid_columnconfigure(2, minsize=1000)
-
-        # Energies vs time for single runs
-        u_en = ttk.Button(text="U",
-                          command=obj.potential_data(rho.get(), t.get(), n.get(), a.get()))
-        u_en.grid(row=1, column=0)
-
-        k_en = ttk.Button(text="K")
-        k_en.grid(row=1, column=1)
-
-        total_en = ttk.Button(text="U+K")
-        total_en.grid(row=2, column=0)
-
-        all_en = ttk.Button(text="All",
-                            command=obj.energy_plots(rho.get(), t.get(), n.get(), a.get()))
-        all_en.grid(row=2, column=1)
-
-        # Statistical Quantities
-        # tkinter variables not converted to Python variables
-
-        rdf = ttk.Button(text="RDF",
-                         command=lambda: obj.rdf(rho.get(), t.get(), n.get(), a.get()))
-        rdf.grid(row=1, column=3)
+        positions = {"U": (1, 0), "K": (1, 1), "U+K": (2, 0), "All": (2, 1),
+                     "RDF": (1, 3), "MSD": (1, 4), "VAF": (1, 5),
+                     "D vs a": (2, 3), "Pc": (2, 4), "Vel dist": (2, 5)}
+        for text, (row, column) in positions.items():
+            button = ttk.Button(self, text=text,
+                                command=lambda text=text: self.request(text))
+            button.grid(row=row, column=column)
 
-        msd = ttk.Button(text="MSD",
-                         command=lambda: obj.msd(rho.get(), t.get(), n.get(), a.get()))
-        msd.grid(row=1, column=4)
-
-        vaf = ttk.Button(text="VAF",
-                         command=lambda: obj.vaf(rho.get(), t.get(), n.get(), a.get()))
-        vaf.grid(row=1, column=5)
-
-        dif_plot = ttk.Button(text="D vs a",
-                              command=lambda: obj.diffusion_plot(rho.get(), t.get(), n.get(), a.get()))
-        dif_plot.grid(row=2, column=3)
-
-        pc = ttk.Button(text="Pc",
-                        command=lambda: obj.pc(rho.get(), t.get(), n.get(), a.get()))
-        pc.grid(row=2, column=4)
         # Allows multiple figures to be stacked and then plotted
         # use tk.Button since ttk has no easy way for bg/fg manipulation
-        plot_button = tk.Button(text="PLOT", bg="blue",
+        plot_button = tk.Button(self, text="PLOT", bg="blue",
                                 command=lambda: plt.show())
-        plot_button.grid(row=1, column=7, padx=5)
+        plot_button.grid(row=3, column=7, padx=5)
 
-        clear_figure = tk.Button(text="Clear Fig", bg="red",
+        clear_figure = tk.Button(self, text="Clear Fig", bg="red",
                                  command=lambda: plt.clf())
-        clear_figure.grid(row=1, column=8, padx=5)
-
-        # No-Data plots
-        no_data_label = ttk.Label(text="Theoretical", font=LARGE_FONT)
-        no_data_label.grid(row=4, column=0, columnspan=2)
-        # todo: this is a hack. find better sol'n
-        empty_label = ttk.Label(text=" ")
-        empty_label.grid(row=3, column=0)
-        self.grid_rowconfigure(3, minsize=1000)
-
-        # Buttons
-        potential = ttk.Button(text="Potential",
-                               command=lambda: obj.potential(n.get(), a.get()))
-        potential.grid(row=5, column=0)
-
-        force = ttk.Button(text="Force",
-                           command=lambda: obj.force(n.get(), a.get()))
-        force.grid(row=5, column=1)
-
-        rdf2 = ttk.Button(text="RDF2",
-                          command=lambda: obj.rdf_2(n.get(), a.get()))
-        rdf2.grid(row=6, column=0)
-
-        avg_q_label = ttk.Label(text="Average Quantities", font=LARGE_FONT)
-        avg_q_label.grid(row=5, column=3, columnspan=3)
-        three_d_label = ttk.Label(text="3D", font=LARGE_FONT)
-        three_d_label.grid(row=9, column=0, columnspan=2)
+        clear_figure.grid(row=3, column=8, padx=5)
+
+        cancel = tk.Button(self, text="Cancel", command=self.cancel)
+        cancel.grid(row=3, column=9, padx=5)
+
+        # Progress of the running analyses
+        self.progress = ttk.Progressbar(self, mode="determinate", length=200)
+        self.progress.grid(row=4, column=0, columnspan=6, pady=5, sticky="we")
+        self.status = tk.StringVar(value="Idle")
+        ttk.Label(self, textvariable=self.status).grid(
+            row=4, column=6, columnspan=12, sticky="w")
+
+        self.after(POLL_INTERVAL, self.poll)
+
+    def browse(self):
+        path = filedialog.askdirectory(initialdir=self.data_dir.get())
+        if path:
+            self.data_dir.set(path)
+
+    def parameters(self):
+        """
+        @return: the keyword arguments of JobRunner.submit, or None if an
+                 entry does not hold a valid value
+        """
+        try:
+            return {"steps": self.steps.get(),
+                    "particles": self.particles.get(),
+                    "sim_name": self.sim_name.get(),
+                    "rho": self.rho.get(), "t": self.t.get(),
+                    "n": self.n.get(), "a": self.a.get(),
+                    "data_dir": self.data_dir.get()}
+        except (tk.TclError, ValueError):
+            return None
+
+    def request(self, text):
+        params = self.parameters()
+        if params is None:
+            self.status.set("Invalid parameters")
+            return
+        name, __ = BUTTONS[text]
+        if name == "diffusion":
+            try:
+                params["a_list"] = [float(v) for v in
+                                    self.a_list.get().replace(",", " ").split()]
+            except ValueError:
+                self.status.set("Invalid a list")
+                return
+        job = self.runner.submit(name, **params)
+        self.pending[job.job_id] = text
+        self.update_status()
+
+    def parameters_changed(self, *args):
+        if self.runner.cancel_stale():
+            self.pending.clear()
+            self.update_status("Cancelled the jobs of the old parameters")
+
+    def cancel(self):
+        dropped = self.runner.cancel_stale()
+        self.pending.clear()
+        self.update_status(f"Cancelled {dropped} jobs")
+
+    def poll(self):
+        # Drawing only ever happens here, on the Tk thread
+        for job in self.runner.poll():
+            text = self.pending.pop(job.job_id, None)
+            if text is None:
+                continue
+            if job.error is not None:
+                self.update_status(f"{text} failed: {job.error}")
+                continue
+            p = job.params
+            quantities = StatQ(p["steps"], p["particles"])
+            file_id = quantities.file_searcher(p["rho"], p["t"], p["n"],
+                                               p["a"])
+            __, draw = BUTTONS[text]
+            draw(quantities, StateProperties(p["steps"], p["particles"]),
+                 job.result, quantities.get_label(file_id))
+            plt.gcf().canvas.draw_idle()
+            source = "cache" if job.cached else f"{job.elapsed:.2f} s"
+            self.update_status(f"{text} done ({source})")
+        self.after(POLL_INTERVAL, self.poll)
+
+    def update_status(self, message=None):
+        finished, total = self.runner.progress()
+        running = total - finished
+        self.progress["value"] = 100. * finished / total if total else 0.
+        if running:
+            names = ", ".join(sorted(set(self.pending.values())))
+            self.status.set(f"Running {names} ({finished}/{total})")
+        elif message is not None:
+            self.status.set(message)
 
 
 class PageOne(tk.Frame):
@@ -176,5 +248,8 @@ class PageOne(tk.Frame):
         button1.grid(row=1, column=0)
 
 
-app = MDAnalysis()
-app.mainloop()
+if __name__ == "__main__":
+    # Figures appear and update as the results arrive
+    plt.ion()
+    app = MDAnalysis()
+    app.mainloop()
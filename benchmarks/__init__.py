@@ -0,0 +1,9 @@
+"""
+Benchmarks of mdtools.
+
+    synthetic.py    writes synthetic simulation logs of any size, named and
+                    laid out like the files of md-sim
+    run.py          times every loader and analysis method on them and
+                    saves the results as JSON
+    import_time.py  startup time of "import mdtools"
+"""
@@ -0,0 +1,61 @@
+"""
+Startup-time benchmark for "import mdtools".
+
+Every measurement runs in a fresh interpreter, since the import cost is only
+paid once per process. The benchmark fails if the median import time exceeds
+the bound, or if importing the package loads any of the heavy dependencies.
+
+    python benchmarks/import_time.py [bound in seconds] [repeats]
+"""
+import os
+import sys
+import json
+import subprocess
+
+# The probe imports the mdtools of this checkout, whatever the working
+# directory of the caller
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ("matplotlib", "matplotlib.pyplot", "mpl_toolkits.mplot3d",
+                 "matplotlib.animation", "scipy", "scipy.stats",
+                 "scipy.interpolate", "scipy.signal")
+
+PROBE = f"""
+import sys, time, json
+start = time.perf_counter()
+import mdtools
+from mdtools import Isomorph, FileNaming
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed,
+                  "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(repeats=5):
+    """
+    @param repeats: number of fresh interpreters to time the import in
+    @return: list of import times in seconds, heavy modules that were loaded
+    """
+    times, loaded = [], set()
+    for __ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", PROBE], check=True,
+                             capture_output=True, text=True,
+                             cwd=REPO_ROOT).stdout
+        result = json.loads(out.strip().splitlines()[-1])
+        times.append(result["elapsed"])
+        loaded.update(result["loaded"])
+    return times, sorted(loaded)
+
+
+def main(bound=0.5, repeats=5):
+    times, loaded = measure_import(repeats)
+    median = sorted(times)[len(times) // 2]
+    print(f"import mdtools: median {median * 1e3:.1f} ms "
+          f"(min {min(times) * 1e3:.1f} ms, max {max(times) * 1e3:.1f} ms)")
+    assert not loaded, f"import mdtools loaded heavy modules: {loaded}"
+    assert median < bound, \
+        f"import mdtools took {median:.3f} s, more than the {bound} s bound"
+
+
+if __name__ == "__main__":
+    main(*(float(a) if i == 0 else int(a) for i, a in enumerate(sys.argv[1:])))
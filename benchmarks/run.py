@@ -0,0 +1,450 @@
+"""
+Timed and peak-memory benchmarks of the loaders and analysis methods of
+mdtools, on synthetic logs written by benchmarks.synthetic.
+
+Every benchmark is timed `repeats` times, with its setup (e.g. clearing the
+column cache for a cold load) excluded from the timings, and then run once
+more under tracemalloc for the peak of the memory allocated by Python and
+numpy. Pages of memory-mapped files are not counted. The plots are drawn on
+the Agg backend and closed after every run.
+
+    python -m benchmarks.run [--particles N] [--rows N] [--frames N]
+                             [--repeats N] [--only NAME ...]
+                             [--data-dir DIR] [--out results.json]
+
+The results are written as JSON, together with the sizes, the versions of
+the dependencies and the machine they were measured on, so that runs can be
+compared over time.
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+from benchmarks import synthetic
+from benchmarks.import_time import measure_import
+from mdtools.log_cache import load_columns, clear_cache
+from mdtools.trajectory import trajectory_file
+from mdtools.stat_quantities import StatQ
+from mdtools.state_properties import StateProperties
+from mdtools.rdf_analysis_tools import RDFAnalysis
+from mdtools.iso_store import IsoStore
+from mdtools.visualise_fluid import ParticleVisualisation
+from mdtools.movie import ParticleScene, neighbour_colouring
+
+SIM_NAME = "bench_"
+SWEEP_NAME = "sweep_"
+STEPS = 1000
+STATE_POINT = {"rho": 0.5, "t": 0.5, "n": 8, "a": 0.5}
+# The synthetic trajectories save every integration step
+FRAME_INTERVAL = 1
+SWEEP = {"rho_list": [0.3, 0.5], "t_list": [0.5, 1.0],
+         "n_list": [8, 10, 12], "a_list": [0.25, 0.5]}
+# State points of the isosbestic store of the plotting benchmarks
+ISO_GRID = {"rho": np.round(np.linspace(0.1, 2., 20), 3).tolist(),
+            "t": [0.5, 1.0, 1.5, 2.0, 2.5],
+            "a": np.linspace(0., 1., 50).tolist()}
+# Number of frames drawn by the animation benchmarks
+ANIMATION_FRAMES = 20
+
+# name: (function, setup, measure memory)
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None, memory=True):
+    """
+    Registers a benchmark. The function is called as func(ctx, arg), with
+    arg the value returned by setup(ctx), which is not timed.
+    """
+    def register(func):
+        BENCHMARKS[name] = (func, setup, memory)
+        return func
+    return register
+
+
+class Context(object):
+    """
+    Sizes of the synthetic data and the paths of the generated logs.
+    """
+
+    def __init__(self, data_dir, particles, rows, frames, rdf_bins):
+        self.data_dir = data_dir
+        self.particles = particles
+        self.rows = rows
+        self.frames = frames
+        self.rdf_bins = rdf_bins
+        self.paths = {}
+
+    def generate(self):
+        self.paths = synthetic.generate_state_point(
+            self.data_dir, SIM_NAME, STEPS, self.particles, rows=self.rows,
+            frames=self.frames, rdf_bins=self.rdf_bins, **STATE_POINT)
+        synthetic.generate_sweep(self.data_dir, sim_name=SWEEP_NAME,
+                                 steps=STEPS, particles=self.particles,
+                                 rdf_bins=self.rdf_bins, **SWEEP)
+
+    def sizes(self):
+        return {"particles": self.particles, "rows": self.rows,
+                "frames": self.frames, "rdf_bins": self.rdf_bins}
+
+    def args(self, n=True):
+        sp = STATE_POINT
+        return (sp["rho"], sp["t"], sp["n"] if n else None, sp["a"])
+
+    def trajectory(self):
+        return ParticleVisualisation(STEPS, self.particles).trajectory(
+            SIM_NAME, *self.args(), frame_interval=FRAME_INTERVAL)
+
+
+def _warm_data(ctx):
+    # Build the column cache of the Data log, so that only the analysis is
+    # timed
+    load_columns(ctx.paths["Data"], usecols=tuple(range(12)))
+
+
+def _clear_data(ctx):
+    clear_cache(ctx.paths["Data"])
+
+
+def _warm_trajectory(ctx):
+    ctx.trajectory()
+
+
+def _remove_trajectory(ctx):
+    file_id = StatQ(STEPS, ctx.particles).file_searcher(*ctx.args())
+    fname = os.path.join(ctx.data_dir, trajectory_file(SIM_NAME, file_id))
+    if os.path.exists(fname):
+        os.remove(fname)
+
+
+def _new_rdf_analysis(ctx):
+    # A fresh instance, so that its RDF cache is empty
+    return RDFAnalysis(STEPS, ctx.particles)
+
+
+def _new_scene(ctx, colour_by=None):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    traj = ctx.trajectory()
+    colours = neighbour_colouring(traj.box_length, colour_by)
+    first = np.asarray(traj.frame(0), dtype=np.float64)
+    fig = Figure(figsize=(6, 6), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    scene = ParticleScene(fig, traj.box_length, first,
+                          values=None if colours is None else colours(first))
+    return traj, canvas, scene, colours
+
+
+# Loaders
+@benchmark("loadtxt_data")
+def _loadtxt_data(ctx, arg):
+    np.loadtxt(ctx.paths["Data"], delimiter='\t', usecols=(3, 4, 5),
+               comments='#', unpack=True)
+
+
+@benchmark("load_columns_cold", setup=_clear_data)
+def _load_columns_cold(ctx, arg):
+    load_columns(ctx.paths["Data"], usecols=(3, 4, 5))
+
+
+@benchmark("load_columns_warm", setup=_warm_data)
+def _load_columns_warm(ctx, arg):
+    load_columns(ctx.paths["Data"], usecols=(3, 4, 5))
+
+
+@benchmark("trajectory_convert", setup=_remove_trajectory)
+def _trajectory_convert(ctx, arg):
+    ctx.trajectory()
+
+
+# StatQ
+@benchmark("msd", setup=_warm_data)
+def _msd(ctx, arg):
+    StatQ(STEPS, ctx.particles).msd(SIM_NAME, *ctx.args())
+
+
+@benchmark("msd_fit")
+def _msd_fit(ctx, arg):
+    StatQ(STEPS, ctx.particles).msd_fit(SIM_NAME, *ctx.args())
+
+
+@benchmark("msd_multi_origin", setup=_warm_trajectory)
+def _msd_multi_origin(ctx, arg):
+    StatQ(STEPS, ctx.particles).msd_multi_origin(SIM_NAME, *ctx.args())
+
+
+@benchmark("vaf", setup=_warm_data)
+def _vaf(ctx, arg):
+    StatQ(STEPS, ctx.particles).vaf(SIM_NAME, *ctx.args())
+
+
+@benchmark("vaf_multi_origin", setup=_warm_trajectory)
+def _vaf_multi_origin(ctx, arg):
+    StatQ(STEPS, ctx.particles).vaf_multi_origin(SIM_NAME, *ctx.args())
+
+
+@benchmark("vel_dist")
+def _vel_dist(ctx, arg):
+    StatQ(STEPS, ctx.particles).vel_dist(SIM_NAME, *ctx.args())
+
+
+@benchmark("rdf_from_positions")
+def _rdf_from_positions(ctx, arg):
+    StatQ(STEPS, ctx.particles).rdf_from_positions(SIM_NAME, *ctx.args())
+
+
+@benchmark("structure_factor")
+def _structure_factor(ctx, arg):
+    StatQ(STEPS, ctx.particles).structure_factor(SIM_NAME, *ctx.args(),
+                                                 k_max=5.)
+
+
+# StateProperties
+@benchmark("energy_plots", setup=_warm_data)
+def _energy_plots(ctx, arg):
+    StateProperties(STEPS, ctx.particles).energy_plots(SIM_NAME, *ctx.args())
+
+
+@benchmark("energy_averages")
+def _energy_averages(ctx, arg):
+    StateProperties(STEPS, ctx.particles).energy_averages(SIM_NAME,
+                                                          *ctx.args())
+
+
+@benchmark("averages_with_errors", setup=_warm_data)
+def _averages_with_errors(ctx, arg):
+    StateProperties(STEPS, ctx.particles).averages_with_errors(SIM_NAME,
+                                                               *ctx.args())
+
+
+# RDFAnalysis, on the sweep
+@benchmark("rdf_intersect", setup=_new_rdf_analysis)
+def _rdf_intersect(ctx, rdf_analysis):
+    sp = STATE_POINT
+    rdf_analysis.rdf_intersect(SWEEP_NAME, sp["rho"], sp["t"],
+                               SWEEP["n_list"], sp["a"], plot=False)
+
+
+@benchmark("batch_intersections", setup=_new_rdf_analysis)
+def _batch_intersections(ctx, rdf_analysis):
+    rdf_analysis.batch_intersections(SWEEP_NAME, **SWEEP)
+
+
+@benchmark("get_intersections_to_file", setup=_new_rdf_analysis)
+def _get_intersections_to_file(ctx, rdf_analysis):
+    rdf_analysis.get_intersections_to_file(
+        SWEEP_NAME, filename=os.path.join(ctx.data_dir, "serial_"), **SWEEP)
+
+
+@benchmark("get_intersections_to_file_workers", setup=_new_rdf_analysis,
+           memory=False)
+def _get_intersections_to_file_workers(ctx, rdf_analysis):
+    rdf_analysis.get_intersections_to_file(
+        SWEEP_NAME, filename=os.path.join(ctx.data_dir, "workers_"),
+        workers=0, **SWEEP)
+
+
+def _iso_store(ctx):
+    fname = os.path.join(ctx.data_dir, "bench.iso")
+    if not os.path.exists(fname):
+        IsoStore(fname).extend(
+            (rho, t, a, SWEEP["n_list"], [1. + 0.1 * a, 1.5], [1., 1.])
+            for rho in ISO_GRID["rho"] for t in ISO_GRID["t"]
+            for a in ISO_GRID["a"])
+    return fname
+
+
+@benchmark("plot_intersection_loop", setup=_iso_store)
+def _plot_intersection_loop(ctx, fname):
+    for t in ISO_GRID["t"]:
+        for rho in ISO_GRID["rho"]:
+            RDFAnalysis.plot_intersection(rho, t, fname)
+
+
+@benchmark("plot_intersections", setup=_iso_store)
+def _plot_intersections(ctx, fname):
+    RDFAnalysis.plot_intersections(fname)
+
+
+# ParticleVisualisation, the frame updates of animation3D
+@benchmark("animation3D_frames", setup=_new_scene)
+def _animation3d_frames(ctx, arg):
+    traj, canvas, scene, __ = arg
+    for num in range(min(ANIMATION_FRAMES, len(traj))):
+        scene.update(num, np.asarray(traj.frame(num), dtype=np.float64))
+        canvas.draw()
+
+
+@benchmark("animation3D_frames_nn",
+           setup=lambda ctx: _new_scene(ctx, colour_by="nn"))
+def _animation3d_frames_nn(ctx, arg):
+    traj, canvas, scene, colours = arg
+    for num in range(min(ANIMATION_FRAMES, len(traj))):
+        positions = np.asarray(traj.frame(num), dtype=np.float64)
+        scene.update(num, positions, colours(positions))
+        canvas.draw()
+
+
+@benchmark("animation3D_funcanimation")
+def _animation3d_funcanimation(ctx, arg):
+    # Steps the FuncAnimation of animation3D itself, past the prefetch
+    # buffer and into a repeat, to also time the frame source
+    buffer = 4
+    frames = min(ANIMATION_FRAMES, len(ctx.trajectory()))
+    ani = ParticleVisualisation(STEPS, ctx.particles).animation3D(
+        SIM_NAME, *ctx.args(), stop=frames, buffer=buffer)
+    ani._init_draw()
+    for __ in range(frames + 2 * buffer):
+        ani._step()
+    ani.event_source.stop()
+
+
+@benchmark("import_mdtools", memory=False)
+def _import_mdtools(ctx, arg):
+    # Runs in a fresh interpreter, memory is not comparable
+    measure_import(1)
+
+
+def _close_figures():
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close("all")
+
+
+def run_benchmark(ctx, name, repeats=3):
+    """
+    @param ctx: Context of the generated data
+    @param name: name of a registered benchmark
+    @param repeats: number of timed runs
+    @return: dictionary of the timings in seconds and the peak memory in bytes
+    """
+    func, setup, memory = BENCHMARKS[name]
+    times = []
+    for __ in range(repeats):
+        arg = None if setup is None else setup(ctx)
+        start = time.perf_counter()
+        func(ctx, arg)
+        times.append(time.perf_counter() - start)
+        _close_figures()
+
+    peak = None
+    if memory:
+        arg = None if setup is None else setup(ctx)
+        tracemalloc.start()
+        try:
+            func(ctx, arg)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            _close_figures()
+    return {"times": times, "median": float(np.median(times)),
+            "min": min(times), "peak_bytes": peak}
+
+
+def _versions():
+    versions = {"python": platform.python_version()}
+    for module in ("numpy", "scipy", "matplotlib"):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return versions
+
+
+def run_suite(data_dir, particles=1000, rows=10000, frames=100, rdf_bins=500,
+              repeats=3, only=None, reuse=False):
+    """
+    Generates the synthetic logs in data_dir and runs the benchmarks there.
+
+    @param data_dir: directory of the synthetic logs
+    @param particles: number of particles
+    @param rows: number of rows of the Data log
+    @param frames: number of frames of the x, y, z trajectories
+    @param rdf_bins: number of bins of the RDFs
+    @param repeats: number of timed runs of every benchmark
+    @param only: names of the benchmarks to run, defaults to all of them
+    @param reuse: keep the logs already in data_dir instead of writing them
+    @return: dictionary with the metadata and the results. A benchmark that
+             raised has {"error": repr(exception)} as its result
+    """
+    names = list(BENCHMARKS) if not only else list(only)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {unknown}, "
+                         f"use some of {list(BENCHMARKS)}")
+
+    data_dir = os.path.abspath(data_dir)
+    ctx = Context(data_dir, particles, rows, frames, rdf_bins)
+    if reuse:
+        ctx.paths = {kind: synthetic.file_name(data_dir, SIM_NAME, kind, STEPS,
+                                               particles, **STATE_POINT)
+                     for kind in synthetic.KINDS}
+    else:
+        ctx.generate()
+
+    # The methods resolve the log files relative to the working directory
+    cwd = os.getcwd()
+    os.chdir(data_dir)
+    results = {}
+    try:
+        for name in names:
+            try:
+                results[name] = run_benchmark(ctx, name, repeats)
+            except Exception as err:
+                # Recorded, so that one failure does not lose the others
+                _close_figures()
+                results[name] = {"error": repr(err)}
+                print(f"{name:36s}failed: {err!r}", file=sys.stderr)
+                continue
+            print(f"{name:36s}{results[name]['median'] * 1e3:12.1f} ms"
+                  + (f"{results[name]['peak_bytes'] / 2 ** 20:12.1f} MiB"
+                     if results[name]['peak_bytes'] is not None else ""))
+    finally:
+        os.chdir(cwd)
+
+    meta = {"timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "platform": platform.platform(), "machine": platform.machine(),
+            "cpu_count": os.cpu_count(), "versions": _versions(),
+            "repeats": repeats}
+    return {"meta": meta, "sizes": ctx.sizes(), "results": results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    size = lambda value: int(float(value))  # accepts 1e6
+    parser.add_argument("--particles", type=size, default=1000)
+    parser.add_argument("--rows", type=size, default=10000)
+    parser.add_argument("--frames", type=size, default=100)
+    parser.add_argument("--rdf-bins", type=size, default=500)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", nargs="+", metavar="NAME")
+    parser.add_argument("--data-dir", help="directory of the synthetic logs, "
+                                           "a temporary one by default")
+    parser.add_argument("--reuse", action="store_true",
+                        help="reuse the logs already in --data-dir")
+    parser.add_argument("--out", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    kwargs = dict(particles=args.particles, rows=args.rows,
+                  frames=args.frames, rdf_bins=args.rdf_bins,
+                  repeats=args.repeats, only=args.only)
+    if args.data_dir is None:
+        with tempfile.TemporaryDirectory() as data_dir:
+            report = run_suite(data_dir, **kwargs)
+    else:
+        report = run_suite(args.data_dir, reuse=args.reuse, **kwargs)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
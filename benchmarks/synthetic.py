@@ -0,0 +1,203 @@
+"""
+Synthetic simulation logs for the benchmarks.
+
+The files use the names generated by FileNaming.file_searcher and the
+column layouts read by mdtools:
+
+    RDF                   r, g(r)
+    Data                  step, rho, T, U, K, Pc, Pk, MSD, VAF, SFx, SFy, SFz
+    Positions_Velocities  rx, ry, rz, vx, vy, vz of every particle
+    x_data, y_data, z_data one frame per row, one particle per column
+
+The values are cheap stand-ins with the right shapes and magnitudes
+(a random walk for the trajectories, an oscillating decay for the RDF and
+VAF, ...), not a simulated fluid. Every file is written in chunks, so logs
+with 10^7 rows or 10^6 particles never have to fit in memory.
+
+    python -m benchmarks.synthetic out_dir [particles] [rows] [frames]
+"""
+import os
+import sys
+import numpy as np
+from scipy import signal
+from mdtools.stat_quantities import FileNaming
+
+KINDS = ("RDF", "Data", "Positions_Velocities", "x_data", "y_data", "z_data")
+DATA_COLUMNS = ("step", "rho", "T", "U", "K", "Pc", "Pk", "MSD", "VAF",
+                "SFx", "SFy", "SFz")
+CHUNK_ROWS = 1 << 16
+
+
+def box_length(particles, rho):
+    return (particles / rho) ** (1. / 3.)
+
+
+def file_name(out_dir, sim_name, kind, steps, particles, rho, t, n=None,
+              a=None):
+    """
+    @return: path of the log, as FileNaming.log_file would resolve it
+    """
+    file_id = FileNaming(steps, particles).file_searcher(rho, t, n, a)
+    return os.path.join(out_dir, f"{sim_name}{kind}{file_id}.log")
+
+
+def _write_rows(f, block):
+    np.savetxt(f, block, delimiter='\t', fmt='%.6f')
+
+
+def write_rdf(fname, rho, t, n, bins=500, r_max=3.0, seed=0):
+    """
+    g(r) of a soft fluid: zero inside the core, damped oscillations
+    around 1 outside. The period depends on n, so that curves of the same
+    state point with different n intersect.
+    """
+    rng = np.random.default_rng(seed)
+    r = np.linspace(r_max / bins, r_max, bins)
+    w = 1. + 0.02 * (n if n is not None else 8)
+    g = 1. + 1.5 * rho ** 0.5 * np.exp(-1.5 * w * (r - 1.)) * \
+        np.cos(2. * np.pi * w * (r - 1.)) / np.sqrt(t)
+    g[r < 0.85] = 0.
+    g = np.clip(g, 0., None) + 0.01 * rng.random(bins) * (g > 0)
+    with open(fname, "w") as f:
+        f.write("# r\tg(r)\n")
+        _write_rows(f, np.column_stack((r, g)))
+
+
+def write_data(fname, rows, rho, t, step=0.005, seed=0):
+    """
+    Time series of the thermodynamic quantities. U, K and Pc are AR(1)
+    processes around their means, the MSD grows linearly and the VAF
+    decays in an oscillating way.
+    """
+    rng = np.random.default_rng(seed)
+    phi = 0.95
+    state = np.zeros(3)
+    means = np.array([-2. * rho, 1.5 * t, rho * t])
+    with open(fname, "w") as f:
+        f.write("# " + "\t".join(DATA_COLUMNS) + "\n")
+        for r0 in range(0, rows, CHUNK_ROWS):
+            n_rows = min(CHUNK_ROWS, rows - r0)
+            step_idx = np.arange(r0, r0 + n_rows)
+            time = step_idx * step / np.sqrt(t)
+            noise = rng.normal(scale=0.01, size=(n_rows, 3))
+            # x_i = phi x_i-1 + noise_i, continued from the previous chunk
+            fluct, __ = signal.lfilter([1.], [1., -phi], noise, axis=0,
+                                       zi=phi * state[np.newaxis, :])
+            state = fluct[-1]
+            u, k, pc = (means + fluct).T
+            msd = 6. * 0.1 * t * time + rng.normal(scale=1e-3, size=n_rows)
+            vaf = np.exp(-time) * np.cos(2. * time)
+            sf = 1. + rng.normal(scale=0.05, size=(n_rows, 3))
+            block = np.column_stack((step_idx, np.full(n_rows, rho),
+                                     np.full(n_rows, t), u, k, pc, k / 1.5 * rho,
+                                     msd, vaf, sf))
+            _write_rows(f, block)
+
+
+def write_positions(fname, particles, rho, t, seed=0):
+    """
+    Last snapshot: uniform positions in the box and Maxwell-Boltzmann
+    velocities at temperature t.
+    """
+    rng = np.random.default_rng(seed)
+    length = box_length(particles, rho)
+    with open(fname, "w") as f:
+        f.write("# rx\try\trz\tvx\tvy\tvz\n")
+        for p0 in range(0, particles, CHUNK_ROWS):
+            n_p = min(CHUNK_ROWS, particles - p0)
+            block = np.column_stack((rng.random((n_p, 3)) * length,
+                                     rng.normal(scale=np.sqrt(t),
+                                                size=(n_p, 3))))
+            _write_rows(f, block)
+
+
+def write_xyz(fnames, frames, particles, rho, t, step=0.005, seed=0):
+    """
+    Trajectories of particles doing a random walk in the periodic box,
+    one frame per row.
+    """
+    rng = np.random.default_rng(seed)
+    length = box_length(particles, rho)
+    positions = rng.random((particles, 3)) * length
+    scale = np.sqrt(t) * step
+    # Rows of one frame are particles wide, keep the chunks about the same
+    chunk = max(1, CHUNK_ROWS * 8 // particles)
+    files = [open(fname, "w") for fname in fnames]
+    try:
+        for f0 in range(0, frames, chunk):
+            n_f = min(chunk, frames - f0)
+            steps = rng.normal(scale=scale, size=(n_f, particles, 3))
+            block = np.mod(positions + np.cumsum(steps, axis=0), length)
+            positions = block[-1]
+            for axis, f in enumerate(files):
+                _write_rows(f, block[:, :, axis])
+    finally:
+        for f in files:
+            f.close()
+
+
+def generate_state_point(out_dir, sim_name="", steps=1000, particles=1000,
+                         rho=0.5, t=0.5, n=8, a=0.5, rows=10000, frames=100,
+                         rdf_bins=500, kinds=KINDS, seed=0):
+    """
+    Writes the logs of a single state point.
+
+    @param out_dir: directory of the logs
+    @param sim_name: prefix of the log files
+    @param steps: number of steps, used in the file names
+    @param particles: number of particles
+    @param rho: density
+    @param t: temperature
+    @param n: pair potential strength
+    @param a: softening parameter
+    @param rows: number of rows of the Data log
+    @param frames: number of frames of the x, y, z trajectories
+    @param rdf_bins: number of bins of the RDF
+    @param kinds: files to write, a subset of KINDS
+    @param seed: seed of the random number generator
+    @return: dictionary of kind: path
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {kind: file_name(out_dir, sim_name, kind, steps, particles,
+                             rho, t, n, a) for kind in KINDS}
+    if "RDF" in kinds:
+        write_rdf(paths["RDF"], rho, t, n, rdf_bins, seed=seed)
+    if "Data" in kinds:
+        write_data(paths["Data"], rows, rho, t, seed=seed)
+    if "Positions_Velocities" in kinds:
+        write_positions(paths["Positions_Velocities"], particles, rho, t,
+                        seed=seed)
+    xyz = [k for k in ("x_data", "y_data", "z_data") if k in kinds]
+    if xyz:
+        write_xyz([paths[k] for k in ("x_data", "y_data", "z_data")],
+                  frames, particles, rho, t, seed=seed)
+    return {kind: paths[kind] for kind in kinds}
+
+
+def generate_sweep(out_dir, rho_list, t_list, n_list, a_list, sim_name="",
+                   steps=1000, particles=1000, rdf_bins=500, kinds=("RDF",),
+                   **kwargs):
+    """
+    Writes the logs of every state point of a sweep, by default only the
+    RDFs, which is what the intersection sweeps read.
+
+    @return: list of the written paths
+    """
+    paths = []
+    seed = 0
+    for rho in rho_list:
+        for t in t_list:
+            for n in n_list:
+                for a in a_list:
+                    written = generate_state_point(
+                        out_dir, sim_name, steps, particles, rho, t, n, a,
+                        rdf_bins=rdf_bins, kinds=kinds, seed=seed, **kwargs)
+                    paths.extend(written.values())
+                    seed += 1
+    return paths
+
+
+if __name__ == "__main__":
+    sizes = [int(float(v)) for v in sys.argv[2:5]]
+    generate_state_point(sys.argv[1], **dict(zip(("particles", "rows",
+                                                  "frames"), sizes)))
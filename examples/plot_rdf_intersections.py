@@ -20,16 +20,16 @@ print(os.chdir("simulation_data"))
 # Generating the RDF intersection data
 # ! this generates the RDF Interpolate plot
 rdf_stat = RDFAnalysis(35000, 1000)
-r_iso_dir = "."
-if not os.path.exists(f"{r_iso_dir}/r_iso.dat"):
-    rdf_stat.get_intersections_to_file("", rho, t, n, a, r_iso_dir)
+iso_store = "isosbestic.iso"
+if not os.path.exists(iso_store):
+    rdf_stat.get_intersections_to_store("", rho, t, n, a, iso_store)
 
 
-# Plot the intersection points r_iso vs a
-for temp in t:
-    for density in rho:
-        rdf_stat.plot_intersection(density, temp)
-    az = np.linspace(0, 1, 500)
-    tr = (1 - az**2)**(1./2.)
+# Plot the intersection points r_iso vs a, one figure per temperature
+figures = rdf_stat.plot_intersections(iso_store, rho, t)
+az = np.linspace(0, 1, 500)
+tr = (1 - az**2)**(1./2.)
+for temp in figures:
+    plt.figure(f"r_iso Intersections with T: {temp}")
     plt.plot(az, tr, color='red', linewidth='3')
-    plt.show()
+plt.show()
@@ -1,6 +1,32 @@
-from mdtools.stat_quantities import StatQ, FileNaming
-from mdtools.state_properties import StateProperties
-from mdtools.visualise_fluid import ParticleVisualisation
-from mdtools.isomorphs import Isomorph, iso_surface
-from mdtools.rdf_analysis_tools import RDFAnalysis
-from mdtools.isomorph_plotting import isomorphic_surface_array, plot_all_surfaces, load_figures
+import importlib
+
+# The submodules are only imported when one of their names is first used,
+# so that "import mdtools" does not load matplotlib or scipy
+_SUBMODULE_OF = {
+    "StatQ": "mdtools.stat_quantities",
+    "FileNaming": "mdtools.stat_quantities",
+    "StateProperties": "mdtools.state_properties",
+    "ParticleVisualisation": "mdtools.visualise_fluid",
+    "Isomorph": "mdtools.isomorphs",
+    "iso_surface": "mdtools.isomorphs",
+    "isomorph_grid": "mdtools.isomorphs",
+    "RDFAnalysis": "mdtools.rdf_analysis_tools",
+    "isomorphic_surface_array": "mdtools.isomorph_plotting",
+    "plot_all_surfaces": "mdtools.isomorph_plotting",
+    "load_figures": "mdtools.isomorph_plotting",
+    "render_all_surfaces": "mdtools.isomorph_plotting",
+}
+
+__all__ = list(_SUBMODULE_OF)
+
+
+def __getattr__(name):
+    if name in _SUBMODULE_OF:
+        value = getattr(importlib.import_module(_SUBMODULE_OF[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module 'mdtools' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,60 @@
+import os
+import sys
+import argparse
+
+"""
+Command line entry point, runs the sweep of a JSON specification:
+
+    python -m mdtools sweep.json --workers 8
+
+See mdtools.batch for the format of the specification.
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m mdtools",
+        description="Runs the analyses of a sweep of state points and "
+                    "collects the results into a single JSON file.")
+    parser.add_argument("spec", help="JSON specification of the sweep")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="worker processes, all the cores if < 1 "
+                             "(default), 1 runs in this process")
+    parser.add_argument("--out", default=None,
+                        help="output file, overrides the one of the spec")
+    parser.add_argument("--force", action="store_true",
+                        help="run the tasks that are already up to date too")
+    parser.add_argument("--iso-store", default=None,
+                        help="also append the RDF intersections to this "
+                             "isosbestic store")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only list the tasks of the sweep")
+    args = parser.parse_args(argv)
+
+    # Nothing is drawn, the sweep runs on nodes without a display
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    from mdtools import batch
+
+    spec = batch.load_spec(args.spec)
+    if args.out is not None:
+        spec["output"] = os.path.abspath(args.out)
+
+    if args.dry_run:
+        for task in batch.tasks(spec):
+            print(batch.task_key(task))
+        return 0
+
+    workers = None if args.workers == 1 else args.workers
+    counts = batch.run_sweep(spec, workers, args.force)
+    print(f"{counts['done']} done, {counts['skipped']} up to date, "
+          f"{counts['missing']} without logs, {counts['failed']} failed, "
+          f"results in {spec['output']}", file=sys.stderr)
+    if args.iso_store is not None:
+        exported = batch.export_intersections(spec["output"], args.iso_store)
+        print(f"{exported} intersections appended to {args.iso_store}",
+              file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import importlib
+
+"""
+Deferred imports of the heavy dependencies (matplotlib, scipy).
+
+lazy_import returns a stand-in for a module, which imports the real module
+the first time one of its attributes is used. Modules that only plot in
+some of their methods can therefore be imported without pulling in
+matplotlib and its backends.
+"""
+
+
+class LazyModule(object):
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    @param name: full name of the module, e.g. "matplotlib.pyplot"
+    @return: a LazyModule standing in for the module
+    """
+    return LazyModule(name)
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from mdtools.stat_quantities import FileNaming, StatQ
+from mdtools.state_properties import StateProperties
+
+"""
+The analyses of a single state point, without any plotting.
+
+Every analysis reads the logs of a run and returns a dictionary of numpy
+arrays and numbers. They never touch matplotlib and only take plain,
+picklable arguments, so they can run in worker processes, e.g. behind the
+GUI or in a batch, while the results are drawn or saved elsewhere. The
+logs are read by the compute halves of the StatQ and StateProperties
+methods, and the results drawn by their draw_* halves.
+
+    run_analysis("msd", 10000, 1000, "", 0.5, 0.5, 8, 0.5, data_dir="runs")
+"""
+
+
+class RunFiles(FileNaming):
+    """
+    Paths of the logs of a run inside a data directory.
+    """
+
+    def __init__(self, steps, particles, sim_name="", data_dir="."):
+        super().__init__(steps, particles)
+        self.sim_name = sim_name
+        self.data_dir = data_dir
+        self.step = 0.005
+
+    @property
+    def prefix(self):
+        """
+        sim_name of the StatQ methods: log_file prefixes the filenames
+        with it, so it also carries the data directory
+        """
+        return os.path.join(self.data_dir, self.sim_name)
+
+    def path(self, kind, rho, t, n=None, a=None):
+        return os.path.join(self.data_dir,
+                            self.log_file(self.sim_name, kind, rho, t, n, a))
+
+
+def energies(run, rho, t, n=None, a=None):
+    time, u, k, total = StateProperties(run.steps_str, run.p_str).energy_data(
+        run.prefix, rho, t, n, a)
+    return {"time": time, "U": np.asarray(u), "K": np.asarray(k),
+            "U+K": total}
+
+
+def pc(run, rho, t, n=None, a=None):
+    time, pc_data = StateProperties(run.steps_str, run.p_str).pc_data(
+        run.prefix, rho, t, n, a)
+    return {"time": time, "Pc": np.asarray(pc_data)}
+
+
+def rdf(run, rho, t, n=None, a=None):
+    r, g = StatQ(run.steps_str, run.p_str).rdf(run.prefix, rho, t, n, a)
+    return {"r": np.asarray(r), "g": np.asarray(g)}
+
+
+def msd(run, rho, t, n=None, a=None):
+    time, msd_data, grad, intercept, std = StatQ(
+        run.steps_str, run.p_str).msd_data(run.prefix, rho, t, n, a)
+    return {"time": time, "msd": np.asarray(msd_data), "D": grad,
+            "D_err": std, "intercept": intercept}
+
+
+def vaf(run, rho, t, n=None, a=None):
+    time, cr = StatQ(run.steps_str, run.p_str).vaf_data(run.prefix, rho, t,
+                                                        n, a)
+    return {"time": time, "cr": np.asarray(cr)}
+
+
+def vel_dist(run, rho, t, n=None, a=None, bins=150):
+    dist = StatQ(run.steps_str, run.p_str).vel_dist_data(run.prefix, rho, t,
+                                                         n, a, bins)
+    return {"component_edges": dist.component_edges,
+            "speed_edges": dist.speed_edges, "density": dist.density(),
+            "scale": dist.scale, "kl": dist.kl_divergence()}
+
+
+def diffusion(run, rho, t, n=None, a=None, a_list=()):
+    """
+    Diffusion coefficients of the runs with every A of a_list, from
+    streamed fits of their MSD, see StatQ.msd_fit. The argument a is
+    ignored.
+    """
+    a_values = np.asarray(a_list, dtype=np.float64)
+    coef, err = np.empty(len(a_values)), np.empty(len(a_values))
+    quantities = StatQ(run.steps_str, run.p_str)
+    for i, a_i in enumerate(a_values):
+        coef[i], __, err[i] = quantities.msd_fit(run.prefix, rho, t, n, a_i)
+    return {"a": a_values, "D": coef, "D_err": err}
+
+
+# name: (function, kind of the log it reads)
+ANALYSES = {
+    "energies": (energies, "Data"),
+    "pc": (pc, "Data"),
+    "rdf": (rdf, "RDF"),
+    "msd": (msd, "Data"),
+    "vaf": (vaf, "Data"),
+    "vel_dist": (vel_dist, "Positions_Velocities"),
+    "diffusion": (diffusion, "Data"),
+}
+
+
+def _analysis(name):
+    try:
+        return ANALYSES[name]
+    except KeyError:
+        raise ValueError(f"Unknown analysis {name}, "
+                         f"use one of {list(ANALYSES)}") from None
+
+
+def source_files(name, steps, particles, sim_name, rho, t, n=None, a=None,
+                 data_dir=".", **options):
+    """
+    @return: the paths of the logs an analysis reads
+    """
+    __, kind = _analysis(name)
+    run = RunFiles(steps, particles, sim_name, data_dir)
+    a_values = options["a_list"] if "a_list" in options else [a]
+    return [run.path(kind, rho, t, n, a_i) for a_i in a_values]
+
+
+def run_analysis(name, steps, particles, sim_name, rho, t, n=None, a=None,
+                 data_dir=".", **options):
+    """
+    Runs an analysis of a state point.
+
+    @param name: one of ANALYSES
+    @param steps: number of steps of the run
+    @param particles: number of particles of the run
+    @param sim_name: simulation name used as the prefix in the log files
+    @param rho: density
+    @param t: temperature
+    @param n: pair potential strength
+    @param a: softening parameter
+    @param data_dir: directory of the logs
+    @param options: keyword arguments of the analysis, e.g. a_list
+    @return: dictionary of numpy.arrays and numbers
+    """
+    func, __ = _analysis(name)
+    return func(RunFiles(steps, particles, sim_name, data_dir),
+                rho, t, n, a, **options)
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from mdtools.analyses import RunFiles
+from mdtools.log_stream import iter_chunks, stream_linregress, CHUNK_ROWS
+from mdtools.error_analysis import BlockingAccumulator
+
+"""
+Declarative sweeps of analyses, run headless over a pool of processes.
+
+A sweep is described by a JSON specification:
+
+    {
+        "data_dir": "simulation_data",
+        "sim_names": ["", "bip_"],
+        "steps": 35000,
+        "particles": 1000,
+        "rho": [0.2, 0.3, 0.5],
+        "t": [0.5, 1.0],
+        "n": [8, 10, 12],
+        "a": [0.0, 0.25, 0.5],
+        "analyses": ["rdf_intersections", "diffusion", "energies", "pc"],
+        "options": {"rdf_intersections": {"r_lower": 100}},
+        "output": "sweep_results.json"
+    }
+
+n and a may be omitted, or null, for potentials without them. Relative
+paths are resolved against the directory of the specification.
+
+Every analysis of every state point is a task. The RDF intersections are
+sought across all the n of the sweep, so they have one task per
+(sim_name, rho, T, A), the other analyses one per (sim_name, rho, T, n, A).
+The results of all the tasks go into a single JSON output file, together
+with the size and modification time of the logs they were computed from.
+When the sweep runs again, the tasks whose logs and options are unchanged
+are skipped, so extending a grid only computes the new state points.
+
+    python -m mdtools sweep.json --workers 8
+"""
+
+
+def averages(fname, usecols, names, with_sum=False, chunk_rows=CHUNK_ROWS):
+    """
+    Means of columns of a log, with errors from a blocking analysis,
+    streamed in chunks.
+
+    @param fname: path to the log file
+    @param usecols: columns to average
+    @param names: names of the columns in the result
+    @param with_sum: also average the sum of the first two columns
+    @param chunk_rows: maximum number of rows held in memory
+    @return: dictionary of {"mean": ..., "error": ...} per name
+    """
+    acc = BlockingAccumulator()
+    for chunk in iter_chunks(fname, usecols, chunk_rows):
+        if with_sum:
+            chunk = np.column_stack((chunk, chunk[:, 0] + chunk[:, 1]))
+        acc.update(chunk)
+    result = acc.result()
+    return {name: {"mean": float(result.mean[i]),
+                   "error": float(result.error[i])}
+            for i, name in enumerate(names)}
+
+
+def energies(run, rho, t, n=None, a=None, chunk_rows=CHUNK_ROWS):
+    return averages(run.path("Data", rho, t, n, a), (3, 4), ("U", "K", "U+K"),
+                    with_sum=True, chunk_rows=chunk_rows)
+
+
+def pc(run, rho, t, n=None, a=None, chunk_rows=CHUNK_ROWS):
+    return averages(run.path("Data", rho, t, n, a), (5,), ("Pc",),
+                    chunk_rows=chunk_rows)
+
+
+def diffusion(run, rho, t, n=None, a=None, chunk_rows=CHUNK_ROWS):
+    grad, intercept, rms, p_val, std = stream_linregress(
+        run.path("Data", rho, t, n, a), 7, dx=run.step / np.sqrt(t),
+        chunk_rows=chunk_rows)
+    return {"D": float(grad), "D_err": float(std),
+            "intercept": float(intercept)}
+
+
+def rdf_intersections(run, rho, t, n_list, a=None, r_lower=100, r_higher=-1,
+                      range_refinement=2000, intersections=1):
+    """
+    Isosbestic points of the RDFs of all the n, see
+    RDFAnalysis.rdf_intersect.
+    """
+    from mdtools.rdf_analysis_tools import RDFAnalysis
+
+    analysis = RDFAnalysis(run.steps_str, run.p_str)
+    r_iso, g_iso = analysis.rdf_intersect(
+        run.prefix, rho, t, n_list, a, range_refinement, r_lower, r_higher,
+        intersections, plot=False)
+    return {"r_iso": [float(v) for v in r_iso],
+            "g_iso": [float(v) for v in g_iso]}
+
+
+# name: (function, kind of the log it reads, sought across all the n)
+BATCH_ANALYSES = {
+    "energies": (energies, "Data", False),
+    "pc": (pc, "Data", False),
+    "diffusion": (diffusion, "Data", False),
+    "rdf_intersections": (rdf_intersections, "RDF", True),
+}
+
+
+def load_spec(fname):
+    """
+    Reads and checks a sweep specification.
+
+    @param fname: path to the JSON specification
+    @return: dictionary, with the paths made absolute and the optional
+             entries filled in
+    """
+    with open(fname, "r") as f:
+        spec = json.load(f)
+
+    missing = [k for k in ("steps", "particles", "rho", "t", "analyses")
+               if k not in spec]
+    if missing:
+        raise ValueError(f"{fname}: missing entries {missing}")
+    unknown = [name for name in spec["analyses"] if name not in BATCH_ANALYSES]
+    if unknown:
+        raise ValueError(f"{fname}: unknown analyses {unknown}, "
+                         f"use some of {list(BATCH_ANALYSES)}")
+
+    base = os.path.dirname(os.path.abspath(fname))
+    spec["data_dir"] = os.path.join(base, spec.get("data_dir", "."))
+    spec["output"] = os.path.join(base, spec.get("output",
+                                                 "sweep_results.json"))
+    spec.setdefault("sim_names", [""])
+    spec.setdefault("options", {})
+    for par in ("rho", "t", "n", "a"):
+        values = spec.get(par)
+        if values is None or isinstance(values, (int, float)):
+            values = [values]
+        spec[par] = values
+    return spec
+
+
+def tasks(spec):
+    """
+    @param spec: specification returned by load_spec
+    @return: list of the task dictionaries of the sweep
+    """
+    out = []
+    for name in spec["analyses"]:
+        __, __, across_n = BATCH_ANALYSES[name]
+        options = spec["options"].get(name, {})
+        n_values = [spec["n"]] if across_n else spec["n"]
+        for sim_name, rho, t, n, a in itertools.product(
+                spec["sim_names"], spec["rho"], spec["t"], n_values,
+                spec["a"]):
+            out.append({"analysis": name, "sim_name": sim_name,
+                        "steps": spec["steps"],
+                        "particles": spec["particles"],
+                        "rho": rho, "t": t, "n": n, "a": a,
+                        "options": options})
+    return out
+
+
+def task_key(task):
+    """
+    @return: string identifying the task in the output file
+    """
+    return json.dumps([task[k] for k in ("analysis", "sim_name", "steps",
+                                         "particles", "rho", "t", "n", "a",
+                                         "options")], sort_keys=True)
+
+
+def _run_files(task, data_dir):
+    return RunFiles(task["steps"], task["particles"], task["sim_name"],
+                    data_dir)
+
+
+def sources(task, data_dir):
+    """
+    @return: the paths of the logs a task reads
+    """
+    __, kind, across_n = BATCH_ANALYSES[task["analysis"]]
+    run = _run_files(task, data_dir)
+    n_values = task["n"] if across_n else [task["n"]]
+    return [run.path(kind, task["rho"], task["t"], n, task["a"])
+            for n in n_values]
+
+
+def signatures(fnames, data_dir):
+    """
+    @return: [path relative to data_dir, mtime in ns, size] of every file,
+             None if one of them does not exist
+    """
+    out = []
+    for fname in fnames:
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        out.append([os.path.relpath(fname, data_dir), st.st_mtime_ns,
+                    st.st_size])
+    return out
+
+
+def run_task(task, data_dir):
+    """
+    Runs a task, in a worker process.
+
+    @return: the result of the analysis, with numbers and lists only
+    """
+    func, __, __ = BATCH_ANALYSES[task["analysis"]]
+    return func(_run_files(task, data_dir), task["rho"], task["t"],
+                task["n"], task["a"], **task["options"])
+
+
+def load_results(fname):
+    """
+    @return: the records of an output file, keyed by task_key,
+             empty if it does not exist
+    """
+    if not os.path.exists(fname):
+        return {}
+    with open(fname, "r") as f:
+        records = json.load(f)["results"]
+    return {task_key(record): record for record in records}
+
+
+def export_intersections(fname, store):
+    """
+    Appends the RDF intersections of an output file to an IsoStore.
+
+    @param fname: output file of a sweep
+    @param store: path to the store, created if it does not exist
+    @return: the number of state points exported
+    """
+    from mdtools.iso_store import IsoStore
+
+    records = [r for r in load_results(fname).values()
+               if r["analysis"] == "rdf_intersections"]
+    return IsoStore(store).extend(
+        (r["rho"], r["t"], r["a"], r["n"], r["result"]["r_iso"],
+         r["result"]["g_iso"]) for r in records)
+
+
+def save_results(fname, spec, records):
+    tmp_file = f"{fname}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump({"spec": spec, "results": list(records.values())}, f,
+                  indent=1)
+    os.replace(tmp_file, fname)
+
+
+def run_sweep(spec, workers=0, force=False, log=sys.stderr):
+    """
+    Runs the tasks of a sweep that are not up to date in its output file.
+    The output is rewritten at the end, and also if the sweep is
+    interrupted, with the tasks finished so far.
+
+    @param spec: specification returned by load_spec
+    @param workers: number of worker processes, all the cores if < 1.
+                    If None the tasks run one at a time in this process
+    @param force: run every task, even if its result is up to date
+    @param log: stream of the progress messages, None for silence
+    @return: dictionary with the numbers of "done", "skipped", "missing"
+             and "failed" tasks
+    """
+    def report(message):
+        if log is not None:
+            print(message, file=log, flush=True)
+
+    data_dir = spec["data_dir"]
+    records = load_results(spec["output"])
+    counts = {"done": 0, "skipped": 0, "missing": 0, "failed": 0}
+
+    todo = []
+    for task in tasks(spec):
+        sigs = signatures(sources(task, data_dir), data_dir)
+        if sigs is None:
+            counts["missing"] += 1
+            continue
+        record = records.get(task_key(task))
+        if not force and record is not None and record["sources"] == sigs:
+            counts["skipped"] += 1
+            continue
+        todo.append((task, sigs))
+    report(f"{len(todo)} tasks to run, {counts['skipped']} up to date, "
+           f"{counts['missing']} without logs")
+
+    def finished(task, sigs, result):
+        record = dict(task, sources=sigs, result=result)
+        records[task_key(task)] = record
+        counts["done"] += 1
+
+    # The progress is reported about 20 times over the sweep
+    every = max(1, len(todo) // 20)
+
+    def progress():
+        ended = counts["done"] + counts["failed"]
+        if ended % every == 0 or ended == len(todo):
+            report(f"{ended}/{len(todo)} tasks")
+
+    def failed(task, err):
+        counts["failed"] += 1
+        report(f"{task['analysis']} {task['sim_name']}rho {task['rho']} "
+               f"T {task['t']} n {task['n']} A {task['a']} failed: {err!r}")
+
+    try:
+        if workers is None:
+            for task, sigs in todo:
+                try:
+                    finished(task, sigs, run_task(task, data_dir))
+                except Exception as err:
+                    failed(task, err)
+                progress()
+        elif todo:
+            if workers < 1:
+                workers = os.cpu_count()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            try:
+                futures = {executor.submit(run_task, task, data_dir):
+                           (task, sigs) for task, sigs in todo}
+                for future in as_completed(futures):
+                    task, sigs = futures[future]
+                    try:
+                        finished(task, sigs, future.result())
+                    except Exception as err:
+                        failed(task, err)
+                    progress()
+            finally:
+                # On an interrupt, the queued tasks are dropped
+                executor.shutdown(cancel_futures=True)
+    finally:
+        save_results(spec["output"], spec, records)
+    return counts
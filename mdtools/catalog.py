@@ -0,0 +1,267 @@
+import os
+import re
+import json
+import bisect
+import hashlib
+
+"""
+Index of the simulation output files of a directory tree.
+
+Every log written by the simulation encodes its parameters in the filename,
+see FileNaming.file_searcher. The catalog parses the filenames back into
+(sim_name, steps, particles, rho, T, n, A), so that the available state
+points can be queried without guessing filenames or changing directory.
+"""
+
+CATALOG_FILE = ".mdtools_catalog.json"
+KINDS = ("RDF", "Data", "Positions_Velocities", "x_data", "y_data", "z_data")
+
+FILE_PATTERN = re.compile(
+    r"^(?P<sim_name>.*?)(?P<kind>" + "|".join(KINDS) + r")"
+    r"_step_(?P<steps>\d+)_particles_(?P<particles>\d+)"
+    r"_rho_(?P<rho>-?\d+\.\d+)_T_(?P<t>-?\d+\.\d+)"
+    r"(?:_n_(?P<n>-?\d+\.\d+))?(?:_A_(?P<a>-?\d+\.\d+))?\.log$")
+
+
+def _fmt(value, fmt):
+    return None if value is None else fmt.format(value)
+
+
+def _key(sim_name, kind, steps, particles, rho, t, n=None, a=None):
+    """
+    Lookup key, with the floats formatted exactly like FileNaming does.
+    """
+    return (sim_name, kind, int(steps), int(particles),
+            _fmt(rho, "{:.4f}"), _fmt(t, "{:.4f}"),
+            _fmt(n, "{:.2f}"), _fmt(a, "{:.5f}"))
+
+
+def _names_digest(names):
+    """
+    @return: digest of the sorted names of a directory, without the hidden
+             ones
+    """
+    visible = sorted(name for name in names if not name.startswith("."))
+    return hashlib.sha1("\n".join(visible).encode()).hexdigest()
+
+
+def parse_filename(fname):
+    """
+    Parses the parameters of a simulation log out of its filename.
+
+    @param fname: name of the log file, with or without directories
+    @return: dictionary with the parameters or None if the name
+             does not follow the naming scheme of the simulation
+    """
+    match = FILE_PATTERN.match(os.path.basename(fname))
+    if match is None:
+        return None
+    entry = match.groupdict()
+    entry["steps"] = int(entry["steps"])
+    entry["particles"] = int(entry["particles"])
+    for par in ("rho", "t", "n", "a"):
+        if entry[par] is not None:
+            entry[par] = float(entry[par])
+    return entry
+
+
+class RunCatalog(object):
+    """
+    Catalog of the simulation files found under a root directory.
+    The entries are kept sorted on (rho, T, n, A), so range queries on
+    the density are resolved with a binary search.
+    """
+
+    def __init__(self, root, entries=()):
+        self.root = os.path.abspath(root)
+        self.entries = []
+        self._rho = []
+        self._lookup = {}
+        # Directories walked by scan, relative to root: [mtime, names digest]
+        self.dirs = {}
+        self._set_entries(entries)
+
+    def _set_entries(self, entries):
+        def order(e):
+            return (e["rho"], e["t"],
+                    -1. if e["n"] is None else e["n"],
+                    -1. if e["a"] is None else e["a"],
+                    e["sim_name"], e["kind"], e["path"])
+
+        self.entries = sorted(entries, key=order)
+        self._rho = [e["rho"] for e in self.entries]
+        self._lookup = {}
+        for e in self.entries:
+            key = _key(e["sim_name"], e["kind"], e["steps"], e["particles"],
+                       e["rho"], e["t"], e["n"], e["a"])
+            self._lookup[key] = e
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def index_file(self):
+        return os.path.join(self.root, CATALOG_FILE)
+
+    def scan(self):
+        """
+        Walks the directory tree and indexes every simulation log found.
+
+        @return: self
+        """
+        entries = []
+        self.dirs = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            # Skip the hidden cache directories
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+            self.dirs[os.path.relpath(dirpath, self.root)] = [
+                os.stat(dirpath).st_mtime_ns,
+                _names_digest(dirnames + filenames)]
+            for fname in filenames:
+                entry = parse_filename(fname)
+                if entry is None:
+                    continue
+                entry["path"] = os.path.relpath(
+                    os.path.join(dirpath, fname), self.root)
+                entries.append(entry)
+        self._set_entries(entries)
+        return self
+
+    def save(self):
+        """
+        Writes the index into the root directory.
+        """
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump({"root": self.root, "dirs": self.dirs,
+                       "entries": self.entries}, f)
+        os.replace(tmp_file, self.index_file)
+
+    def is_stale(self):
+        """
+        A file added, renamed or deleted in a directory of the tree changes
+        the mtime of that directory, and a new subdirectory that of its
+        parent. Only the directories whose mtime differs from the one of
+        the scan are listed again, and the index is stale if the names in
+        one of them changed (hidden files, like the index itself, are
+        ignored) or if one of them is missing.
+
+        @return: True if the index may miss files or list files that are
+                 not there anymore
+        """
+        for rel, (mtime, digest) in self.dirs.items():
+            path = os.path.join(self.root, rel)
+            try:
+                if os.stat(path).st_mtime_ns == mtime:
+                    continue
+                if _names_digest(os.listdir(path)) != digest:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    @classmethod
+    def load(cls, root, rescan=False):
+        """
+        Loads the persisted index of a directory. The directory is scanned,
+        and the index saved, if there is no index yet or if it is stale.
+
+        @param root: root directory of the simulation data
+        @param rescan: ignore the persisted index and scan again
+        @return: RunCatalog
+        """
+        catalog = cls(root)
+        if not rescan and os.path.exists(catalog.index_file):
+            with open(catalog.index_file, "r") as f:
+                saved = json.load(f)
+            # Indexes written without the directories are always rescanned
+            catalog.dirs = saved.get("dirs", {})
+            if catalog.dirs and not catalog.is_stale():
+                catalog._set_entries(saved["entries"])
+                return catalog
+        catalog.scan()
+        try:
+            catalog.save()
+        except OSError:
+            pass
+        return catalog
+
+    def path(self, entry):
+        return os.path.join(self.root, entry["path"])
+
+    def find(self, sim_name, kind, steps, particles, rho, t, n=None, a=None):
+        """
+        Exact lookup of a single file.
+
+        @return: absolute path of the file or None if it is not indexed
+        """
+        entry = self._lookup.get(
+            _key(sim_name, kind, steps, particles, rho, t, n, a))
+        return None if entry is None else self.path(entry)
+
+    def has_state_point(self, sim_name, steps, particles, rho, t, n_list, a=None,
+                        kind="RDF"):
+        """
+        @return: True if a file exists for every n in n_list at (rho, T, A)
+        """
+        return all(self.find(sim_name, kind, steps, particles, rho, t, n, a)
+                   is not None for n in n_list)
+
+    def query(self, kind=None, sim_name=None, steps=None, particles=None,
+              rho=None, t=None, n=None, a=None):
+        """
+        Finds all the files matching the given parameters.
+        The continuous parameters (rho, t, n, a) accept either a single
+        value or an inclusive (low, high) range. Only rho is resolved with
+        a binary search, the other parameters are then checked one entry at
+        a time over the files in the rho range, so a query without rho is
+        linear in the size of the catalog.
+
+        @return: list of the matching entries, sorted by (rho, T, n, A)
+        """
+        lo, hi = 0, len(self.entries)
+        if rho is not None:
+            rho_lo, rho_hi = rho if isinstance(rho, (tuple, list)) else (rho, rho)
+            lo = bisect.bisect_left(self._rho, rho_lo - 1e-9)
+            hi = bisect.bisect_right(self._rho, rho_hi + 1e-9)
+
+        def within(value, bounds):
+            if bounds is None:
+                return True
+            if value is None:
+                return False
+            low, high = bounds if isinstance(bounds, (tuple, list)) \
+                else (bounds, bounds)
+            return low - 1e-9 <= value <= high + 1e-9
+
+        matches = []
+        for e in self.entries[lo:hi]:
+            if (kind is None or e["kind"] == kind) and \
+                    (sim_name is None or e["sim_name"] == sim_name) and \
+                    (steps is None or e["steps"] == int(steps)) and \
+                    (particles is None or e["particles"] == int(particles)) and \
+                    within(e["t"], t) and within(e["n"], n) and within(e["a"], a):
+                matches.append(e)
+        return matches
+
+    def state_points(self, sim_name, steps, particles, kind="RDF", n_list=None):
+        """
+        The (rho, T, A) state points for which files exist.
+
+        @param sim_name: simulation name used as the prefix in the log files
+        @param steps: number of steps of the runs
+        @param particles: number of particles of the runs
+        @param kind: type of log that has to exist
+        @param n_list: if given, only the state points that have a file
+                       for every n in the list are returned
+        @return: sorted list of (rho, T, A) tuples
+        """
+        found = {}
+        for e in self.query(kind, sim_name, steps, particles):
+            found.setdefault((e["rho"], e["t"], e["a"]), set()).add(
+                _fmt(e["n"], "{:.2f}"))
+        if n_list is not None:
+            required = {_fmt(n, "{:.2f}") for n in n_list}
+            found = {k: v for k, v in found.items() if required <= v}
+        return sorted(found, key=lambda k: (k[0], k[1],
+                                            -1. if k[2] is None else k[2]))
@@ -0,0 +1,237 @@
+import itertools
+import numpy as np
+
+"""
+Periodic neighbour search with a cell list.
+
+The cubic box is divided into cells with a side of at least r_cut, so that
+every pair closer than r_cut is found by looking into the same cell and its
+26 neighbours. Each cell is only paired with half of its neighbours, so
+that every pair is visited once, and the cells are processed in blocks,
+which bounds the memory used for the candidate pairs. The cost of a search
+is O(N) for a fixed density.
+"""
+
+# Half of the 26 neighbouring cells; with the cell itself this covers each
+# pair of adjacent cells exactly once
+HALF_SHELL = [o for o in itertools.product((-1, 0, 1), repeat=3)
+              if o > (0, 0, 0)]
+
+# Maximum number of candidate pairs held in memory at once
+MAX_PAIRS = 1 << 22
+
+
+def minimum_image(d, box_length):
+    """
+    @param d: array of separation vectors (or components)
+    @param box_length: length of the periodic box
+    @return: the separations of the closest periodic images
+    """
+    return d - box_length * np.round(d / box_length)
+
+
+class CellList(object):
+
+    def __init__(self, positions, box_length, r_cut):
+        """
+        @param positions: (N, 3) array of particle positions
+        @param box_length: length of the periodic cubic box
+        @param r_cut: largest separation that will be searched for
+        """
+        self.box_length = float(box_length)
+        self.r_cut = float(r_cut)
+        self.positions = np.mod(np.asarray(positions, dtype=np.float64),
+                                self.box_length)
+        self.n_cells = max(int(self.box_length // self.r_cut), 1)
+
+        cell_size = self.box_length / self.n_cells
+        idx3 = np.floor(self.positions / cell_size).astype(np.int64)
+        idx3 %= self.n_cells  # positions == box_length after rounding
+        nc = self.n_cells
+        self.cell_of = (idx3[:, 0] * nc + idx3[:, 1]) * nc + idx3[:, 2]
+
+        # Padded (cells, max occupancy) table of the particle indices
+        order = np.argsort(self.cell_of, kind='stable')
+        counts = np.bincount(self.cell_of, minlength=nc ** 3)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        rank = np.arange(len(order)) - starts[self.cell_of[order]]
+        self.cells = np.full((nc ** 3, max(int(counts.max(initial=0)), 1)), -1,
+                             dtype=np.int64)
+        self.cells[self.cell_of[order], rank] = order
+
+    def _neighbour_cells(self, cell_ids, offset):
+        nc = self.n_cells
+        ix, rem = np.divmod(cell_ids, nc * nc)
+        iy, iz = np.divmod(rem, nc)
+        ix = (ix + offset[0]) % nc
+        iy = (iy + offset[1]) % nc
+        iz = (iz + offset[2]) % nc
+        return (ix * nc + iy) * nc + iz
+
+    def pairs(self, max_pairs=MAX_PAIRS):
+        """
+        Yields every pair of particles closer than r_cut exactly once.
+
+        @param max_pairs: bound on the number of candidate pairs
+                          evaluated at once
+        @return: generator of (i, j, distance) arrays
+        """
+        if self.n_cells < 3:
+            # Too few cells for the half shell to be unique
+            yield from self._all_pairs(max_pairs)
+            return
+
+        n_total, occupancy = self.cells.shape
+        block = max(max_pairs // (occupancy * occupancy), 1)
+        for c0 in range(0, n_total, block):
+            cell_ids = np.arange(c0, min(c0 + block, n_total))
+            own = self.cells[cell_ids]
+            for offset in [(0, 0, 0)] + HALF_SHELL:
+                if offset == (0, 0, 0):
+                    other = own
+                else:
+                    other = self.cells[self._neighbour_cells(cell_ids, offset)]
+                i = np.broadcast_to(own[:, :, np.newaxis], own.shape + (occupancy,))
+                j = np.broadcast_to(other[:, np.newaxis, :], i.shape)
+                mask = (i >= 0) & (j >= 0)
+                if offset == (0, 0, 0):
+                    mask &= i < j
+                yield from self._within_cut(i[mask], j[mask])
+
+    def _all_pairs(self, max_pairs):
+        n = len(self.positions)
+        rows = max(max_pairs // max(n, 1), 1)
+        for i0 in range(0, n, rows):
+            i, j = np.meshgrid(np.arange(i0, min(i0 + rows, n)), np.arange(n),
+                               indexing='ij')
+            mask = i < j
+            yield from self._within_cut(i[mask], j[mask])
+
+    def _within_cut(self, i, j):
+        if len(i) == 0:
+            return
+        d = minimum_image(self.positions[j] - self.positions[i], self.box_length)
+        dist = np.sqrt(np.einsum('ij,ij->i', d, d))
+        close = dist < self.r_cut
+        yield i[close], j[close], dist[close]
+
+
+def compute_rdf(positions, box_length, r_max, dr=0.01, max_pairs=MAX_PAIRS):
+    """
+    Radial distribution function of one or many snapshots
+    of a periodic fluid.
+
+    @param positions: (N, 3) array, or (frames, N, 3) array (or Trajectory)
+                      with the particle positions
+    @param box_length: length of the periodic cubic box
+    @param r_max: largest distance of the RDF, at most half the box length
+    @param dr: width of the histogram bins
+    @param max_pairs: bound on the number of candidate pairs
+                      evaluated at once
+    @return: the bin centres r and g(r), averaged over the frames
+    """
+    if r_max > box_length / 2.:
+        raise ValueError(f"r_max = {r_max} is larger than half the "
+                         f"box length {box_length / 2.}")
+    # Trajectory objects are indexed lazily, do not convert them to arrays
+    if len(getattr(positions, "shape", np.shape(positions))) == 2:
+        positions = np.asarray(positions)[np.newaxis]
+
+    n_bins = int(r_max / dr + 1e-9)
+    hist = np.zeros(n_bins, dtype=np.int64)
+    n_frames = len(positions)
+    n_particles = positions[0].shape[0]
+    for frame in range(n_frames):
+        cells = CellList(positions[frame], box_length, n_bins * dr)
+        for __, __, dist in cells.pairs(max_pairs):
+            hist += np.bincount((dist / dr).astype(np.int64),
+                                minlength=n_bins)[:n_bins]
+
+    edges = np.arange(n_bins + 1) * dr
+    shell = 4. / 3. * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+    density = n_particles / box_length ** 3
+    # Every pair is counted once, hence the factor of 2
+    g = 2. * hist / (n_frames * n_particles * density * shell)
+    return 0.5 * (edges[1:] + edges[:-1]), g
+
+
+class NeighbourTracker(object):
+    """
+    Nearest neighbour distance and coordination number of every particle,
+    followed along a trajectory with a Verlet list.
+
+    The list holds every pair closer than r_cut + skin and is built with a
+    CellList. While no particle has moved more than skin / 2 since the last
+    build, every pair closer than r_cut is guaranteed to be in the list,
+    so a new frame only needs the distances of the listed pairs.
+    """
+
+    def __init__(self, box_length, r_cut=1.5, skin=0.3, max_pairs=MAX_PAIRS):
+        """
+        @param box_length: length of the periodic cubic box
+        @param r_cut: radius of the coordination shell, nearest neighbour
+                      distances are exact up to r_cut
+        @param skin: extra radius of the list, a larger skin means fewer
+                     rebuilds but more pairs per frame
+        @param max_pairs: bound on the number of candidate pairs
+                          evaluated at once when building the list
+        """
+        self.box_length = float(box_length)
+        self.r_cut = float(r_cut)
+        self.skin = float(skin)
+        self.max_pairs = max_pairs
+        self.reference = None  # Positions at the last build
+        self.rebuilds = 0
+        self._i, self._j = None, None
+        self._order, self._starts, self._owners = None, None, None
+        self._pair_owner = None
+
+    def _build(self, positions):
+        cells = CellList(positions, self.box_length, self.r_cut + self.skin)
+        found = list(cells.pairs(self.max_pairs))
+        if found:
+            self._i = np.concatenate([i for i, __, __ in found])
+            self._j = np.concatenate([j for __, j, __ in found])
+        else:
+            self._i = self._j = np.empty(0, dtype=np.int64)
+
+        # Every pair appears once for i and once for j; sort the two halves
+        # by particle once, so that each frame is a single reduceat
+        owners = np.concatenate((self._i, self._j))
+        self._pair_owner = owners
+        self._order = np.argsort(owners, kind='stable')
+        self._owners, self._starts = np.unique(owners[self._order],
+                                               return_index=True)
+        self.reference = positions.copy()
+        self.rebuilds += 1
+
+    def needs_rebuild(self, positions):
+        if self.reference is None or positions.shape != self.reference.shape:
+            return True
+        d = minimum_image(positions - self.reference, self.box_length)
+        max_sq = np.einsum('ij,ij->i', d, d).max(initial=0.)
+        return max_sq > (0.5 * self.skin) ** 2
+
+    def update(self, positions):
+        """
+        @param positions: (N, 3) array with the positions of a frame
+        @return: (N,) array of the nearest neighbour distances, inf for the
+                 particles without a neighbour within the list radius, and
+                 (N,) array of the number of neighbours closer than r_cut
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        if self.needs_rebuild(positions):
+            self._build(positions)
+        n = len(positions)
+
+        d = minimum_image(positions[self._j] - positions[self._i],
+                          self.box_length)
+        dist = np.sqrt(np.einsum('ij,ij->i', d, d))
+        both = np.concatenate((dist, dist))[self._order]
+
+        nearest = np.full(n, np.inf)
+        if len(both):
+            nearest[self._owners] = np.minimum.reduceat(both, self._starts)
+        within = np.concatenate((dist, dist)) < self.r_cut
+        coordination = np.bincount(self._pair_owner[within], minlength=n)
+        return nearest, coordination
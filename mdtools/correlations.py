@@ -0,0 +1,192 @@
+import tempfile
+import numpy as np
+from mdtools._lazy import lazy_import
+
+"""
+Time correlation functions of the stored trajectories.
+
+Every function averages over all the time origins of the trajectory.
+The correlations are evaluated with FFTs, O(T log T) per particle instead of
+the O(T^2) direct double loop, and the particles are processed in blocks
+so that the memory used is bounded independently of the system size.
+The trajectory stores are written frame by frame, so when they need more
+than one block they are first read once, whole frames at a time, into a
+temporary particle-major copy from which the blocks are contiguous.
+"""
+
+fft = lazy_import("scipy.fft")
+
+# Maximum number of float64 values of a block of particles held in memory
+MAX_BLOCK_VALUES = 1 << 24
+
+
+def _block_size(n_frames, block):
+    if block is not None:
+        return block
+    # 3 components, padded to about 2x the frames as complex numbers
+    return max(1, MAX_BLOCK_VALUES // (32 * n_frames))
+
+
+def _particle_blocks(positions, block):
+    """
+    Iterates over blocks of consecutive particles of a trajectory.
+    In-memory arrays are sliced directly. Other trajectories, e.g. memory
+    maps, are transposed into a temporary file first: slicing a block of
+    particles out of every frame would read the pages of the whole file
+    once per block.
+
+    @param positions: (frames, particles, 3) array or Trajectory
+    @param block: number of particles of a block
+    @return: generator of (frames, block, 3) float64 arrays
+    """
+    n_frames, n_particles = positions.shape[0], positions.shape[1]
+    in_memory = isinstance(positions, np.ndarray) \
+        and not isinstance(positions, np.memmap)
+    if in_memory or block >= n_particles:
+        for p0 in range(0, n_particles, block):
+            yield np.asarray(positions[:, p0:p0 + block, :], dtype=np.float64)
+        return
+
+    chunk_frames = max(1, MAX_BLOCK_VALUES // (3 * n_particles))
+    with tempfile.TemporaryFile() as f:
+        copy = None
+        for f0 in range(0, n_frames, chunk_frames):
+            chunk = np.asarray(positions[f0:f0 + chunk_frames])
+            if copy is None:
+                copy = np.memmap(f, dtype=chunk.dtype, mode="w+",
+                                 shape=(n_particles, n_frames, 3))
+            copy[:, f0:f0 + len(chunk)] = chunk.transpose(1, 0, 2)
+        for p0 in range(0, n_particles, block):
+            yield np.asarray(copy[p0:p0 + block],
+                             dtype=np.float64).transpose(1, 0, 2)
+        del copy
+
+
+def unwrap(positions, box_length):
+    """
+    Removes the jumps of the periodic boundary conditions from a
+    trajectory, assuming no particle moves more than half a box between
+    two consecutive frames.
+
+    @param positions: (frames, particles, 3) array of wrapped positions
+    @param box_length: length of the periodic box
+    @return: (frames, particles, 3) array of continuous positions
+    """
+    steps = np.diff(positions, axis=0)
+    steps -= box_length * np.round(steps / box_length)
+    unwrapped = np.empty_like(positions, dtype=np.float64)
+    unwrapped[0] = positions[0]
+    np.cumsum(steps, axis=0, out=unwrapped[1:])
+    unwrapped[1:] += positions[0]
+    return unwrapped
+
+
+def autocorrelation(x, axis=0):
+    """
+    Multi-origin autocorrelation, <x(t0) x(t0 + t)> averaged over every
+    available origin t0, computed with a zero padded FFT.
+
+    @param x: array with time along the given axis
+    @param axis: the time axis
+    @return: array of the same shape as x, holding the lags 0..T-1
+    """
+    n = x.shape[axis]
+    n_fft = fft.next_fast_len(2 * n - 1, real=True)
+    # The transforms are spread over all the cores
+    spec = fft.rfft(x, n=n_fft, axis=axis, workers=-1)
+    acf = fft.irfft(spec * spec.conj(), n=n_fft, axis=axis, workers=-1)
+    acf = np.take(acf, np.arange(n), axis=axis)
+    counts = (n - np.arange(n)).reshape([-1 if i == axis % x.ndim else 1
+                                         for i in range(x.ndim)])
+    return acf / counts
+
+
+def msd_fft(positions, box_length=None, unwrap_pbc=False, block=None,
+            max_lag=None):
+    """
+    Mean square displacement averaged over all the time origins
+    and all the particles, with the FFT algorithm of Kneller et al.:
+    MSD(m) = S1(m) - 2 S2(m), where S2 is the position autocorrelation and
+    S1 is obtained from cumulative sums of the squared positions.
+
+    @param positions: (frames, particles, 3) array or Trajectory
+    @param box_length: length of the periodic box, needed for unwrap_pbc
+    @param unwrap_pbc: unwrap the periodic boundary conditions first
+    @param block: number of particles processed at once
+    @param max_lag: largest lag returned, defaults to all the frames
+    @return: (lags,) array of the MSD for lags 0, 1, 2, ... frames
+    """
+    n_frames, n_particles = positions.shape[0], positions.shape[1]
+    block = _block_size(n_frames, block)
+    msd = np.zeros(n_frames)
+    lags = np.arange(n_frames)
+    for r in _particle_blocks(positions, block):
+        if unwrap_pbc is True:
+            r = unwrap(r, box_length)
+        # Remove the mean position of every particle; MSD is shift invariant
+        # and the FFT is more accurate on centred data
+        r = r - r.mean(axis=0)
+
+        sq = np.einsum('tpd,tpd->tp', r, r)
+        cum = np.concatenate((np.zeros((1, sq.shape[1])),
+                              np.cumsum(sq, axis=0)))
+        # sum_{k=m}^{T-1} sq_k + sum_{k=0}^{T-1-m} sq_k
+        s1 = (cum[-1] - cum[lags]) + cum[n_frames - lags]
+        s1 /= (n_frames - lags)[:, np.newaxis]
+        s2 = autocorrelation(r, axis=0).sum(axis=-1)
+        msd += (s1 - 2. * s2).sum(axis=1)
+
+    msd /= n_particles
+    return msd if max_lag is None else msd[:max_lag + 1]
+
+
+def velocities_from_positions(positions, time_step, box_length=None):
+    """
+    Finite difference velocities of a block of a trajectory,
+    v(t) = (r(t + dt) - r(t)) / dt. With a box length the displacements
+    are taken with the minimum image convention.
+
+    @param positions: (frames, particles, 3) array
+    @param time_step: time between two consecutive frames
+    @param box_length: length of the periodic box
+    @return: (frames - 1, particles, 3) array of velocities
+    """
+    steps = np.diff(np.asarray(positions, dtype=np.float64), axis=0)
+    if box_length is not None:
+        steps -= box_length * np.round(steps / box_length)
+    return steps / time_step
+
+
+def vaf_fft(velocities, block=None, max_lag=None, normalise=True,
+            time_step=None, box_length=None):
+    """
+    Velocity autocorrelation function C(t) = <v(t0) . v(t0 + t)>, averaged
+    over all the time origins, particles and Cartesian components.
+
+    If time_step is given, velocities holds positions instead, and the
+    velocities are obtained from their finite differences one block of
+    particles at a time.
+
+    @param velocities: (frames, particles, 3) array or Trajectory
+    @param block: number of particles processed at once
+    @param max_lag: largest lag returned, defaults to all the frames
+    @param normalise: divide by C(0), so that C(0) = 1
+    @param time_step: time between frames, when positions are passed
+    @param box_length: length of the periodic box, when positions are passed
+    @return: (lags,) array of C(t) for lags 0, 1, 2, ... frames
+    """
+    n_frames, n_particles = velocities.shape[0], velocities.shape[1]
+    if time_step is not None:
+        n_frames -= 1
+    block = _block_size(n_frames, block)
+    cr = np.zeros(n_frames)
+    for v in _particle_blocks(velocities, block):
+        if time_step is not None:
+            v = velocities_from_positions(v, time_step, box_length)
+        # Sum over the particles and components of the block
+        cr += autocorrelation(v, axis=0).sum(axis=(1, 2))
+
+    cr /= n_particles
+    if normalise is True:
+        cr /= cr[0]
+    return cr if max_lag is None else cr[:max_lag + 1]
@@ -0,0 +1,298 @@
+import numpy as np
+from mdtools._lazy import lazy_import
+from mdtools.log_stream import iter_chunks, CHUNK_ROWS
+
+stats = lazy_import("scipy.stats")
+
+"""
+Statistical errors of the averages of correlated time series.
+
+The samples of an MD run are correlated, so the naive standard error of
+the mean, std / sqrt(n), is too small. Two estimators are provided, both
+working on every column of a log at once:
+
+- Blocking (Flyvbjerg & Petersen, J. Chem. Phys. 91, 461 (1989)). The
+  series is split into blocks of 1, 2, 4, ... samples and the variance of
+  the block means gives the error of the mean for every block size. The
+  block size is picked with the automated test of Jonsson, Phys. Rev. E 98,
+  043304 (2018). The block means of every level are differences of a single
+  cumulative sum; for logs larger than the memory BlockingAccumulator
+  builds the same levels chunk by chunk.
+- Moving block bootstrap. Resamples of overlapping blocks keep the short
+  time correlations. The mean of every possible block is again a
+  difference of cumulative sums, so a resample only costs one gather.
+"""
+
+# Maximum number of values gathered at once by the bootstrap
+MAX_BOOT_VALUES = 1 << 22
+
+
+class BlockingResult(object):
+    """
+    Outcome of the blocking analysis of one or more columns.
+
+    mean:        (cols,) average of every column
+    block_sizes: (levels,) number of samples in a block at every level
+    sem:         (levels, cols) standard error of the mean at every level
+    sem_err:     (levels, cols) statistical error of sem
+    level:       (cols,) level picked by the automated test
+    error:       (cols,) standard error of the mean at the picked level
+    """
+
+    def __init__(self, mean, block_sizes, n_blocks, var, gamma):
+        self.mean = mean
+        self.block_sizes = block_sizes
+        self.n_blocks = n_blocks
+        n_b = n_blocks[:, np.newaxis].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.sem = np.sqrt(var / (n_b - 1.))
+            self.sem_err = self.sem / np.sqrt(2. * (n_b - 1.))
+        self.level = _optimal_level(n_blocks, var, gamma)
+        self.error = self.sem[self.level, np.arange(var.shape[1])]
+
+
+def _optimal_level(n_blocks, var, gamma):
+    """
+    Automated choice of the block size of Jonsson: the first level j for
+    which M_j = sum_{k >= j} n_k (gamma_k / s_k^2)^2, with gamma_k the lag 1
+    autocovariance of the block means, is compatible with a chi^2
+    distribution of d - j degrees of freedom at the 99% level.
+    """
+    d = len(n_blocks)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        terms = n_blocks[:, np.newaxis] * np.square(gamma / var)
+    terms = np.nan_to_num(terms)
+    m_j = np.cumsum(terms[::-1], axis=0)[::-1]
+    q = stats.chi2.ppf(0.99, d - np.arange(d))[:, np.newaxis]
+    passed = m_j < q
+    # The last level always passes, it has a single term
+    passed[-1] = True
+    return np.argmax(passed, axis=0)
+
+
+def _levels(n_samples, min_blocks=2):
+    """Number of blocking levels, keeping at least min_blocks blocks."""
+    return max(int(np.floor(np.log2(max(n_samples // min_blocks, 1)))) + 1, 1)
+
+
+def blocking(x, min_blocks=2):
+    """
+    Blocking analysis of every column of x.
+    The block means of size b are (C[b (j + 1)] - C[b j]) / b, where C is the
+    cumulative sum of the series, so every level is a strided slice of C.
+
+    @param x: (n,) or (n, cols) array with time along the first axis
+    @param min_blocks: smallest number of blocks of the last level
+    @return: BlockingResult
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    n = x.shape[0]
+    mean = x.mean(axis=0)
+    # Centring makes the cumulative sum accurate for large offsets
+    cum = np.concatenate((np.zeros((1, x.shape[1])),
+                          np.cumsum(x - mean, axis=0)))
+
+    levels = _levels(n, min_blocks)
+    block_sizes = 2 ** np.arange(levels)
+    n_blocks = n // block_sizes
+    var = np.empty((levels, x.shape[1]))
+    gamma = np.empty((levels, x.shape[1]))
+    for k, (b, n_b) in enumerate(zip(block_sizes, n_blocks)):
+        means = np.diff(cum[:b * n_b + 1:b], axis=0) / b
+        centred = means - means.mean(axis=0)
+        var[k] = np.mean(np.square(centred), axis=0)
+        gamma[k] = np.sum(centred[:-1] * centred[1:], axis=0) / n_b
+    return BlockingResult(mean, block_sizes, n_blocks, var, gamma)
+
+
+class BlockingAccumulator(object):
+    """
+    Blocking analysis updated chunk by chunk. Every level keeps the count,
+    sum, sum of squares and lag 1 products of its block means, and passes
+    pairs of block means on to the next level. The blocks are the same as
+    in blocking(), so both give identical results.
+    """
+
+    def __init__(self, max_levels=48):
+        self.max_levels = max_levels
+        self.shift = None  # First sample, subtracted for accuracy
+        self.count = np.zeros(max_levels, dtype=np.int64)
+        self.sum = None
+        self.sum_sq = None
+        self.sum_lag = None
+        self.first = None  # First block mean of every level
+        self.last = None  # Last block mean of every level
+        self.pending = [None] * max_levels  # Unpaired block mean
+
+    def update(self, chunk):
+        """
+        @param chunk: (rows,) or (rows, cols) array of new samples
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim == 1:
+            chunk = chunk[:, np.newaxis]
+        if chunk.shape[0] == 0:
+            return self
+        if self.shift is None:
+            cols = chunk.shape[1]
+            self.shift = chunk[0].copy()
+            self.sum = np.zeros((self.max_levels, cols))
+            self.sum_sq = np.zeros((self.max_levels, cols))
+            self.sum_lag = np.zeros((self.max_levels, cols))
+            self.first = np.zeros((self.max_levels, cols))
+            self.last = np.zeros((self.max_levels, cols))
+
+        means = chunk - self.shift
+        for k in range(self.max_levels):
+            if len(means) == 0:
+                break
+            if self.count[k] == 0:
+                self.first[k] = means[0]
+            else:
+                self.sum_lag[k] += self.last[k] * means[0]
+            self.sum_lag[k] += np.sum(means[:-1] * means[1:], axis=0)
+            self.sum[k] += means.sum(axis=0)
+            self.sum_sq[k] += np.square(means).sum(axis=0)
+            self.count[k] += len(means)
+            self.last[k] = means[-1]
+
+            # Pair the block means into the means of the next level
+            if self.pending[k] is not None:
+                means = np.concatenate((self.pending[k][np.newaxis], means))
+            paired = len(means) // 2 * 2
+            self.pending[k] = means[paired] if paired < len(means) else None
+            means = 0.5 * (means[:paired:2] + means[1:paired:2])
+        return self
+
+    def result(self, min_blocks=2):
+        """
+        @param min_blocks: smallest number of blocks of the last level
+        @return: BlockingResult
+        """
+        levels = min(_levels(self.count[0], min_blocks), self.max_levels)
+        n_b = self.count[:levels].astype(np.float64)[:, np.newaxis]
+        mean = self.sum[:levels] / n_b
+        var = self.sum_sq[:levels] / n_b - np.square(mean)
+        # sum (x_i - m)(x_i+1 - m) over the n_b - 1 consecutive pairs
+        lag = self.sum_lag[:levels] \
+            - mean * (2. * self.sum[:levels] - self.first[:levels]
+                      - self.last[:levels]) \
+            + (n_b - 1.) * np.square(mean)
+        return BlockingResult(mean[0] + self.shift, 2 ** np.arange(levels),
+                              self.count[:levels], var, lag / n_b)
+
+
+def blocking_log(fname, usecols=None, chunk_rows=CHUNK_ROWS, min_blocks=2):
+    """
+    Blocking analysis of the columns of a log, streamed in chunks.
+
+    @param fname: path to the log file
+    @param usecols: columns to analyse, all of them if None
+    @param chunk_rows: maximum number of rows held in memory
+    @param min_blocks: smallest number of blocks of the last level
+    @return: BlockingResult
+    """
+    acc = BlockingAccumulator()
+    for chunk in iter_chunks(fname, usecols, chunk_rows):
+        acc.update(chunk)
+    return acc.result(min_blocks)
+
+
+def block_length(x):
+    """
+    Block length for the bootstrap, the block size picked by blocking,
+    which is about twice the correlation time of the series.
+
+    @param x: (n,) or (n, cols) array
+    @return: int, the largest block size of the columns
+    """
+    result = blocking(x)
+    return int(result.block_sizes[result.level].max())
+
+
+def _resample_sums(block_values, n, length, n_boot, seed):
+    """
+    Sums of the values of n // length blocks drawn with replacement,
+    for every resample. The resamples are drawn in batches so that the
+    gathered values fit in MAX_BOOT_VALUES.
+    """
+    rng = np.random.default_rng(seed)
+    n_pick = max(n // length, 1)
+    batch = max(1, MAX_BOOT_VALUES // (n_pick * block_values.shape[1]))
+    sums = np.empty((n_boot, block_values.shape[1]))
+    for b0 in range(0, n_boot, batch):
+        idx = rng.integers(0, n - length + 1,
+                           size=(min(batch, n_boot - b0), n_pick))
+        sums[b0:b0 + batch] = block_values[idx].sum(axis=1)
+    return sums, n_pick
+
+
+def bootstrap_mean(x, length=None, n_boot=1000, seed=None):
+    """
+    Moving block bootstrap of the mean of every column of x.
+    Each resample is the concatenation of n // length blocks, drawn with
+    replacement from the n - length + 1 overlapping blocks of the series,
+    so its mean is the mean of the chosen block means.
+
+    @param x: (n,) or (n, cols) array with time along the first axis
+    @param length: block length, estimated with block_length if None
+    @param n_boot: number of resamples
+    @param seed: seed of the random number generator
+    @return: mean and standard error of every column
+    """
+    x = np.asarray(x, dtype=np.float64)
+    squeeze = x.ndim == 1
+    if squeeze:
+        x = x[:, np.newaxis]
+    n = x.shape[0]
+    if length is None:
+        length = block_length(x)
+    length = min(max(int(length), 1), n)
+
+    mean = x.mean(axis=0)
+    cum = np.concatenate((np.zeros((1, x.shape[1])),
+                          np.cumsum(x - mean, axis=0)))
+    block_means = (cum[length:] - cum[:-length]) / length
+
+    sums, n_pick = _resample_sums(block_means, n, length, n_boot, seed)
+    boot = sums / n_pick
+    err = boot.std(axis=0, ddof=1)
+    return (mean[0], err[0]) if squeeze else (mean, err)
+
+
+def bootstrap_linregress(x, y, length=None, n_boot=1000, seed=None):
+    """
+    Moving block bootstrap of a least squares line, y = slope x + intercept.
+    The sums of x, y, x^2 and xy of every overlapping block come from
+    cumulative sums, so the fit of a resample only needs the sums of the
+    chosen blocks.
+
+    @param x: (n,) array of the independent variable
+    @param y: (n,) array of the dependent variable
+    @param length: block length, estimated from the residuals if None
+    @param n_boot: number of resamples
+    @param seed: seed of the random number generator
+    @return: slope, slope error, intercept, intercept error
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    slope, intercept = np.polyfit(x, y, 1)
+    if length is None:
+        length = block_length(y - (slope * x + intercept))
+    length = min(max(int(length), 1), n)
+
+    # Centre x and y so that the sums are accurate
+    xc, yc = x - x.mean(), y - y.mean()
+    sums = np.column_stack((xc, yc, xc * xc, xc * yc))
+    cum = np.concatenate((np.zeros((1, 4)), np.cumsum(sums, axis=0)))
+    block_sums = cum[length:] - cum[:-length]
+
+    sums, n_pick = _resample_sums(block_sums, n, length, n_boot, seed)
+    s_x, s_y, s_xx, s_xy = sums.T
+    m = n_pick * length
+    b_slope = (m * s_xy - s_x * s_y) / (m * s_xx - s_x * s_x)
+    b_intercept = (s_y - b_slope * s_x) / m + y.mean() - b_slope * x.mean()
+    return slope, b_slope.std(ddof=1), intercept, b_intercept.std(ddof=1)
@@ -0,0 +1,372 @@
+import os
+import numpy as np
+
+"""
+Binary store of the isosbestic points (RDF intersections) of a sweep.
+
+Every record holds a state point (rho, T, A), the set of n whose RDFs were
+intersected and all the intersections found, r_iso[k] and g_iso[k], however
+many there are. The file is laid out as
+
+    header | records | index | trailer
+
+with the records as runs of float64 (n..., r_iso..., g_iso...) and the
+index as six columns sorted on (rho, T, A): rho, T, A, the byte offset of
+the record, its number of n and its number of intersections. The trailer
+holds the offset of the index and the number of records.
+
+Lookups memory-map the index and binary search the sorted columns, so
+finding the records of a (rho, T) reads a few pages of the index and the
+records themselves, even when the store holds millions of them. Appending
+writes the new records and then the merged index after the old trailer, so
+an interrupted append leaves the previous store intact. A record of a
+(rho, T, A) already stored replaces the old one, whose bytes, like those of
+the old index, stay in the file until it is compacted.
+
+    store = IsoStore("isosbestic.iso")
+    store.append(0.5, 1.0, 0.25, [8, 10, 12], r_iso, g_iso)
+    a, n_count, r_iso, g_iso = store.curve(0.5, 1.0)
+"""
+
+ISO_STORE_FILE = "isosbestic.iso"
+
+HEADER = b"MDISO\x00\x00\x01"
+TRAILER_MAGIC = b"MDISOEND"
+TRAILER = np.dtype([("index_offset", "<i8"), ("count", "<i8"),
+                    ("magic", "S8")])
+# Columns of the index, stored one after the other
+INDEX_COLUMNS = (("rho", "<f8"), ("t", "<f8"), ("a", "<f8"),
+                 ("offset", "<i8"), ("n_count", "<i4"), ("k", "<i4"))
+
+
+def is_iso_store(fname):
+    """
+    @param fname: path to a file
+    @return: True if the file is an isosbestic store
+    """
+    try:
+        with open(fname, "rb") as f:
+            return f.read(len(HEADER)) == HEADER
+    except OSError:
+        return False
+
+
+def _key(value):
+    # Potentials without a softening parameter are stored with A = NaN
+    return np.nan if value is None else float(value)
+
+
+def _equal(x):
+    """
+    @return: x[1:] == x[:-1], with NaN equal to NaN
+    """
+    return (x[1:] == x[:-1]) | (np.isnan(x[1:]) & np.isnan(x[:-1]))
+
+
+def read_iso_table(fname):
+    """
+    Reads a whole table of isosbestic points in a single pass.
+
+    @param fname: an IsoStore, or a r_iso.dat text file written by
+                  RDFAnalysis.get_intersections_to_file, of which only
+                  the first intersection of every state point is read
+    @return: dictionary of the rho, t and a columns and of the r_iso
+             array of shape (records, max k), see IsoStore.table
+    """
+    if is_iso_store(fname):
+        return IsoStore(fname).table()
+    rho, t, a, r_iso = np.loadtxt(fname, usecols=(0, 1, 2, 3), unpack=True,
+                                  skiprows=1, ndmin=1)
+    return {"rho": rho, "t": t, "a": a, "r_iso": r_iso[:, np.newaxis]}
+
+
+def group_curves(table, k=0, rho_list=None, t_list=None):
+    """
+    Splits a table into the r_iso(a) curves of every (rho, T), with one
+    sort and one np.unique instead of a filter per curve.
+
+    @param table: dictionary returned by read_iso_table or IsoStore.table
+    @param k: which intersection of the state points makes the curves
+    @param rho_list: densities to keep, all of them if None
+    @param t_list: temperatures to keep, all of them if None
+    @return: t, rho, a_curves, r_curves. t and rho have one entry per
+             curve, sorted on (T, rho), a_curves and r_curves are lists
+             of arrays sorted on a. Missing intersections are NaN
+    """
+    rho, t, a = table["rho"], table["t"], table["a"]
+    r_iso = table["r_iso"]
+    r = r_iso[:, k] if r_iso.shape[1] > k else np.full(len(rho), np.nan)
+
+    keep = np.ones(len(rho), dtype=bool)
+    if rho_list is not None:
+        keep &= np.isin(rho, rho_list)
+    if t_list is not None:
+        keep &= np.isin(t, t_list)
+    rows = np.nonzero(keep)[0]
+    order = rows[np.lexsort((a[rows], rho[rows], t[rows]))]
+    if len(order) == 0:
+        return np.empty(0), np.empty(0), [], []
+
+    # np.unique sorts the pairs like the lexsort, so the first rows of the
+    # groups are increasing
+    pairs, start = np.unique(np.column_stack((t[order], rho[order])), axis=0,
+                             return_index=True)
+    return pairs[:, 0], pairs[:, 1], np.split(a[order], start[1:]), \
+        np.split(r[order], start[1:])
+
+
+class IsoStore(object):
+    """
+    Append-friendly binary table of the isosbestic points, indexed on
+    (rho, T, A).
+    """
+
+    def __init__(self, fname=ISO_STORE_FILE):
+        """
+        @param fname: path to the store, created empty if it does not exist
+        """
+        self.fname = fname
+        self._index = None
+        self._data = None
+        self._index_offset = len(HEADER)
+        if not os.path.exists(fname):
+            with open(fname, "wb") as f:
+                f.write(HEADER)
+                self._write_index(f, {name: np.empty(0, dtype)
+                                      for name, dtype in INDEX_COLUMNS})
+        elif not is_iso_store(fname):
+            raise ValueError(f"{fname} is not an isosbestic store")
+
+    def _load(self):
+        if self._index is not None:
+            return
+        with open(self.fname, "rb") as f:
+            f.seek(-TRAILER.itemsize, os.SEEK_END)
+            trailer = np.frombuffer(f.read(TRAILER.itemsize), TRAILER)[0]
+        if trailer["magic"] != TRAILER_MAGIC:
+            raise ValueError(f"{self.fname}: the index is missing, "
+                             f"the last write did not complete")
+        count = int(trailer["count"])
+        self._index_offset = int(trailer["index_offset"])
+
+        self._index = {}
+        pos = self._index_offset
+        for name, dtype in INDEX_COLUMNS:
+            if count:
+                self._index[name] = np.memmap(self.fname, dtype, "r",
+                                              offset=pos, shape=(count,))
+            else:
+                self._index[name] = np.empty(0, dtype)
+            pos += count * np.dtype(dtype).itemsize
+        # The records, as float64 counted from the start of the file
+        self._data = np.memmap(self.fname, "<f8", "r",
+                               shape=(self._index_offset // 8,))
+
+    def _release(self):
+        # The maps have to be closed before the file is rewritten
+        self._index = None
+        self._data = None
+
+    def _write_index(self, f, index):
+        self._index_offset = f.tell()
+        for name, dtype in INDEX_COLUMNS:
+            f.write(np.ascontiguousarray(index[name], dtype=dtype).tobytes())
+        trailer = np.array([(self._index_offset, len(index["rho"]),
+                             TRAILER_MAGIC)], dtype=TRAILER)
+        f.write(trailer.tobytes())
+        f.truncate()
+
+    def __len__(self):
+        self._load()
+        return len(self._index["rho"])
+
+    def append(self, rho, t, a, n_list, r_iso, g_iso):
+        """
+        Stores the intersections of a state point.
+
+        @param rho: density
+        @param t: temperature
+        @param a: softening parameter, None if the potential has none
+        @param n_list: pair potential strengths of the intersected RDFs
+        @param r_iso: radii of the intersections
+        @param g_iso: values of the RDF at the intersections
+        """
+        self.extend([(rho, t, a, n_list, r_iso, g_iso)])
+
+    def extend(self, records):
+        """
+        Stores the intersections of many state points, with a single
+        rewrite of the index. The records are written as they are
+        produced, so records may be a generator.
+
+        The new records and the merged index are written after the current
+        trailer, so the old index stays valid until the new trailer is on
+        disk. If a record is invalid, or the iteration is interrupted, the
+        file is truncated back to its previous end. The dead space left by
+        the old indexes and replaced records is reclaimed by compact, which
+        runs by itself once the dead bytes exceed the live records and
+        index.
+
+        @param records: iterable of (rho, t, a, n_list, r_iso, g_iso)
+        @return: the number of records written
+        """
+        self._load()
+        index = {name: np.array(column)
+                 for name, column in self._index.items()}
+        self._release()
+
+        rows = []
+        with open(self.fname, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            try:
+                pos = end
+                for rho, t, a, n_list, r_iso, g_iso in records:
+                    r_iso = np.asarray(r_iso, dtype=np.float64).ravel()
+                    g_iso = np.asarray(g_iso, dtype=np.float64).ravel()
+                    if len(r_iso) != len(g_iso):
+                        raise ValueError(
+                            "r_iso and g_iso have different lengths")
+                    values = np.concatenate(
+                        (np.asarray(n_list, dtype=np.float64), r_iso, g_iso))
+                    f.write(values.astype("<f8").tobytes())
+                    rows.append((float(rho), float(t), _key(a), pos,
+                                 len(n_list), len(r_iso)))
+                    pos += values.size * 8
+
+                new = np.array(rows, dtype=list(INDEX_COLUMNS)) if rows \
+                    else np.empty(0, dtype=list(INDEX_COLUMNS))
+                for name, __ in INDEX_COLUMNS:
+                    index[name] = np.concatenate((index[name], new[name]))
+
+                # Sort on (rho, T, A), the later record of a key replacing
+                # the earlier one
+                order = np.lexsort((np.arange(len(index["rho"])),
+                                    index["a"], index["t"], index["rho"]))
+                index = {name: column[order]
+                         for name, column in index.items()}
+                replaced = _equal(index["rho"]) & _equal(index["t"]) & \
+                    _equal(index["a"])
+                keep = np.append(~replaced, True)
+                index = {name: column[keep] for name, column in index.items()}
+                self._write_index(f, index)
+            except BaseException:
+                # Back to the previous end, and the previous trailer
+                f.truncate(end)
+                raise
+
+        live = 8 * int(np.sum(index["n_count"].astype(np.int64)
+                              + 2 * index["k"].astype(np.int64)))
+        dead = self._index_offset - len(HEADER) - live
+        index_bytes = len(index["rho"]) * sum(np.dtype(dtype).itemsize
+                                              for __, dtype in INDEX_COLUMNS)
+        if dead > live + index_bytes:
+            self.compact()
+        return len(rows)
+
+    def _range(self, rho, t, a=None, all_a=True):
+        """
+        @return: start, stop of the index rows of (rho, T), or of
+                 (rho, T, A) if all_a is False
+        """
+        self._load()
+        lo, hi = 0, len(self._index["rho"])
+        bounds = [("rho", float(rho)), ("t", float(t))]
+        if not all_a:
+            bounds.append(("a", _key(a)))
+        for name, value in bounds:
+            # Inside the rows of the previous keys, the column is sorted
+            column = self._index[name][lo:hi]
+            lo, hi = lo + np.searchsorted(column, value, "left"), \
+                lo + np.searchsorted(column, value, "right")
+        return int(lo), int(hi)
+
+    def _padded(self, rows):
+        """
+        @param rows: slice or indices of index rows
+        @return: n_count, r_iso and g_iso of the rows, the last two as
+                 (rows, max k) arrays padded with NaN
+        """
+        offset = np.asarray(self._index["offset"][rows]) // 8
+        n_count = np.asarray(self._index["n_count"][rows])
+        k = np.asarray(self._index["k"][rows])
+        width = int(k.max()) if len(k) else 0
+        cols = np.arange(width)
+        valid = cols[np.newaxis, :] < k[:, np.newaxis]
+        r_pos = (offset + n_count)[:, np.newaxis] + cols
+        g_pos = r_pos + k[:, np.newaxis]
+        r_iso = np.where(valid, self._data[np.where(valid, r_pos, 0)], np.nan)
+        g_iso = np.where(valid, self._data[np.where(valid, g_pos, 0)], np.nan)
+        return n_count, r_iso, g_iso
+
+    def get(self, rho, t, a=None):
+        """
+        @param rho: density
+        @param t: temperature
+        @param a: softening parameter
+        @return: dictionary with the n, r_iso and g_iso arrays of the state
+                 point, None if it is not stored
+        """
+        lo, hi = self._range(rho, t, a, all_a=False)
+        if lo == hi:
+            return None
+        pos = int(self._index["offset"][lo]) // 8
+        n_count, k = int(self._index["n_count"][lo]), int(self._index["k"][lo])
+        values = np.array(self._data[pos:pos + n_count + 2 * k])
+        return {"n": values[:n_count], "r_iso": values[n_count:n_count + k],
+                "g_iso": values[n_count + k:]}
+
+    def curve(self, rho, t):
+        """
+        All the state points of a (rho, T), with a single indexed lookup.
+
+        @param rho: density
+        @param t: temperature
+        @return: a, n_count, r_iso and g_iso. a and n_count have one entry
+                 per stored A, in increasing order, r_iso and g_iso are
+                 (A, max k) arrays padded with NaN
+        """
+        lo, hi = self._range(rho, t)
+        n_count, r_iso, g_iso = self._padded(slice(lo, hi))
+        return np.array(self._index["a"][lo:hi]), n_count, r_iso, g_iso
+
+    def table(self):
+        """
+        Reads the whole store.
+
+        @return: dictionary of the rho, t, a, n_count and k columns, sorted
+                 on (rho, T, A), and of the r_iso and g_iso arrays of shape
+                 (records, max k) padded with NaN
+        """
+        self._load()
+        n_count, r_iso, g_iso = self._padded(slice(None))
+        return {"rho": np.array(self._index["rho"]),
+                "t": np.array(self._index["t"]),
+                "a": np.array(self._index["a"]), "n_count": n_count,
+                "k": np.array(self._index["k"]), "r_iso": r_iso,
+                "g_iso": g_iso}
+
+    def records(self):
+        """
+        @return: generator of (rho, t, a, n, r_iso, g_iso) in index order,
+                 with a None for the potentials without one
+        """
+        self._load()
+        for row in range(len(self)):
+            rho, t, a = (float(self._index[name][row])
+                         for name in ("rho", "t", "a"))
+            record = self.get(rho, t, a)
+            yield rho, t, None if np.isnan(a) else a, record["n"], \
+                record["r_iso"], record["g_iso"]
+
+    def compact(self):
+        """
+        Rewrites the store without the replaced records, with the records
+        in index order so that the state points of a (rho, T) are
+        contiguous.
+        """
+        tmp_file = f"{self.fname}.tmp"
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        IsoStore(tmp_file).extend(self.records())
+        self._release()
+        os.replace(tmp_file, self.fname)
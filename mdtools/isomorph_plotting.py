@@ -1,8 +1,11 @@
+import os
 import numpy as np
-import pickle as pl
-import matplotlib.pyplot as plt
-from mdtools import Isomorph
-from mpl_toolkits.mplot3d import Axes3D
+from concurrent.futures import ProcessPoolExecutor
+from mdtools.isomorphs import isomorph_grid
+from mdtools._lazy import lazy_import
+
+plt = lazy_import("matplotlib.pyplot")
+patches = lazy_import("matplotlib.patches")
 
 
 """
@@ -22,168 +25,302 @@ surface higher up. When A0 = 0, then the figure is collapsed on the rho-T axis
     A2 decreases
 
     if a_r == 0; then all the a2s are forced to be zero (0) hence causing the surface to be flat
+
+RENDERING:
+
+The surfaces of a figure are cached as a {figname}.npz file holding the
+arrays and the parameters they were generated with, instead of pickling the
+matplotlib figure (which does not work with 3D axes). render_all_surfaces
+draws every figure offscreen with the Agg canvas in a pool of processes,
+so it runs on nodes without a display.
 """
 
+# Default directory of the cached surface arrays
+CACHE_DIR = "."
+# Density reference
+RHO_LIST = np.linspace(0.2, 1, 10)
+# Input temperature over which the isomorphic points are generated
+T2_LIST = np.linspace(0.2, 2, 20)
 
-def isomorphic_surface_array(rho_list, t_list, n_list, a_list, t2,
-                             figname, save_fig=False, save_pickle=False):
+# Reference parameters (T0, A0, n) of every figure of plot_all_surfaces
+FIGURES = {
+    # PLOT VARIOUS TEMPERATURES T0
+    "Isomorphs_with_varying_T0":
+        (np.linspace(0.2, 1, 5), [0.5], [8]),
+    # PLOT VARIOUS PARAMETERS A0
+    "Isomorphs_with_varying_A0":
+        ([0.5], np.linspace(0.5, 1, 3), [8]),
+    # PLOT VARIOUS PAIR POTENTIAL STRENGTHS n
+    # TODO: increase color intensity cyan, light green, DISABLE SHADING, wireframe color and decrease thickness
+    "Isomorphs_with_varying_n":
+        ([0.5], [0.5], list(range(8, 15, 2))),
+    # PLOT VARIOUS A0 AND T0
+    "Isomorphs_with_varying_A0_and_T0":
+        (np.linspace(0.2, 1, 3), np.linspace(0, 1, 3), [8]),
+    # PLOT VARYING A0 and n
+    "Isomorphs_with_varying_A0_and_n":
+        ([0.5], np.linspace(0, 1, 3), list(range(8, 15, 2))),
+    # PLOT VARYING T0 and n
+    "Isomorphs_with_varying_T0_and_n":
+        (np.linspace(0.2, 1, 3), [0.5], list(range(8, 13, 2))),
+    # PLOT WITH TEMPERATURE TO INFINITY
+    "Isomorphs_T0_to_infinity":
+        (np.linspace(0.2, 10, 15), [0.5], [8]),
+}
+
+
+def surface_arrays(rho_list, t_list, n_list, a_list, t2, figname=None,
+                   cache_dir=None):
     """
+    The isomorphic surfaces of every reference parameter. If a cache
+    directory is given they are read from {figname}.npz, as long as it was
+    generated with the same parameters, and written to it otherwise.
+
+    @param rho_list: Reference densities
+    @param t_list: Reference temperatures
+    @param n_list: Potential strengths
+    @param a_list: Reference A parameters
+    @param t2: Temperatures along the isomorphs
+    @param figname: Name of the cached file
+    @param cache_dir: Directory of the cached surfaces
+    @return: rho, T, A arrays of shape (a, T0, n, rho, T2)
+    """
+    params = {"rho_list": rho_list, "t_list": t_list, "n_list": n_list,
+              "a_list": a_list, "t2": t2}
+    params = {k: np.asarray(v, dtype=np.float64) for k, v in params.items()}
+
+    path = None
+    if cache_dir is not None and figname is not None:
+        path = os.path.join(cache_dir, f"{figname}.npz")
+        try:
+            with np.load(path) as npz:
+                if all(np.array_equal(npz[k], v) for k, v in params.items()):
+                    return npz["rho_iso"], npz["t_iso"], npz["a_iso"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    rho_iso, t_iso, a_iso = (np.ascontiguousarray(x) for x in isomorph_grid(
+        rho_list, t_list, a_list, n_list, t2))
+    if path is not None:
+        tmp_file = f"{path}.tmp.npz"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(tmp_file, rho_iso=rho_iso, t_iso=t_iso, a_iso=a_iso,
+                     **params)
+            os.replace(tmp_file, path)
+        except OSError:
+            # Read-only or full directory, return the surfaces uncached
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+    return rho_iso, t_iso, a_iso
+
+
+def decimate(surface, lod):
+    """
+    Level of detail reduction of a mesh, keeping every lod-th point along
+    the last two axes and always the last row and column, so that the
+    extent of the surface is unchanged.
 
-    @param rho_list:
-    @param t_list:
-    @param n_list:
-    @param a_list:
-    @param t2:
-    @param figname:
-    @param save_fig:
-    @param save_pickle:
-    @return:
+    @param surface: array of shape (..., rho, T2)
+    @param lod: stride of the points kept, 1 keeps the full mesh
+    @return: the decimated array
     """
+    if lod <= 1:
+        return surface
+    rows, cols = (np.unique(np.r_[np.arange(0, size, lod), size - 1])
+                  for size in surface.shape[-2:])
+    return surface[..., rows[:, np.newaxis], cols]
 
-    # Generate the 3D plot canvas here
-    fig = plt.figure(figname)
-    ax = Axes3D(fig)
-    canvas = None
+
+def draw_surfaces(ax, rho_iso, t_iso, a_iso, t_list, n_list, a_list, lod=1):
+    """
+    Draws every surface of the (a, T0, n, rho, T2) arrays on a 3D axis.
+
+    @param ax: matplotlib 3D axis
+    @param lod: Level of detail, stride of the mesh points drawn
+    """
+    rho_iso, t_iso, a_iso = (decimate(x, lod) for x in (rho_iso, t_iso, a_iso))
 
     edg_col = ["none", "black", "cyan", "white"]
-    edg_it = 0
-    for a_r in a_list:
-        for t_r in t_list:
+    handles = []
+    for i, a_r in enumerate(a_list):
+        for j, t_r in enumerate(t_list):
             # Varying the reference density in the line
             # Merging multiple rho lines creates a surface
-            for n in n_list:
-                rho_iso = np.empty((0, len(t2)))
-                t_iso = np.empty((0, len(t2)))
-                a_iso = np.empty((0, len(t2)))
-
-                label_title = fr"n: {n}, $T_0$: {t_r:.1f}, $A_0$: {a_r:.1f}"
-                for i, rho_r in enumerate(rho_list):
-                    iso = Isomorph(rho_r, t_r, a_r, t2)
-                    # Generate isomorphic line
-                    rho2, a2 = iso.gen_line(n)
-
-                    # Creating the 3D mesh grid
-                    rho_iso = np.append(rho_iso, [rho2], axis=0)
-                    t_iso = np.append(t_iso, [t2], axis=0)
-                    a_iso = np.append(a_iso, [a2], axis=0)
-
-                surf = ax.plot_surface(rho_iso, t_iso, a_iso, label=label_title,
-                                       alpha=0.9, edgecolor=edg_col[edg_it])
-
-                # This is a fix for the bug that does not allow legends to 3D surfaces
-                surf._facecolors2d = surf._facecolors3d
-                surf._edgecolors2d = surf._edgecolors3d
-                ax.legend(loc="best")
-
-        edg_it += 1
+            for k, n in enumerate(n_list):
+                label_title = fr"n: {n:g}, $T_0$: {t_r:.1f}, $A_0$: {a_r:.1f}"
+                surf = ax.plot_surface(rho_iso[i, j, k], t_iso[i, j, k],
+                                       a_iso[i, j, k], alpha=0.9,
+                                       edgecolor=edg_col[i % len(edg_col)])
+                # 3D surfaces have no legend entry, use a proxy patch
+                handles.append(patches.Patch(
+                    facecolor=surf.get_facecolor()[0],
+                    edgecolor=edg_col[i % len(edg_col)], label=label_title))
+    ax.legend(handles=handles, loc="best")
 
     ax.set_xlabel(r'$\rho$')
     ax.set_ylabel(r'T')
     ax.set_zlabel(r'a')
     # ax.view_init(elev=44, azim=-128.5)
 
-    if save_fig is True:
-        plt.savefig(f"{figname}.pdf")
 
-    # Save figures for loading at a later time
-    if save_pickle is True:
-        pl.dump(fig, open(f"{figname}.pickle", "wb"))
+def isomorphic_surface_array(rho_list, t_list, n_list, a_list, t2,
+                             figname, save_fig=False, cache_dir=None, lod=1):
+    """
+    Plots the isomorphic surfaces of every combination of the reference
+    parameters on an interactive figure.
+
+    @param rho_list: Reference densities
+    @param t_list: Reference temperatures
+    @param n_list: Potential strengths
+    @param a_list: Reference A parameters
+    @param t2: Temperatures along the isomorphs
+    @param figname: Name of the figure and of the saved files
+    @param save_fig: Save the figure as {figname}.pdf
+    @param cache_dir: Directory where the surface arrays are cached, so that
+                      load_figures can redraw the figure (this replaces the
+                      figure pickles). Nothing is cached if None
+    @param lod: Level of detail, stride of the mesh points drawn
+    @return: the figure
+    """
+    rho_iso, t_iso, a_iso = surface_arrays(rho_list, t_list, n_list, a_list,
+                                           t2, figname, cache_dir)
+
+    # Generate the 3D plot canvas here
+    fig = plt.figure(figname)
+    ax = fig.add_subplot(projection='3d')
+    draw_surfaces(ax, rho_iso, t_iso, a_iso, t_list, n_list, a_list, lod)
+
+    if save_fig is True:
+        fig.savefig(f"{figname}.pdf")
+    return fig
 
 
-def plot_all_surfaces():
+def render_surface(task):
     """
-    Generates all the plots of the ismorphic surfaces for the MD fluid.
-    It also pickles the figures, so that they can be loaded at a later time.
+    Draws a figure of isomorphic surfaces offscreen, with the Agg canvas and
+    without pyplot, and saves it in every requested format.
+    Runs in the worker processes of render_all_surfaces.
+
+    @param task: (figname, rho_list, t_list, n_list, a_list, t2, out_dir,
+                 formats, lod, dpi, cache_dir)
+    @return: list of the written files
     """
-    # Leave these unchanged
-    # Density reference
-    rho_list = np.linspace(0.2, 1, 10)
-    # Input temperature over which the isomorphic points are generated
-    t2 = np.linspace(0.2, 2, 20)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
 
-    # PLOT VARIOUS TEMPERATURES T0
-    # Reference parameters
-    t_list = np.linspace(0.2, 1, 5)
-    a_list = [0.5]
-    n_list = [8]
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_T0")
+    figname, rho_list, t_list, n_list, a_list, t2, out_dir, formats, lod, \
+        dpi, cache_dir = task
+    rho_iso, t_iso, a_iso = surface_arrays(rho_list, t_list, n_list, a_list,
+                                           t2, figname, cache_dir)
 
-    # PLOT VARIOUS PARAMETERS A0
-    a_list = np.linspace(0.5, 1, 3)
-    t_list = [0.5]
-    n_list = [8]
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_A0")
+    fig = Figure(figsize=(8, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(projection='3d')
+    draw_surfaces(ax, rho_iso, t_iso, a_iso, t_list, n_list, a_list, lod)
 
-    # PLOT VARIOUS PAIR POTENTIAL STRENGTHS n
-    # TODO: increase color intensity cyan, light green, DISABLE SHADING, wireframe color and decrease thickness
-    a_list = [0.5]
-    t_list = [0.5]
-    n_list = list(range(8, 15, 2))
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_n")
+    written = []
+    for fmt in formats:
+        fname = os.path.join(out_dir, f"{figname}.{fmt}")
+        fig.savefig(fname, dpi=dpi)
+        written.append(fname)
+    return written
 
-    # PLOT VARIOUS A0 AND T0
-    t_list = np.linspace(0.2, 1, 3)
-    a_list = np.linspace(0, 1, 3)
-    n_list = [8]
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_A0_and_T0")
-
-    # PLOT VARYING A0 and n
-    t_list = [0.5]
-    a_list = np.linspace(0, 1, 3)
-    n_list = list(range(8, 15, 2))
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_A0_and_n")
 
-    # PLOT VARYING T0 and n
-    t_list = np.linspace(0.2, 1, 3)
-    a_list = [0.5]
-    n_list = list(range(8, 13, 2))
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_with_varying_T0_and_n")
+def render_all_surfaces(out_dir=".", formats=("pdf", "png"), lod=1,
+                        workers=0, dpi=150, cache_dir=None, figures=None):
+    """
+    Renders the figures of plot_all_surfaces offscreen, every figure in
+    its own process.
+
+    @param out_dir: Directory of the output files
+    @param formats: File formats to save, e.g. ("pdf", "png")
+    @param lod: Level of detail, a stride > 1 decimates the mesh for previews
+    @param workers: Number of processes, all the cores if < 1 and
+                    serially in this process if None
+    @param dpi: Resolution of the raster formats
+    @param cache_dir: Directory of the cached surface arrays,
+                      defaults to out_dir
+    @param figures: Dictionary of figname: (t_list, a_list, n_list),
+                    defaults to FIGURES
+    @return: list of the written files
+    """
+    if cache_dir is None:
+        cache_dir = out_dir
+    if figures is None:
+        figures = FIGURES
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(figname, RHO_LIST, t_list, n_list, a_list, T2_LIST, out_dir,
+              tuple(formats), lod, dpi, cache_dir)
+             for figname, (t_list, a_list, n_list) in figures.items()]
+
+    if workers is None:
+        results = [render_surface(task) for task in tasks]
+    else:
+        if workers < 1:
+            workers = os.cpu_count()
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) \
+                as executor:
+            results = list(executor.map(render_surface, tasks))
+    return [fname for written in results for fname in written]
+
+
+def plot_all_surfaces(cache_dir=CACHE_DIR, lod=1):
+    """
+    Generates all the plots of the ismorphic surfaces for the MD fluid.
+    The surface arrays are cached in cache_dir, so that the figures can be
+    loaded at a later time with load_figures. By default this writes one
+    {figname}.npz file per figure into the current directory.
 
-    # PLOT WITH TEMPERATURE TO INFINITY
-    t_list = np.linspace(0.2, 10, 15)
-    a_list = [0.5]
-    n_list = [8]
-    isomorphic_surface_array(rho_list, t_list, n_list,
-                             a_list, t2, "Isomorphs_T0_to_infinity")
+    @param cache_dir: Directory where the surface arrays are cached,
+                      the current directory by default, None to cache nothing
+    @param lod: Level of detail, stride of the mesh points drawn
+    """
+    for figname, (t_list, a_list, n_list) in FIGURES.items():
+        isomorphic_surface_array(RHO_LIST, t_list, n_list, a_list, T2_LIST,
+                                 figname, cache_dir=cache_dir, lod=lod)
 
 
-# Not working with 3DAxes
-def load_figures(fig_names):
+def load_figures(fig_names, cache_dir=CACHE_DIR, lod=1):
     """
-    Uses a list of the figure names to load them into a list
-    @param fig_names:
-    @type fig_names:
+    Redraws figures from their cached surface arrays,
+    without generating the surfaces again.
+
+    @param fig_names: Names of the figures
+    @type fig_names: list
+    @param cache_dir: Directory where the surface arrays are cached
+    @param lod: Level of detail, stride of the mesh points drawn
     @return: A list containing all the figures
     @rtype: list
     """
     fig_list = []
-    for i, name in enumerate(fig_names):
-        fig_list.append(pl.load(open(f"{name}.pickle", "rb")))
+    for name in fig_names:
+        path = os.path.join(cache_dir, f"{name}.npz")
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No cached surfaces for {name} in {cache_dir}, generate "
+                f"them with plot_all_surfaces or render_all_surfaces using "
+                f"the same cache_dir")
+        with np.load(path) as npz:
+            fig = plt.figure(name)
+            ax = fig.add_subplot(projection='3d')
+            draw_surfaces(ax, npz["rho_iso"], npz["t_iso"], npz["a_iso"],
+                          npz["t_list"], npz["n_list"], npz["a_list"], lod)
+        fig_list.append(fig)
     return fig_list
 
 
 if __name__ == "__main__":
-    import os
     import matplotlib.pyplot as plt
 
     # Change directory to where files will be saved and loaded from
     os.chdir("/home/gn/Desktop/surface_figures")
-    # List that contains a copy of the figure names,
-    # that will be loaded into the load_pickle function
-    # to resume the figures to their normal state without having to re-plot them
-    fig_names = ["Isomorphs_with_varying_T0",
-                 "Isomorphs_with_varying_A0",
-                 "Isomorphs_with_varying_n",
-                 "Isomorphs_with_varying_A0_and_T0",
-                 "Isomorphs_with_varying_A0_and_n",
-                 "Isomorphs_with_varying_T0_and_n",
-                 "Isomorphs_T0_to_infinity"]
-
-    plot_all_surfaces()
+
+    # Offscreen rendering of every figure into PDF and PNG files
+    render_all_surfaces()
+
+    # The cached surfaces are loaded into interactive figures
+    load_figures(list(FIGURES))
     plt.show()
@@ -37,17 +37,11 @@ class Isomorph:
         @return: Output for Density and A of the isomorph, along the given rho, A and T reference point
                  and the using T_OUT as a range of values for the isomorph
         """
-        self.rho2_list = []
-        self.a2_list = []
-        # Extract T2, from the range of temperatures
-        for t2 in self.t_out:
-            # Generate the rho2, for T1, T2, rho1, a1
-            rho_out = self.get_rho(self.rho_r, self.t_r, t2, n)
-            # Generate a2 for T1, T2, rho1, rho2, a1
-            a_out = self.get_a(self.a_r, self.rho_r, rho_out)
-            # Pass rho2, a2 to lists
-            self.rho2_list.append(rho_out)
-            self.a2_list.append(a_out)
+        t_out = np.asarray(self.t_out, dtype=np.float64)
+        # Generate the rho2, for T1, T2, rho1, a1 for every T2 at once
+        self.rho2_list = self.get_rho(self.rho_r, self.t_r, t_out, n)
+        # Generate a2 for T1, T2, rho1, rho2, a1
+        self.a2_list = self.get_a(self.a_r, self.rho_r, self.rho2_list)
         return self.rho2_list, self.a2_list
 
     def get_iso_point(self, t2, n):
@@ -63,21 +57,54 @@ class Isomorph:
         return rho2, t2, a2
 
 
+def isomorph_grid(rho_r, t_r, a_r, n, t2):
+    """
+    Isomorphic states of every combination of reference parameters.
+    The inputs are broadcast against each other, so a whole family of
+    isomorphs is generated with a few array operations:
+    rho2 = rho_r (T2 / T_r)^(3 / n) and a2 = a_r (rho_r / rho2)^(1 / 3).
+
+    @param rho_r: Reference densities, scalar or 1D array
+    @param t_r: Reference temperatures, scalar or 1D array
+    @param a_r: Reference A parameters, scalar or 1D array
+    @param n: Potential strengths, scalar or 1D array
+    @param t2: Temperatures along the isomorphs, scalar or 1D array
+    @return: rho2, t2, a2 arrays of shape (a_r, t_r, n, rho_r, t2)
+    """
+    a_r = np.atleast_1d(np.asarray(a_r, dtype=np.float64))
+    t_r = np.atleast_1d(np.asarray(t_r, dtype=np.float64))
+    n = np.atleast_1d(np.asarray(n, dtype=np.float64))
+    rho_r = np.atleast_1d(np.asarray(rho_r, dtype=np.float64))
+    t2 = np.atleast_1d(np.asarray(t2, dtype=np.float64))
+
+    a_r = a_r[:, None, None, None, None]
+    t_r = t_r[None, :, None, None, None]
+    n = n[None, None, :, None, None]
+    rho_r = rho_r[None, None, None, :, None]
+    t2 = t2[None, None, None, None, :]
+
+    # (T_r, n, T2) factor shared by every density and A
+    ratio = t2 / t_r
+    rho2 = rho_r * ratio ** (3.0 / n)
+    # a_r (rho_r / rho2)^(1/3) = a_r (T_r / T2)^(1/n)
+    a2 = a_r * ratio ** (-1.0 / n)
+    shape = np.broadcast_shapes(rho2.shape, a2.shape)
+    return np.broadcast_to(rho2, shape), np.broadcast_to(t2, shape), \
+        np.broadcast_to(a2, shape)
+
+
 def iso_surface(sim_name, rho_list, t_r, a_r, t2, n):
     """
     Produces the 2D lists needed to plot a surface
+
+    @param sim_name: simulation name used as the prefix in the log files
+    @param rho_list: Reference densities
+    @param t_r: Reference Temperature
+    @param a_r: Reference A parameter
+    @param t2: Temperatures along the isomorphs
+    @param n: Potential strength
+    @return: rho, T and A arrays of shape (rho_list, t2)
     """
-    rho_iso = np.empty((0, len(t2)))
-    t_iso = np.empty((0, len(t2)))
-    a_iso = np.empty((0, len(t2)))
-
-    for rho_r in rho_list:
-        iso = Isomorph(sim_name, rho_r, t_r, a_r, t2)
-        # Generate isomorphic line
-        rho2, a2 = iso.gen_line(n)
-
-        # Creating the 3D mesh grid
-        rho_iso = np.append(rho_iso, [rho2], axis=0)
-        t_iso = np.append(t_iso, [t2], axis=0)
-        a_iso = np.append(a_iso, [a2], axis=0)
-    return rho_iso, t_iso, a_iso
+    rho_iso, t_iso, a_iso = isomorph_grid(rho_list, t_r, a_r, n, t2)
+    return np.array(rho_iso[0, 0, 0]), np.array(t_iso[0, 0, 0]), \
+        np.array(a_iso[0, 0, 0])
@@ -0,0 +1,183 @@
+import os
+import time
+import queue
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    CancelledError
+from mdtools.analyses import run_analysis, source_files
+
+"""
+Background execution of the analyses for interactive front ends.
+
+A JobRunner sends every analysis to a pool of worker processes and hands the
+finished results to the thread that polls it, e.g. the Tk main loop, which
+then does the drawing. The results are cached per analysis, state point and
+options, together with the modification times of the logs read, so asking
+again for a state point that was already analysed returns at once.
+
+When the parameters change, cancel_stale drops the jobs that were asked for
+before. Queued jobs are cancelled; a job that is already running in a worker
+cannot be interrupted, its result is cached but not delivered.
+"""
+
+# Number of results kept in the cache of a JobRunner
+MAX_RESULTS = 128
+
+
+class Job(object):
+    """
+    An analysis of a state point, submitted to a JobRunner.
+    """
+
+    def __init__(self, job_id, key, name, params, generation):
+        self.job_id = job_id
+        self.key = key
+        self.name = name
+        self.params = params
+        self.generation = generation
+        self.future = None
+        self.result = None
+        self.error = None
+        self.cached = False
+        self.submitted = time.perf_counter()
+        self.elapsed = None
+
+
+def _signature(fname):
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return fname, None, None
+    return os.path.abspath(fname), st.st_mtime_ns, st.st_size
+
+
+def job_key(name, params):
+    """
+    @param name: name of the analysis
+    @param params: keyword arguments of run_analysis
+    @return: hashable key, which changes when one of the logs is rewritten
+    """
+    options = tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple)) else v)
+                           for k, v in params.items()))
+    files = tuple(_signature(f) for f in source_files(name, **params))
+    return (name,) + options + files
+
+
+class JobRunner(object):
+
+    def __init__(self, workers=0, max_results=MAX_RESULTS):
+        """
+        @param workers: number of worker processes, all the cores if < 1.
+                        If None the jobs run one at a time in a background
+                        thread of this process
+        @param max_results: number of results kept in the cache
+        """
+        if workers is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            if workers < 1:
+                workers = os.cpu_count()
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.max_results = max_results
+        self.cache = OrderedDict()
+        self.generation = 0
+        self.finished = queue.Queue()  # Jobs waiting to be polled
+        self.active = {}  # job_id: Job, submitted and not yet polled
+        self._ids = itertools.count()
+        self._batch = 0  # Jobs submitted since the runner was last idle
+
+    def submit(self, name, steps, particles, sim_name, rho, t, n=None,
+               a=None, data_dir=".", **options):
+        """
+        Queues an analysis, see analyses.run_analysis for the arguments.
+        A cached result is delivered by the next poll.
+
+        @return: the Job
+        """
+        params = dict(options, steps=steps, particles=particles,
+                      sim_name=sim_name, rho=rho, t=t, n=n, a=a,
+                      data_dir=data_dir)
+        key = job_key(name, params)
+        job = Job(next(self._ids), key, name, params, self.generation)
+        if not self.active:
+            self._batch = 0
+        self._batch += 1
+        self.active[job.job_id] = job
+
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            job.result, job.cached, job.elapsed = self.cache[key], True, 0.
+            self.finished.put(job)
+            return job
+
+        job.future = self.executor.submit(run_analysis, name, **params)
+        job.future.add_done_callback(lambda future: self._hand_over(job))
+        return job
+
+    def _hand_over(self, job):
+        # Runs in a thread of the executor, the result is read by poll
+        job.elapsed = time.perf_counter() - job.submitted
+        self.finished.put(job)
+
+    def cancel_stale(self):
+        """
+        Drops every job submitted so far: the queued ones are cancelled and
+        the results of the running ones will not be delivered.
+
+        @return: the number of jobs dropped
+        """
+        self.generation += 1
+        dropped = 0
+        for job in list(self.active.values()):
+            if job.future is not None:
+                job.future.cancel()
+            del self.active[job.job_id]
+            dropped += 1
+        self._batch = 0
+        return dropped
+
+    def poll(self):
+        """
+        Collects the jobs finished since the last call. Must be called
+        periodically by the consumer, e.g. with Tk's after.
+
+        @return: list of the finished jobs that are not stale, in the order
+                 they finished. Failed jobs have their error set
+        """
+        jobs = []
+        while True:
+            try:
+                job = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            if job.future is not None:
+                try:
+                    job.result = job.future.result()
+                    self._cache(job.key, job.result)
+                except CancelledError:
+                    continue
+                except Exception as err:
+                    job.error = err
+            if job.generation != self.generation:
+                continue
+            self.active.pop(job.job_id, None)
+            jobs.append(job)
+        return jobs
+
+    def _cache(self, key, result):
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_results:
+            self.cache.popitem(last=False)
+
+    def progress(self):
+        """
+        @return: (finished, total) jobs of the current batch; a batch starts
+                 with the first job submitted while no job is active
+        """
+        return self._batch - len(self.active), self._batch
+
+    def shutdown(self):
+        self.cancel_stale()
+        self.executor.shutdown(wait=False, cancel_futures=True)
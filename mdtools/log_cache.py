@@ -0,0 +1,151 @@
+import os
+import json
+import numpy as np
+from mdtools.profiling import span
+
+# Name of the hidden directory, created next to the logs, holding the sidecars
+CACHE_DIR = ".mdtools_cache"
+CACHE_VERSION = 1
+
+
+def cache_path(fname):
+    """
+    Location of the columnar sidecar for a given log file.
+
+    @param fname: path to the tab delimited log file
+    @return: path to the directory holding the per-column .npy files
+    """
+    head, tail = os.path.split(os.path.abspath(fname))
+    return os.path.join(head, CACHE_DIR, tail)
+
+
+def _signature(fname):
+    st = os.stat(fname)
+    return {"version": CACHE_VERSION, "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size}
+
+
+def _count_columns(fname, delimiter, comments):
+    """
+    Number of non-empty fields in the first data row.
+    Trailing delimiters written by the simulation do not count as columns.
+    """
+    with open(fname, "r") as f:
+        for line in f:
+            line = line.split(comments, 1)[0].strip()
+            if line:
+                return len([c for c in line.split(delimiter) if c.strip()])
+    return 0
+
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_cache(path, signature, columns):
+    """
+    Writes every column into its own .npy file. The metadata is written last
+    so that an interrupted write is never mistaken for a valid cache.
+    """
+    os.makedirs(path, exist_ok=True)
+    meta_file = os.path.join(path, "meta.json")
+    if os.path.exists(meta_file):
+        os.remove(meta_file)
+    for i, col in enumerate(columns):
+        np.save(os.path.join(path, f"col_{i}.npy"), col)
+
+    meta = dict(signature, ncols=len(columns),
+                nrows=int(len(columns[0])) if len(columns) else 0)
+    tmp_file = f"{meta_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_file, meta_file)
+
+
+def parse_log(fname, delimiter='\t', comments='#'):
+    """
+    Parses every column of a log file in a single pass.
+
+    @param fname: path to the log file
+    @param delimiter: string that separates the data in the file
+    @param comments: character marking the start of a comment
+    @return: list of 1D numpy.arrays, one per column
+    """
+    ncols = _count_columns(fname, delimiter, comments)
+    if ncols == 0:
+        return []
+    with span("parse_log", fname) as s:
+        data = np.loadtxt(fname, delimiter=delimiter, comments=comments,
+                          usecols=range(ncols), ndmin=2)
+        s.add(rows=len(data))
+    return [np.ascontiguousarray(data[:, i]) for i in range(ncols)]
+
+
+def load_log(fname, delimiter='\t', comments='#'):
+    """
+    Returns all the columns of a log file, parsing the text only once.
+    The parsed columns are stored as .npy sidecars which are memory-mapped
+    on every later call. The sidecars are rebuilt when the modification
+    time or the size of the log changes.
+
+    @param fname: path to the log file
+    @param delimiter: string that separates the data in the file
+    @param comments: character marking the start of a comment
+    @return: list of 1D (memory-mapped) numpy.arrays, one per column
+    """
+    signature = _signature(fname)
+    path = cache_path(fname)
+    meta = _read_meta(path)
+
+    if meta is not None and all(meta.get(k) == v for k, v in signature.items()):
+        try:
+            # Memory-mapped, the pages are only read when they are used
+            with span("load_sidecar", rows=meta["nrows"]):
+                return [np.load(os.path.join(path, f"col_{i}.npy"),
+                                mmap_mode='c')
+                        for i in range(meta["ncols"])]
+        except (OSError, ValueError):
+            pass  # Corrupted sidecar, parse the text again
+
+    columns = parse_log(fname, delimiter, comments)
+    try:
+        _write_cache(path, signature, columns)
+    except OSError:
+        # Read-only data directory, simply work with the parsed data
+        pass
+    return columns
+
+
+def load_columns(fname, usecols, delimiter='\t', comments='#'):
+    """
+    Drop-in replacement for np.loadtxt(..., usecols=usecols, unpack=True)
+    that reads through the columnar cache.
+
+    @param fname: path to the log file
+    @param usecols: int or sequence of ints with the columns to return
+    @param delimiter: string that separates the data in the file
+    @param comments: character marking the start of a comment
+    @return: a single array if usecols is an int, otherwise a tuple of arrays
+    """
+    columns = load_log(fname, delimiter, comments)
+    if isinstance(usecols, (int, np.integer)):
+        return columns[usecols]
+    return tuple(columns[i] for i in usecols)
+
+
+def clear_cache(fname):
+    """
+    Removes the sidecar of a log file, if there is one.
+
+    @param fname: path to the log file
+    """
+    path = cache_path(fname)
+    if not os.path.isdir(path):
+        return
+    for entry in os.listdir(path):
+        os.remove(os.path.join(path, entry))
+    os.rmdir(path)
@@ -0,0 +1,247 @@
+import os
+import numpy as np
+from mdtools._lazy import lazy_import
+from mdtools.log_stream import RunningMoments, RunningLinearFit
+
+plt = lazy_import("matplotlib.pyplot")
+animation = lazy_import("matplotlib.animation")
+
+"""
+Incremental reading of the logs of a simulation that is still running.
+
+A LogFollower remembers the byte offset up to which a log has been parsed
+and on every poll reads only the bytes appended since then. An incomplete
+last line (the simulation is in the middle of writing it) is left for the
+next poll. The running accumulators of log_stream are updated with the new
+rows only, so the cost of a refresh is proportional to the new rows and not
+to the size of the log.
+"""
+
+
+class LogFollower(object):
+
+    def __init__(self, fname, usecols, delimiter='\t', comments='#'):
+        """
+        @param fname: path to the log file, it does not need to exist yet
+        @param usecols: int or sequence of ints with the columns to read
+        @param delimiter: string that separates the data in the file
+        @param comments: character marking the start of a comment
+        """
+        if isinstance(usecols, (int, np.integer)):
+            usecols = (usecols,)
+        self.fname = fname
+        self.usecols = tuple(usecols)
+        self.delimiter = delimiter
+        self.comments = comments
+        self.offset = 0  # Bytes parsed so far, always at the start of a line
+        self.rows = 0  # Data rows returned so far
+        self.resets = 0  # Times the log was found rewritten
+
+    def reset(self):
+        self.offset = 0
+        self.rows = 0
+        self.resets += 1
+
+    def poll(self):
+        """
+        Reads the complete rows appended to the log since the last poll.
+        If the log became shorter than the parsed offset it was rewritten,
+        and it is read again from the start; resets is then incremented.
+
+        @return: 2D numpy.array of shape (new rows, len(usecols))
+        """
+        empty = np.empty((0, len(self.usecols)))
+        try:
+            size = os.path.getsize(self.fname)
+        except OSError:
+            return empty
+        if size < self.offset:
+            self.reset()
+        if size == self.offset:
+            return empty
+
+        with open(self.fname, "rb") as f:
+            f.seek(self.offset)
+            new = f.read(size - self.offset)
+        end = new.rfind(b"\n") + 1
+        if end == 0:
+            return empty  # No complete line yet
+        self.offset += end
+
+        lines = [l for l in new[:end].decode().splitlines()
+                 if l.strip() and not l.lstrip().startswith(self.comments)]
+        if not lines:
+            return empty
+        chunk = np.loadtxt(lines, delimiter=self.delimiter,
+                           comments=self.comments, usecols=self.usecols,
+                           ndmin=2)
+        self.rows += chunk.shape[0]
+        return chunk
+
+
+class GrowableArray(object):
+    """
+    Append-only array of rows, with a capacity that doubles when full,
+    so that appending n rows costs O(n) amortised.
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self._data = np.empty((capacity, columns))
+        self.size = 0
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1,
+                                                          self._data.shape[1])
+        needed = self.size + rows.shape[0]
+        if needed > self._data.shape[0]:
+            grown = np.empty((max(needed, 2 * self._data.shape[0]),
+                              self._data.shape[1]))
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = rows
+        self.size = needed
+        return self
+
+    @property
+    def data(self):
+        return self._data[:self.size]
+
+
+class DataLogMonitor(object):
+    """
+    Follows the Data log of a running simulation. It keeps running means and
+    variances of U, K, U+K and Pc, the least squares fit of the MSD against
+    time and the plotted curves, all updated from the new rows only.
+    """
+
+    # Columns of the Data log: U, K, Pc, MSD
+    COLUMNS = (3, 4, 5, 7)
+
+    def __init__(self, fname, time_step, msd_time_step=None):
+        """
+        @param fname: path to the Data log
+        @param time_step: time between two rows of the log
+        @param msd_time_step: time between two rows used for the MSD,
+                              defaults to time_step
+        """
+        self.follower = LogFollower(fname, self.COLUMNS)
+        self.time_step = time_step
+        self.msd_time_step = time_step if msd_time_step is None \
+            else msd_time_step
+        self.moments = RunningMoments()
+        self.msd_fit = RunningLinearFit()
+        # Columns: U, K, U+K, Pc, MSD
+        self.series = GrowableArray(5)
+        self.fig = None
+        self.lines = {}
+        self.anim = None
+
+    def update(self):
+        """
+        Reads the new rows of the log and updates the accumulators.
+
+        @return: number of new rows
+        """
+        resets = self.follower.resets
+        chunk = self.follower.poll()
+        if self.follower.resets != resets:
+            # The log was rewritten, e.g. by a new run: start afresh
+            self.clear()
+        first = self.follower.rows - chunk.shape[0]
+        n_new = chunk.shape[0]
+        if n_new == 0:
+            return 0
+        u, k, pc, msd = chunk.T
+        values = np.column_stack((u, k, u + k, pc))
+        self.moments.update(values)
+        self.msd_fit.update((np.arange(n_new) + first) * self.msd_time_step,
+                            msd)
+        self.series.append(np.column_stack((values, msd)))
+        return n_new
+
+    def clear(self):
+        """
+        Drops the rows read so far, from the accumulators and the curves.
+        """
+        self.moments = RunningMoments()
+        self.msd_fit = RunningLinearFit()
+        self.series = GrowableArray(5)
+        for line in self.lines.values():
+            line.set_data([], [])
+
+    def averages(self):
+        """
+        @return: dictionary of (mean, variance) tuples for U, K, U+K and Pc
+        """
+        if self.moments.count == 0:
+            return {}
+        mean, var = self.moments.mean, self.moments.var()
+        return {key: (mean[i], var[i])
+                for i, key in enumerate(("U", "K", "U+K", "Pc"))}
+
+    def diffusion(self):
+        """
+        @return: slope, intercept, rvalue, pvalue, stderr of the MSD fit
+        """
+        return self.msd_fit.result()
+
+    def plot(self):
+        """
+        Creates the figure with the energies, Pc and the MSD,
+        the curves are then updated in place by refresh.
+        """
+        self.fig, axes = plt.subplots(3, 1, sharex=False, figsize=(8, 9))
+        en_ax, pc_ax, msd_ax = axes
+        for key, color in (("K", 'r'), ("U", 'g'), ("U+K", 'b')):
+            self.lines[key], = en_ax.plot([], [], color, label=key)
+        en_ax.set_ylabel("Energy units")
+        en_ax.legend(loc='best', fancybox=True)
+        self.lines["Pc"], = pc_ax.plot([], [])
+        pc_ax.set_ylabel(r"$P_C$")
+        self.lines["MSD"], = msd_ax.plot([], [])
+        self.lines["fit"], = msd_ax.plot([], [], '--')
+        msd_ax.set_xlabel(r"$t$")
+        msd_ax.set_ylabel(r"$MSD$")
+        self.refresh()
+        return self.fig
+
+    def refresh(self, *args):
+        """
+        Polls the log and updates the data of the existing curves.
+        Used as the frame function of the animation.
+        """
+        self.update()
+        if not self.lines or self.series.size == 0:
+            return list(self.lines.values())
+
+        data = self.series.data
+        rows = np.arange(self.series.size)
+        t = rows * self.time_step
+        t_msd = rows * self.msd_time_step
+        for i, key in enumerate(("U", "K", "U+K", "Pc")):
+            self.lines[key].set_data(t, data[:, i])
+        self.lines["MSD"].set_data(t_msd, data[:, 4])
+        if self.msd_fit.count > 1:
+            slope, intercept = self.diffusion()[:2]
+            ends = t_msd[[0, -1]]
+            self.lines["fit"].set_data(ends, slope * ends + intercept)
+            self.lines["fit"].set_label(f"D = {slope:.4f}")
+
+        for ax in self.fig.axes:
+            ax.relim()
+            ax.autoscale_view()
+        return list(self.lines.values())
+
+    def animate(self, interval=2000):
+        """
+        Refreshes the figure every interval milliseconds.
+
+        @param interval: time between polls of the log in ms
+        @return: the matplotlib FuncAnimation, a reference must be kept
+        """
+        if self.fig is None:
+            self.plot()
+        self.anim = animation.FuncAnimation(self.fig, self.refresh,
+                                            interval=interval,
+                                            cache_frame_data=False)
+        return self.anim
@@ -0,0 +1,237 @@
+import itertools
+import numpy as np
+from mdtools._lazy import lazy_import
+from mdtools import profiling
+
+"""
+Streaming access to the tab delimited logs of the simulation.
+
+The logs are read in blocks of a fixed number of rows, so the memory used
+is bounded by the chunk size and not by the length of the log.
+The accumulators below combine the statistics of every chunk with the
+pairwise update of Chan et al., which gives the same result as the
+one-pass numpy/scipy functions without keeping the data around.
+"""
+
+stats = lazy_import("scipy.stats")
+
+CHUNK_ROWS = 1 << 16
+
+
+def iter_chunks(fname, usecols, chunk_rows=CHUNK_ROWS,
+                delimiter='\t', comments='#'):
+    """
+    Yields the selected columns of a log, chunk_rows rows at a time.
+
+    @param fname: path to the log file
+    @param usecols: int or sequence of ints with the columns to read
+    @param chunk_rows: maximum number of rows held in memory
+    @param delimiter: string that separates the data in the file
+    @param comments: character marking the start of a comment
+    @return: generator of 2D numpy.arrays of shape (rows, len(usecols))
+    """
+    if isinstance(usecols, (int, np.integer)):
+        usecols = (usecols,)
+    with open(fname, "r") as f:
+        while True:
+            lines = list(itertools.islice(f, chunk_rows))
+            if not lines:
+                break
+            lines = [l for l in lines
+                     if l.strip() and not l.lstrip().startswith(comments)]
+            if not lines:
+                continue
+            with profiling.span("parse_chunk") as s:
+                chunk = np.loadtxt(lines, delimiter=delimiter,
+                                   comments=comments, usecols=usecols, ndmin=2)
+                if profiling.enabled():
+                    s.add(bytes_read=sum(map(len, lines)), rows=len(chunk))
+            yield chunk
+
+
+class RunningMoments(object):
+    """
+    Running count, mean and variance, computed column by column.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None  # Sum of squared deviations from the mean
+
+    def update(self, chunk):
+        """
+        @param chunk: 1D array, or 2D array of shape (rows, columns)
+        """
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim == 1:
+            chunk = chunk[:, np.newaxis]
+        n_b = chunk.shape[0]
+        if n_b == 0:
+            return self
+        mean_b = chunk.mean(axis=0)
+        m2_b = np.square(chunk - mean_b).sum(axis=0)
+
+        if self.count == 0:
+            self.count, self.mean, self.m2 = n_b, mean_b, m2_b
+            return self
+
+        n = self.count + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta * n_b / n
+        self.m2 = self.m2 + m2_b + np.square(delta) * self.count * n_b / n
+        self.count = n
+        return self
+
+    def var(self, ddof=0):
+        return self.m2 / (self.count - ddof)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.var(ddof))
+
+
+class RunningHistogram(object):
+    """
+    Histogram over fixed bin edges, accumulated chunk by chunk.
+    """
+
+    def __init__(self, bins, hist_range):
+        self.edges = np.linspace(hist_range[0], hist_range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values):
+        counts, __ = np.histogram(np.ravel(values), bins=self.edges)
+        self.counts += counts
+        return self
+
+    def density(self):
+        return self.counts / (self.counts.sum() * np.diff(self.edges))
+
+
+class RunningLinearFit(object):
+    """
+    Ordinary least squares fit of y = slope * x + intercept,
+    updated with every new chunk of (x, y) points.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x, self.mean_y = 0., 0.
+        self.sxx, self.syy, self.sxy = 0., 0., 0.
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        n_b = len(x)
+        if n_b == 0:
+            return self
+        mx_b, my_b = x.mean(), y.mean()
+        dx, dy = x - mx_b, y - my_b
+        sxx_b, syy_b, sxy_b = dx @ dx, dy @ dy, dx @ dy
+
+        n = self.count + n_b
+        delta_x, delta_y = mx_b - self.mean_x, my_b - self.mean_y
+        weight = self.count * n_b / n
+        self.sxx += sxx_b + delta_x * delta_x * weight
+        self.syy += syy_b + delta_y * delta_y * weight
+        self.sxy += sxy_b + delta_x * delta_y * weight
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.count = n
+        return self
+
+    def result(self):
+        """
+        @return: slope, intercept, rvalue, pvalue, stderr;
+                 the same quantities as scipy.stats.linregress
+        """
+        if self.count < 2 or self.sxx == 0:
+            raise ValueError(
+                "A linear fit needs at least two distinct x values, "
+                f"got {self.count} points")
+        slope = self.sxy / self.sxx
+        intercept = self.mean_y - slope * self.mean_x
+        r = 0. if self.syy == 0 else self.sxy / np.sqrt(self.sxx * self.syy)
+        r = min(max(r, -1.), 1.)
+        df = self.count - 2
+        if df <= 0:
+            return slope, intercept, r, np.nan, np.nan
+        if abs(r) == 1.:
+            p_val, std = 0., 0.
+        else:
+            t_stat = r * np.sqrt(df / ((1. - r) * (1. + r)))
+            p_val = 2 * stats.t.sf(abs(t_stat), df)
+            std = np.sqrt((1 - r * r) * self.syy / self.sxx / df)
+        return slope, intercept, r, p_val, std
+
+
+def stream_mean_var(fname, usecols, chunk_rows=CHUNK_ROWS, ddof=0):
+    """
+    Mean and variance of the selected columns of a log.
+
+    @param fname: path to the log file
+    @param usecols: int or sequence of ints with the columns to reduce
+    @param chunk_rows: maximum number of rows held in memory
+    @param ddof: delta degrees of freedom of the variance
+    @return: two numpy.arrays, with one entry per column
+    """
+    moments = RunningMoments()
+    for chunk in iter_chunks(fname, usecols, chunk_rows):
+        moments.update(chunk)
+    if moments.count == 0:
+        raise ValueError(f"{fname} has no data rows")
+    return moments.mean, moments.var(ddof)
+
+
+def stream_histogram(fname, col, bins=150, hist_range=None,
+                     chunk_rows=CHUNK_ROWS):
+    """
+    Histogram of a single column of a log.
+    If no range is given the log is read twice, the first pass
+    determining the minimum and maximum of the column.
+
+    @param fname: path to the log file
+    @param col: column to histogram
+    @param bins: number of bins
+    @param hist_range: (min, max) of the histogram
+    @param chunk_rows: maximum number of rows held in memory
+    @return: counts, bin edges
+    """
+    if hist_range is None:
+        low, high = np.inf, -np.inf
+        for chunk in iter_chunks(fname, col, chunk_rows):
+            low, high = min(low, chunk.min()), max(high, chunk.max())
+        hist_range = (low, high)
+    hist = RunningHistogram(bins, hist_range)
+    for chunk in iter_chunks(fname, col, chunk_rows):
+        hist.update(chunk)
+    return hist.counts, hist.edges
+
+
+def stream_linregress(fname, ycol, xcol=None, dx=1., chunk_rows=CHUNK_ROWS):
+    """
+    Linear regression of one column of a log against another column,
+    or against the row index scaled by dx.
+
+    @param fname: path to the log file
+    @param ycol: column of the dependent variable
+    @param xcol: column of the independent variable. If None the
+                 row index multiplied by dx is used instead
+    @param dx: spacing of the independent variable when xcol is None
+    @param chunk_rows: maximum number of rows held in memory
+    @return: slope, intercept, rvalue, pvalue, stderr
+    """
+    fit = RunningLinearFit()
+    cols = (ycol,) if xcol is None else (ycol, xcol)
+    row = 0
+    for chunk in iter_chunks(fname, cols, chunk_rows):
+        if xcol is None:
+            x = (np.arange(chunk.shape[0]) + row) * dx
+        else:
+            x = chunk[:, 1]
+        fit.update(x, chunk[:, 0])
+        row += chunk.shape[0]
+    try:
+        return fit.result()
+    except ValueError as err:
+        raise ValueError(f"{fname}: {err}") from None
@@ -0,0 +1,220 @@
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from mdtools.trajectory import Trajectory
+from mdtools.cell_list import NeighbourTracker
+
+"""
+Rendering of the particle trajectories into movies.
+
+The frames are drawn offscreen with the Agg canvas, without pyplot, by a
+pool of processes. Every worker opens the memory-mapped trajectory itself
+and renders batches of consecutive frames into raw RGB bytes, which are
+piped in order into a single ffmpeg encoder. Only a bounded number of
+batches is in flight at once, so the memory used does not grow with the
+length of the movie.
+"""
+
+# Number of frames rendered by a worker in a single task
+BATCH_FRAMES = 16
+
+# Quantities the particles can be coloured by
+COLOUR_LABELS = {"nn": "Nearest neighbour distance",
+                 "coordination": "Coordination number"}
+
+
+def neighbour_colouring(box_length, colour_by, r_cut=1.5, skin=0.3):
+    """
+    Per-frame colour values of the particles from a periodic neighbour
+    search. The returned function keeps a Verlet list between calls, so it
+    should be called on consecutive frames by a single thread.
+
+    @param box_length: length of the periodic simulation box
+    @param colour_by: "nn" for the nearest neighbour distance or
+                      "coordination" for the number of neighbours within r_cut
+    @param r_cut: radius of the coordination shell
+    @param skin: extra radius of the Verlet list
+    @return: function of the (particles, 3) positions returning the
+             (particles,) colour values, or None if colour_by is None
+    """
+    if colour_by is None:
+        return None
+    if colour_by not in COLOUR_LABELS:
+        raise ValueError(f"Unknown colouring {colour_by}, use one of "
+                         f"{list(COLOUR_LABELS)}")
+    tracker = NeighbourTracker(box_length, r_cut, skin)
+
+    def colours(positions):
+        nearest, coordination = tracker.update(positions)
+        if colour_by == "nn":
+            # No neighbour within the list radius
+            return np.minimum(nearest, r_cut + skin)
+        return coordination.astype(np.float64)
+    return colours
+
+
+class ParticleScene(object):
+    """
+    3D scatter plot of the particles of a frame, shared by the interactive
+    animation and the offscreen renderer.
+    """
+
+    def __init__(self, fig, box_length, positions, color='orange',
+                 values=None, clim=None, label=None, cmap='viridis_r'):
+        """
+        @param fig: matplotlib Figure
+        @param box_length: length of the periodic simulation box
+        @param positions: (particles, 3) array of the first frame
+        @param color: colour of the particles, if values is None
+        @param values: (particles,) array colouring the particles
+        @param clim: (min, max) of the colour scale, defaults to the
+                     range of values
+        @param label: label of the colour bar
+        @param cmap: colour map of the values
+        """
+        self.ax = fig.add_subplot(111, projection="3d")
+        if values is None:
+            self.graph = self.ax.scatter(positions[:, 0], positions[:, 1],
+                                         positions[:, 2], color=color)
+        else:
+            if clim is None:
+                clim = (values.min(), values.max())
+            self.graph = self.ax.scatter(positions[:, 0], positions[:, 1],
+                                         positions[:, 2], c=values, cmap=cmap,
+                                         vmin=clim[0], vmax=clim[1])
+            fig.colorbar(self.graph, ax=self.ax, shrink=0.6, label=label)
+        # Drawn inside the axes, so that it is blitted with the particles
+        self.text = self.ax.text2D(0.02, 0.98, "", va='top',
+                                   transform=self.ax.transAxes)
+        self.ax.set_xlim3d(0, box_length)
+        self.ax.set_ylim3d(0, box_length)
+        self.ax.set_zlim3d(0, box_length)
+
+    def update(self, num, positions, values=None):
+        """
+        @param num: frame number
+        @param positions: (particles, 3) array of the frame
+        @param values: (particles,) array of the new colour values
+        @return: the artists that changed
+        """
+        self.text.set_text(f"Frame: {num}")
+        self.graph._offsets3d = (positions[:, 0], positions[:, 1],
+                                 positions[:, 2])
+        if values is not None:
+            self.graph.set_array(values)
+        return self.graph, self.text
+
+
+# State of a worker process, built once by _init_worker
+_WORKER = {}
+
+
+def _new_canvas(figsize, dpi):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize, dpi=dpi)
+    return fig, FigureCanvasAgg(fig)
+
+
+def _init_worker(traj_file, figsize, dpi, colour_by=None, clim=None,
+                 first_frame=0):
+    traj = Trajectory(traj_file)
+    fig, canvas = _new_canvas(figsize, dpi)
+    colours = neighbour_colouring(traj.box_length, colour_by)
+    first = np.asarray(traj.frame(first_frame), dtype=np.float64)
+    scene = ParticleScene(fig, traj.box_length, first,
+                          values=None if colours is None else colours(first),
+                          clim=clim, label=COLOUR_LABELS.get(colour_by))
+    _WORKER.update(traj=traj, canvas=canvas, scene=scene, colours=colours)
+
+
+def _render_batch(frames):
+    """
+    @param frames: frame numbers to render
+    @return: bytes with the RGB pixels of every frame, one after the other
+    """
+    traj, canvas, scene = _WORKER["traj"], _WORKER["canvas"], _WORKER["scene"]
+    colours = _WORKER["colours"]
+    pixels = []
+    for num in frames:
+        positions = np.asarray(traj.frame(num), dtype=np.float64)
+        values = None if colours is None else colours(positions)
+        scene.update(num, positions, values)
+        canvas.draw()
+        pixels.append(np.asarray(canvas.buffer_rgba())[..., :3].tobytes())
+    return b"".join(pixels)
+
+
+def export_movie(traj_file, out_file, frames, fps=60, figsize=(10, 10),
+                 dpi=100, workers=0, batch=BATCH_FRAMES, ffmpeg=None,
+                 codec="libx264", colour_by=None):
+    """
+    Renders frames of a trajectory store into a movie.
+
+    @param traj_file: path to the binary trajectory store
+    @param out_file: path of the movie, e.g. "fluid.mp4"
+    @param frames: frame numbers to render, in order
+    @param fps: frames per second of the movie
+    @param figsize: size of the figure in inches
+    @param dpi: resolution of the figure, figsize * dpi should be even
+    @param workers: number of rendering processes, all the cores if < 1
+                    and serially in this process if None
+    @param batch: number of frames rendered by a worker in a single task
+    @param ffmpeg: path to the ffmpeg executable, defaults to the one
+                   configured for matplotlib
+    @param codec: video codec used by ffmpeg
+    @param colour_by: colour the particles by "nn" or "coordination",
+                      see neighbour_colouring
+    @return: out_file
+    """
+    if ffmpeg is None:
+        import matplotlib
+        ffmpeg = matplotlib.rcParams["animation.ffmpeg_path"]
+    frames = list(frames)
+    # Colour scale of the first frame, shared by every worker
+    clim = None
+    if colour_by is not None:
+        traj = Trajectory(traj_file)
+        first = np.asarray(traj.frame(frames[0]), dtype=np.float64)
+        values = neighbour_colouring(traj.box_length, colour_by)(first)
+        clim = (values.min(), values.max())
+    init_args = (traj_file, figsize, dpi, colour_by, clim, frames[0])
+    tasks = [frames[i:i + batch] for i in range(0, len(frames), batch)]
+
+    __, canvas = _new_canvas(figsize, dpi)
+    width, height = canvas.get_width_height()
+    cmd = [ffmpeg, "-y", "-loglevel", "error",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}",
+           "-r", str(fps), "-i", "-",
+           "-an", "-vcodec", codec, "-pix_fmt", "yuv420p", out_file]
+    encoder = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    try:
+        if workers is None:
+            _init_worker(*init_args)
+            for task in tasks:
+                encoder.stdin.write(_render_batch(task))
+        else:
+            if workers < 1:
+                workers = os.cpu_count()
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=init_args) \
+                    as executor:
+                # Keep a few batches per worker in flight, and write the
+                # oldest one as soon as it is ready, to keep the order
+                pending = deque()
+                for task in tasks:
+                    pending.append(executor.submit(_render_batch, task))
+                    if len(pending) >= 2 * workers:
+                        encoder.stdin.write(pending.popleft().result())
+                while pending:
+                    encoder.stdin.write(pending.popleft().result())
+    finally:
+        encoder.stdin.close()
+        returncode = encoder.wait()
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg failed with exit status {returncode}")
+    return out_file
@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+"""
+Opt-in instrumentation of the hot paths.
+
+The analysis methods are wrapped in named spans (profiled), split into
+load, compute and plot phases (phase), and the loaders and the smoothing
+and extrema searches open spans of their own (span). A span records its
+wall time, the bytes read from disk and the rows parsed, and optionally
+the peak of the memory traced by tracemalloc while it was open.
+
+    from mdtools import profiling
+    with profiling.profile(memory=True) as prof:
+        StatQ(10000, 1000).msd("", 0.5, 0.5, 8, 0.5)
+    print(prof.report())
+    prof.write_trace("msd_trace.json")
+
+While no profiler is enabled span and phase return immediately and a
+profiled method costs a single extra function call.
+
+The spans of every thread are recorded, each thread with its own stack.
+tracemalloc is process wide, so the peaks of spans running concurrently in
+several threads include each other's allocations. Worker processes are not
+profiled.
+"""
+
+# The enabled Profiler, None while the instrumentation is off
+_PROFILER = None
+
+
+class _NullSpan(object):
+    """
+    Returned by span while the instrumentation is disabled.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, bytes_read=0, rows=0):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """
+    A timed region of the code, nested in the span that was open when it
+    started in the same thread.
+    """
+
+    __slots__ = ("profiler", "name", "path", "parent", "is_phase", "thread",
+                 "start", "wall", "bytes_read", "rows", "peak_bytes",
+                 "_mem_start", "_peak")
+
+    def __init__(self, profiler, name, bytes_read=0, rows=0, is_phase=False):
+        self.profiler = profiler
+        self.name = name
+        self.path = name
+        self.parent = None
+        self.is_phase = is_phase
+        self.thread = None
+        self.start = 0.
+        self.wall = 0.
+        self.bytes_read = bytes_read
+        self.rows = rows
+        self.peak_bytes = None
+        self._mem_start = 0
+        self._peak = 0
+
+    def __enter__(self):
+        self.profiler._open(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._close(self)
+        return False
+
+    def add(self, bytes_read=0, rows=0):
+        """
+        @param bytes_read: bytes read from disk inside the span
+        @param rows: rows of data parsed inside the span
+        """
+        self.bytes_read += bytes_read
+        self.rows += rows
+
+
+class Profiler(object):
+    """
+    Collects the spans and reduces them into reports.
+    """
+
+    def __init__(self, memory=False):
+        """
+        @param memory: record the peak of the traced memory of every span
+        """
+        self.memory = memory
+        self.started_tracing = False  # tracemalloc was started by enable
+        self.spans = []  # Closed spans, in the order they were closed
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _open(self, span):
+        stack = self._stack()
+        if stack:
+            span.parent = stack[-1]
+            span.path = f"{span.parent.path}/{span.name}"
+        span.thread = threading.get_ident()
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if span.parent is not None:
+                span.parent._peak = max(span.parent._peak, peak)
+            # From here on the traced peak is that of the new span
+            tracemalloc.reset_peak()
+            span._mem_start = span._peak = current
+        stack.append(span)
+        span.start = time.perf_counter()
+
+    def _close(self, span, end=None):
+        if end is None:
+            end = time.perf_counter()
+        stack = self._stack()
+        # Phases still open inside the span end with it
+        while stack and stack[-1] is not span:
+            self._close(stack[-1], end)
+        if stack:
+            stack.pop()
+        span.wall = end - span.start
+        if self.memory:
+            span._peak = max(span._peak, tracemalloc.get_traced_memory()[1])
+            span.peak_bytes = span._peak - span._mem_start
+            if span.parent is not None:
+                span.parent._peak = max(span.parent._peak, span._peak)
+        self.spans.append(span)
+
+    def phase(self, name, bytes_read=0):
+        stack = self._stack()
+        if not stack:
+            return _NULL_SPAN
+        if stack[-1].is_phase:
+            self._close(stack[-1])
+        span = Span(self, name, bytes_read, is_phase=True)
+        self._open(span)
+        return span
+
+    def summary(self):
+        """
+        The spans aggregated by their path, in the order they first started.
+        The self time of a span is its wall time minus that of its children.
+
+        @return: list of dictionaries with the path, name, depth, calls,
+                 total, self, mean and max times in seconds, bytes_read,
+                 rows and the largest peak_bytes (None without memory)
+        """
+        children = {}
+        for span in self.spans:
+            if span.parent is not None:
+                children[id(span.parent)] = \
+                    children.get(id(span.parent), 0.) + span.wall
+
+        groups = {}
+        for span in self.spans:
+            group = groups.get(span.path)
+            if group is None:
+                group = groups[span.path] = {
+                    "path": span.path, "name": span.name,
+                    "depth": span.path.count("/"), "first": span.start,
+                    "calls": 0, "total": 0., "self": 0., "max": 0.,
+                    "bytes_read": 0, "rows": 0, "peak_bytes": None}
+            group["first"] = min(group["first"], span.start)
+            group["calls"] += 1
+            group["total"] += span.wall
+            group["self"] += span.wall - children.get(id(span), 0.)
+            group["max"] = max(group["max"], span.wall)
+            group["bytes_read"] += span.bytes_read
+            group["rows"] += span.rows
+            if span.peak_bytes is not None:
+                group["peak_bytes"] = max(group["peak_bytes"] or 0,
+                                          span.peak_bytes)
+
+        summary = sorted(groups.values(), key=lambda g: g["first"])
+        for group in summary:
+            del group["first"]
+            group["mean"] = group["total"] / group["calls"]
+        return summary
+
+    def report(self):
+        """
+        @return: the summary as a text table, indented by the nesting
+        """
+        lines = [f"{'span':48s}{'calls':>7s}{'total ms':>11s}{'self ms':>11s}"
+                 f"{'MiB read':>10s}{'rows':>11s}{'peak MiB':>10s}"]
+        for g in self.summary():
+            name = ("  " * g["depth"] + g["name"])[:47]
+            peak = "" if g["peak_bytes"] is None \
+                else f"{g['peak_bytes'] / 2 ** 20:.1f}"
+            lines.append(f"{name:48s}{g['calls']:7d}{g['total'] * 1e3:11.1f}"
+                         f"{g['self'] * 1e3:11.1f}"
+                         f"{g['bytes_read'] / 2 ** 20:10.1f}{g['rows']:11d}"
+                         f"{peak:>10s}")
+        return "\n".join(lines)
+
+    def trace(self):
+        """
+        @return: the spans in the Trace Event Format of chrome://tracing
+                 and Perfetto, with the summary under "summary"
+        """
+        events = []
+        for span in sorted(self.spans, key=lambda s: s.start):
+            events.append({
+                "name": span.name, "cat": "phase" if span.is_phase else "span",
+                "ph": "X", "pid": os.getpid(), "tid": span.thread,
+                "ts": (span.start - self.origin) * 1e6, "dur": span.wall * 1e6,
+                "args": {"path": span.path, "bytes_read": span.bytes_read,
+                         "rows": span.rows, "peak_bytes": span.peak_bytes}})
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "summary": self.summary()}
+
+    def write_trace(self, fname):
+        """
+        @param fname: path of the JSON trace
+        """
+        with open(fname, "w") as f:
+            json.dump(self.trace(), f)
+
+
+def enable(memory=False):
+    """
+    Starts recording spans. If memory is True, tracemalloc is started too,
+    which slows down the allocations of the profiled code.
+
+    @param memory: record the peak of the traced memory of every span
+    @return: the new Profiler
+    """
+    global _PROFILER
+    profiler = Profiler(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        profiler.started_tracing = True
+    _PROFILER = profiler
+    return _PROFILER
+
+
+def disable():
+    """
+    Stops recording spans, and tracemalloc if enable started it.
+
+    @return: the Profiler that was enabled, or None
+    """
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None and profiler.started_tracing and \
+            tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return profiler
+
+
+def enabled():
+    return _PROFILER is not None
+
+
+@contextmanager
+def profile(memory=False):
+    """
+    Enables the instrumentation inside a with block.
+
+    @param memory: record the peak of the traced memory of every span
+    @return: the Profiler, which keeps the spans after the block
+    """
+    profiler = enable(memory)
+    try:
+        yield profiler
+    finally:
+        disable()
+
+
+def _file_size(fname):
+    if fname is None:
+        return 0
+    fnames = (fname,) if isinstance(fname, str) else fname
+    return sum(os.path.getsize(f) for f in fnames)
+
+
+def span(name, fname=None, rows=0):
+    """
+    A named span, used as a context manager. Its add method counts the
+    bytes read and rows parsed inside it.
+
+    @param name: name of the span
+    @param fname: path, or sequence of paths, of files read in full
+                  inside the span, counted in bytes_read
+    @param rows: rows parsed inside the span
+    """
+    if _PROFILER is None:
+        return _NULL_SPAN
+    return Span(_PROFILER, name, _file_size(fname), rows)
+
+
+def phase(name, fname=None):
+    """
+    Starts a phase, e.g. "load", "compute" or "plot", of the innermost open
+    span, ending its previous phase. The last phase ends with the span.
+
+    @param name: name of the phase
+    @param fname: path, or sequence of paths, of files read in full
+                  during the phase, counted in bytes_read
+    @return: the phase span, whose add method counts rows and bytes
+    """
+    if _PROFILER is None:
+        return _NULL_SPAN
+    return _PROFILER.phase(name, _file_size(fname))
+
+
+def profiled(func):
+    """
+    Decorator wrapping every call of a function or method in a span named
+    after its qualified name, e.g. "StatQ.msd".
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _PROFILER is None:
+            return func(*args, **kwargs)
+        with Span(_PROFILER, name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -1,11 +1,35 @@
+import os
 import numpy as np
-from mdtools import StatQ
-from scipy import interpolate
-import matplotlib.pyplot as plt
-from scipy.signal import argrelextrema, butter, filtfilt
+from mdtools.stat_quantities import StatQ
+from mdtools._lazy import lazy_import
+from mdtools import rdf_batch
+from mdtools.rdf_cache import RDFCache, make_key
+from mdtools.iso_store import IsoStore, ISO_STORE_FILE, is_iso_store, \
+    read_iso_table, group_curves
+from mdtools.profiling import profiled, phase
 import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+interpolate = lazy_import("scipy.interpolate")
+signal = lazy_import("scipy.signal")
+plt = lazy_import("matplotlib.pyplot")
+mcollections = lazy_import("matplotlib.collections")
+mlines = lazy_import("matplotlib.lines")
 
 MARKERS = itertools.cycle(("o", "v", "s", "p", "P", "*", "+", "x", "d"))
+# Text table of the intersections written by get_intersections_to_file
+ISO_TEXT_FILE = "r_iso.dat"
+
+
+def default_iso_file(fname=None):
+    """
+    @param fname: table of isosbestic points, or None
+    @return: fname, or if it is None the IsoStore ISO_STORE_FILE when it
+             exists and the text table ISO_TEXT_FILE otherwise
+    """
+    if fname is not None:
+        return fname
+    return ISO_STORE_FILE if os.path.exists(ISO_STORE_FILE) else ISO_TEXT_FILE
 
 
 class RDFAnalysis(StatQ):
@@ -16,7 +40,26 @@ class RDFAnalysis(StatQ):
         self.r_interp = []
         self.rdf_interp = []
         self.rdf_interp_smooth = []
-
+        # Parameters of the forward-backward butterworth filter
+        self.filter_order = 3
+        self.filter_cutoff = 0.09
+        # Memoised RDFs, shared by every method of the instance
+        self.cache = RDFCache()
+
+    @profiled
+    def rdf(self, sim_name, rho, t, power=None, par_a=None, iso_scale=False):
+        """
+        Same as StatQ.rdf, but a file is only read once, while it is
+        unchanged. The returned arrays are read-only.
+        """
+        data = self.log_file(sim_name, "RDF", rho, t, power, par_a)
+        key = make_key(data, "rdf", iso_scale=iso_scale)
+        self.r, self.rdf_data = self.cache.get_or_compute(
+            key, lambda: super(RDFAnalysis, self).rdf(sim_name, rho, t, power,
+                                                      par_a, iso_scale))
+        return self.r, self.rdf_data
+
+    @profiled
     def rdf_interpolate_smooth(self, sim_name, rho, t, power=None, par_a=None,
                                range_refinement=2000,
                                iso_scale=False,
@@ -42,10 +85,33 @@ class RDFAnalysis(StatQ):
         @:return: 3 numpy.arrays of the interpolated and smoothed RDF data
         """
         self.rdf(sim_name, rho, t, power, par_a, iso_scale)
+        data = self.log_file(sim_name, "RDF", rho, t, power, par_a)
+        key = make_key(data, "smooth", range_refinement=range_refinement,
+                       iso_scale=iso_scale, ignore_zeroes=ignore_zeroes,
+                       filter_order=self.filter_order,
+                       filter_cutoff=self.filter_cutoff)
+        self.r_interp, self.rdf_interp, self.rdf_interp_smooth = \
+            self.cache.get_or_compute(
+                key, lambda: self._interpolate_smooth(range_refinement,
+                                                      ignore_zeroes))
+
+        # Generating new separation unit distance for the x-axis
+        self.dr = self.rg / range_refinement
+
+        # Passing interpolated data to be stored later in file
+        self.interpolated_data.append(self.rdf_interp)
+        return self.r_interp, self.rdf_interp, self.rdf_interp_smooth
+
+    @profiled
+    def _interpolate_smooth(self, range_refinement, ignore_zeroes):
+        """
+        The smoothing and interpolation of rdf_interpolate_smooth,
+        applied to self.r and self.rdf_data.
+        """
+        phase("filter")
         # Smooth the data before interpolating with a forward backward filter
         # First create a lowpass butterworth filter
-        # TODO: fix the parameters for the filter
-        b, a = butter(3, 0.09)
+        b, a = signal.butter(self.filter_order, self.filter_cutoff)
 
         # Make the interpolating functions
         f = interpolate.interp1d(self.r, self.rdf_data, kind='linear')
@@ -56,7 +122,7 @@ class RDFAnalysis(StatQ):
         if ignore_zeroes is True:
             # Get the non-zero values and make a filter
             non_zero = self.rdf_data[np.nonzero(self.rdf_data)[0]]
-            rdf_smooth = filtfilt(b, a, non_zero)
+            rdf_smooth = signal.filtfilt(b, a, non_zero)
             # Locate the zero values in the rdf data
             zero_idx = np.where(self.rdf_data == 0)[0]
             # Knowing that the RDF values == 0 are always
@@ -65,23 +131,17 @@ class RDFAnalysis(StatQ):
             rdf_smooth = np.concatenate((self.rdf_data[zero_idx], rdf_smooth))
 
         else:
-            rdf_smooth = filtfilt(b, a, self.rdf_data)
+            rdf_smooth = signal.filtfilt(b, a, self.rdf_data)
 
+        phase("interpolate")
         f_smooth = interpolate.interp1d(self.r, rdf_smooth)
 
         # Create a radius array with increased precision (number of bins)
-        self.r_interp = np.linspace(self.r[0], self.r[-1], range_refinement)
+        r_interp = np.linspace(self.r[0], self.r[-1], range_refinement)
         # Use the interpolation functions
-        self.rdf_interp = f(self.r_interp)
-        self.rdf_interp_smooth = f_smooth(self.r_interp)
-
-        # Generating new separation unit distance for the x-axis
-        self.dr = self.rg / range_refinement
-
-        # Passing interpolated data to be stored later in file
-        self.interpolated_data.append(self.rdf_interp)
-        return self.r_interp, self.rdf_interp, self.rdf_interp_smooth
+        return r_interp, f(r_interp), f_smooth(r_interp)
 
+    @profiled
     def rdf_interpolate_smooth_plot(self, sim_name, rho, t, power=None, par_a=None,
                                     range_refinement=2000,
                                     iso_scale=False,
@@ -103,6 +163,7 @@ class RDFAnalysis(StatQ):
         self.rdf_interpolate_smooth(
             sim_name, rho, t, power, par_a, range_refinement, iso_scale)
 
+        phase("plot")
         # Naming the curves
         name = ''
         if show_label is True:
@@ -127,10 +188,12 @@ class RDFAnalysis(StatQ):
         if show_label is True:
             plt.legend(loc="best", fancybox=True)
 
+    @profiled
     def rdf_intersect(self, sim_name, rho, t, power_list, par_a=None,
                       range_refinement=2000,
                       r_lower=0, r_higher=-1,
-                      intersections=1):
+                      intersections=1,
+                      plot=True):
         """
         Finds points of intersection in RDF by looping through multiple ns.
         The RDF data are first smoothed with a forward-backward filter
@@ -165,9 +228,12 @@ class RDFAnalysis(StatQ):
                          It should be provided in terms of indices
         @:param intersections: Number of intersections to look
                               for in range gr[min-max]
+        @:param plot: If False nothing is drawn, which allows the method
+                     to run without a display (e.g. in worker processes)
         @:return: A plot with the interpolated and smoothed RDF
                  along with the local max, min, and intersection points
         """
+        phase("load")
         # Passing the smoothed RDF data into a list of lists
         rdf_interp_list = []
         for n in power_list:
@@ -178,6 +244,7 @@ class RDFAnalysis(StatQ):
             sliced_rdf_data = self.rdf_interp_smooth[r_lower:r_higher]
             rdf_interp_list.append(sliced_rdf_data)
 
+        phase("compute")
         # Transpose the RDF array for easier file output
         rdf_interp_list = np.transpose(rdf_interp_list)
 
@@ -191,9 +258,6 @@ class RDFAnalysis(StatQ):
         __, __, __, __, idx_max, idx_min = self.find_local_min_max(
             self.r_interp[r_lower:r_higher], self.rdf_interp_smooth[r_lower:r_higher])
 
-        # Plotting the intersection results into the interpolated RDF canvas
-        plt.figure('Interpolated RDF')
-
         # Merge and sort the arrays containing the indices of the inflection points
         idx_max_min = np.concatenate((idx_max, idx_min))
         idx_max_min.sort()
@@ -214,17 +278,20 @@ class RDFAnalysis(StatQ):
                     std_list[idx_max_min[i - 1]:idx_max_min[i]], intersections)
                 # Adjust index to match with global(interpolated) array index
                 idx_intersect += idx_max_min[i - 1]
+                # Keep the k smallest stds, in increasing order
+                idx_intersect = idx_intersect[:intersections]
+                idx_intersect = idx_intersect[np.argsort(
+                    std_list[idx_intersect], kind="stable")]
 
                 # Get the mean for the intersection points
-                mean_scatter = mean_list[idx_intersect[:intersections]]
+                mean_scatter = mean_list[idx_intersect]
 
                 # Add the lower boundary index to the std,
                 # to correspond to the actual r index
                 idx_intersect += r_lower
 
                 # Get the r-values for the corresponding RDF averaged values
-                r_iso = [self.r_interp[i]
-                         for i in idx_intersect[:intersections]]
+                r_iso = [self.r_interp[i] for i in idx_intersect]
 
                 # Plot only the max used
                 # Extract the indices of the max/min that is used
@@ -237,11 +304,17 @@ class RDFAnalysis(StatQ):
                 if idx_max_min[i - 1] in idx_min and (idx_max_min[i - 1] not in used_min_idx):
                     used_min_idx.append(idx_max_min[i - 1])
 
-                # BUG: using [0] does not account if multiple intersections are chosen
-                # Storing the x-values for export, r_iso is a list of a single element
-                r_iso_list.append(r_iso[0])
-                # Storing the y-value for the intersection
-                mean_iso_list.append(mean_scatter[0])
+                # Storing the x-values of every intersection of the segment
+                r_iso_list.extend(r_iso)
+                # Storing the y-values for the intersections
+                mean_iso_list.extend(mean_scatter)
+
+        if plot is False:
+            return r_iso_list, mean_iso_list
+
+        phase("plot")
+        # Plotting the intersection results into the interpolated RDF canvas
+        plt.figure('Interpolated RDF')
 
         # Plot the intersection points
         plt.scatter(r_iso_list, mean_iso_list, marker='x', color='red', s=100)
@@ -263,15 +336,82 @@ class RDFAnalysis(StatQ):
         # Plotting the data curves of the interpolated data
         for n in power_list:
             self.rdf_interpolate_smooth_plot(
-                rho, t, n, par_a, range_refinement,
+                sim_name, rho, t, n, par_a, range_refinement,
                 show_label=False)
             self.rdf_plot(
-                rho, t, n, par_a,
+                sim_name, rho, t, n, par_a,
                 show_label=False)
 
         return r_iso_list, mean_iso_list
 
+    @profiled
+    def load_rdf_stack(self, sim_name, rho_list, t_list, n_list, a_list,
+                       iso_scale=False):
+        """
+        Loads the RDFs of a whole sweep into two stacked arrays.
+        Every RDF file of the sweep must have the same number of bins.
+
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param rho_list: list of densities
+        @:param t_list: list of temperatures
+        @:param n_list: list of pair potential strengths
+        @:param a_list: list of softening parameters
+        @:param iso_scale: scale r onto the isomorphic surface
+        @:return: r and g(r) arrays of shape (rho, T, a, n, bins)
+        """
+        r_stack, rdf_stack = None, None
+        for i, rho in enumerate(rho_list):
+            for j, t in enumerate(t_list):
+                for k, a in enumerate(a_list):
+                    for m, n in enumerate(n_list):
+                        r, rdf = self.rdf(sim_name, rho, t, n, a, iso_scale)
+                        if r_stack is None:
+                            shape = (len(rho_list), len(t_list), len(a_list),
+                                     len(n_list), len(r))
+                            r_stack, rdf_stack = np.empty(shape), np.empty(shape)
+                        elif len(r) != r_stack.shape[-1]:
+                            raise ValueError("RDFs of the sweep have a "
+                                             "different number of bins")
+                        r_stack[i, j, k, m] = r
+                        rdf_stack[i, j, k, m] = rdf
+        return r_stack, rdf_stack
+
+    @profiled
+    def batch_intersections(self, sim_name, rho_list, t_list, n_list, a_list,
+                            range_refinement=2000,
+                            r_lower=0, r_higher=-1,
+                            intersections=1,
+                            ignore_zeroes=True):
+        """
+        Finds the RDF intersections of a whole sweep at once.
+        The search is the same as in rdf_intersect, but all the RDFs are
+        resampled on a single r grid and processed as one stacked array,
+        without looping over the state points. Nothing is plotted.
+
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param rho_list: list of densities
+        @:param t_list: list of temperatures
+        @:param n_list: list of pair potential strengths
+        @:param a_list: list of softening parameters
+        @:param range_refinement: The accuracy of the interpolated data
+        @:param r_lower: lower index bound of the intersection search
+        @:param r_higher: upper index bound of the intersection search
+        @:param intersections: Number of intersections to look
+                              for in every max-min segment
+        @:param ignore_zeroes: do not smooth the leading zeroes of the RDFs
+        @:return: r_iso and g_iso arrays of shape (rho, T, a, k),
+                 with all the intersections of every state point,
+                 padded with NaN
+        """
+        r, rdf = self.load_rdf_stack(sim_name, rho_list, t_list, n_list, a_list)
+        self.r_interp, r_iso, g_iso = rdf_batch.find_intersections(
+            r, rdf, range_refinement, r_lower, r_higher, intersections,
+            filter_order=self.filter_order, filter_cutoff=self.filter_cutoff,
+            ignore_zeroes=ignore_zeroes)
+        return r_iso, g_iso
+
     @staticmethod
+    @profiled
     def find_local_min_max(x, y):
         """
         Finds the local min and max and their indices.
@@ -287,19 +427,17 @@ class RDFAnalysis(StatQ):
         """
         # Find the index of the local maxima and minima
         # this index can then be used to find the x-y values of the points
-        idx_local_max = argrelextrema(y, np.greater)
-        idx_local_min = argrelextrema(y, np.less)
+        idx_local_max = signal.argrelextrema(y, np.greater)
+        idx_local_min = signal.argrelextrema(y, np.less)
 
         # Realigning for convenience
         idx_local_max = idx_local_max[0]
         idx_local_min = idx_local_min[0]
 
         # Fetch the last global minimum
-        g_min = np.where(y == y.min())[-1]
+        g_min = np.where(y == y.min())[0][-1]
 
         # Test to see if global min is already present
-        # TODO: element comparisson will be deprecated
-        # https://stackoverflow.com/questions/40659212/futurewarning-elementwise-comparison-failed-returning-scalar-but-in-the-futur?rq=1
         if g_min not in idx_local_min:
             idx_local_min = np.append(idx_local_min, g_min)
             idx_local_min.sort()
@@ -312,12 +450,23 @@ class RDFAnalysis(StatQ):
 
         return x_local_max, y_local_max, x_local_min, y_local_min, idx_local_max, idx_local_min
 
+    @profiled
     def get_intersections_to_file(self, sim_name, rho_list, t_list, n_list, a_list,
                                   filename,
-                                  delimiter='\t'):
+                                  delimiter='\t',
+                                  existing_only=False,
+                                  workers=None):
         """
         Writes the isosbestic points coordinates
         (r_iso and rdf_iso) to two different files.
+        With existing_only, state points that do not have an RDF file for
+        every n are skipped. The files are looked up in self.catalog.
+
+        By default every state point is plotted and shown before moving to
+        the next one. If workers is given, the sweep runs headless instead:
+        the state points are spread over a pool of worker processes, nothing
+        is drawn, and the results are written in the same order as the
+        serial sweep.
 
         @:param sim_name: simulation name used as the prefix in the log files
         @:param rho_list: list of densities
@@ -326,46 +475,135 @@ class RDFAnalysis(StatQ):
         @:param a_list: list of softening parameters
         @:param filename: Output filename/ directory
         @:param delimiter: string that separates the data in the files
+        @:param existing_only: only sweep over the indexed state points
+        @:param workers: number of worker processes for a headless sweep,
+                        values < 1 use every available core
         """
-
+        state_points = self._state_points(sim_name, rho_list, t_list, n_list,
+                                          a_list, existing_only)
         x_iso = f"{filename}r_iso.dat"
         y_iso = f"{filename}rdf_iso.dat"
         with open(x_iso, 'w+') as f_x, open(y_iso, 'w+') as f_y:
             f_x.write('rho\tT\ta\tr_iso\n')
             f_y.write('rho\tT\ta\tr_iso\n')
-            for rho in rho_list:
-                for t in t_list:
-                    for a in a_list:
-                        r_iso, rdf_iso = self.rdf_intersect(
-                            sim_name, rho, t, n_list, a, r_lower=100)
-                        # ! TODO: see every r_iso used for debug
-                        print(f"rho {rho} T: {t} A: {a}")
-                        plt.show()
-
-                        # Clean data before writting to file
-                        line_x = f"{rho}{delimiter}" \
-                                 f"{t}{delimiter}" \
-                                 f"{a}{delimiter}{r_iso}\n"
-                        line_x = line_x.replace('[', '')
-                        line_x = line_x.replace(']', '')
-                        line_x = line_x.replace(', ', delimiter)
-
-                        line_y = f"{rho}{delimiter}{t}" \
-                                 f"{delimiter}{a}" \
-                                 f"{delimiter}{rdf_iso}\n"
-                        line_y = line_y.replace('[', '')
-                        line_y = line_y.replace(']', '')
-                        line_y = line_y.replace(', ', delimiter)
-
-                        f_x.write(line_x)
-                        f_y.write(line_y)
+
+            for rho, t, a, r_iso, rdf_iso in self._sweep_intersections(
+                    sim_name, state_points, n_list, workers):
+                f_x.write(self._iso_line(rho, t, a, r_iso, delimiter))
+                f_y.write(self._iso_line(rho, t, a, rdf_iso, delimiter))
+
+    @profiled
+    def get_intersections_to_store(self, sim_name, rho_list, t_list, n_list,
+                                   a_list, fname=ISO_STORE_FILE,
+                                   existing_only=False,
+                                   workers=None):
+        """
+        Same sweep as get_intersections_to_file, but the intersections of
+        every state point are appended to a binary IsoStore, indexed on
+        (rho, T, a), instead of being written to two text files.
+
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param rho_list: list of densities
+        @:param t_list: list of temperatures
+        @:param n_list: list of pair potential strengths
+        @:param a_list: list of softening parameters
+        @:param fname: path to the store, created if it does not exist
+        @:param existing_only: only sweep over the indexed state points
+        @:param workers: number of worker processes for a headless sweep,
+                        values < 1 use every available core
+        @:return: the IsoStore
+        """
+        state_points = self._state_points(sim_name, rho_list, t_list, n_list,
+                                          a_list, existing_only)
+        store = IsoStore(fname)
+        store.extend((rho, t, a, n_list, r_iso, rdf_iso)
+                     for rho, t, a, r_iso, rdf_iso in self._sweep_intersections(
+                         sim_name, state_points, n_list, workers))
+        return store
+
+    def _state_points(self, sim_name, rho_list, t_list, n_list, a_list,
+                      existing_only=False):
+        """
+        (rho, t, a) of a sweep, with existing_only only those that have an
+        RDF file for every n in self.catalog.
+        """
+        if existing_only is True and self.catalog is None:
+            raise ValueError("existing_only requires a catalog, "
+                             "set self.catalog to a RunCatalog")
+
+        state_points = [(rho, t, a) for rho in rho_list
+                        for t in t_list for a in a_list]
+        if existing_only is True:
+            state_points = [(rho, t, a) for rho, t, a in state_points
+                            if self.catalog.has_state_point(
+                                sim_name, self.steps_str, self.p_str,
+                                rho, t, n_list, a)]
+        return state_points
+
+    def _sweep_intersections(self, sim_name, state_points, n_list, workers):
+        """
+        Generator of (rho, t, a, r_iso, rdf_iso) for every state point,
+        in the order of state_points.
+        """
+        if workers is None:
+            for rho, t, a in state_points:
+                r_iso, rdf_iso = self.rdf_intersect(
+                    sim_name, rho, t, n_list, a, r_lower=100)
+                # ! TODO: see every r_iso used for debug
+                print(f"rho {rho} T: {t} A: {a}")
+                plt.show()
+                yield rho, t, a, r_iso, rdf_iso
+            return
+
+        if workers < 1:
+            workers = os.cpu_count()
+        tasks = [(self.steps_str, self.p_str, self.catalog,
+                  sim_name, rho, t, n_list, a) for rho, t, a in state_points]
+        chunksize = max(1, len(tasks) // (4 * workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map yields the results in submission order,
+            # as soon as each of them is available
+            for result in executor.map(_intersect_state_point, tasks,
+                                       chunksize=chunksize):
+                yield result
 
     @staticmethod
-    def plot_intersection(rho, t, fname='r_iso.dat', **kwargs):
+    def _iso_line(rho, t, a, values, delimiter):
+        values = delimiter.join(str(float(v)) for v in values)
+        return f"{rho}{delimiter}{t}{delimiter}{a}{delimiter}{values}\n"
+
+    @staticmethod
+    @profiled
+    def plot_intersection(rho, t, fname=None, k=0, **kwargs):
+        """
+        Plots r_iso against a for a density and temperature.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param fname: an IsoStore, or a r_iso.dat text file written by
+                      get_intersections_to_file, see default_iso_file
+        @:param k: which intersection of the state points to plot,
+                  only used with an IsoStore
+        """
+        fname = default_iso_file(fname)
+        if is_iso_store(fname):
+            phase("load")
+            a_list, __, r_iso, __ = IsoStore(fname).curve(rho, t)
+            phase("plot")
+            plt.figure(f"r_iso Intersections with T: {t}")
+            name = fr"$\rho$: {rho}  T: {t}"
+            plt.plot(a_list, r_iso[:, k] if r_iso.shape[1] > k
+                     else np.full(len(a_list), np.nan), label=name, **kwargs)
+            plt.legend(loc="best")
+            return
+
         # Read rho and T from file if it matches rho and T read
         data = f"{fname}"
+        load = phase("load", data)
         rho_list, t_list, a_list, r_iso_list = np.loadtxt(
             data, usecols=(0, 1, 2, 3), unpack=True, skiprows=1)
+        load.add(rows=len(rho_list))
+        phase("plot")
 
         # Keep only relevant data from file.
         # Probably there is an easier way of doing it
@@ -385,3 +623,62 @@ class RDFAnalysis(StatQ):
         name = fr"$\rho$: {rho}  T: {t}"
         plt.plot(a_list, r_iso_list, label=name, **kwargs)
         plt.legend(loc="best")
+
+    @staticmethod
+    @profiled
+    def plot_intersections(fname=None, rho_list=None, t_list=None,
+                           k=0, **kwargs):
+        """
+        Plots r_iso against a for every (rho, T) of a table, with one
+        figure per temperature, like plot_intersection called for every
+        pair. The table is read once and split into curves with a single
+        sort, and the curves of a figure are drawn as one LineCollection.
+
+        @:param fname: an IsoStore, or a r_iso.dat text file written by
+                      get_intersections_to_file, see default_iso_file
+        @:param rho_list: densities to plot, all of them if None
+        @:param t_list: temperatures to plot, all of them if None
+        @:param k: which intersection of the state points to plot
+        @:param kwargs: keyword arguments of the LineCollections
+        @:return: dictionary of the LineCollection of every temperature
+        """
+        fname = default_iso_file(fname)
+        load = phase("load", fname)
+        table = read_iso_table(fname)
+        load.add(rows=len(table["rho"]))
+        phase("compute")
+        t_curve, rho_curve, a_curves, r_curves = group_curves(
+            table, k, rho_list, t_list)
+
+        phase("plot")
+        lines = {}
+        for t in np.unique(t_curve).tolist():
+            curves = np.nonzero(t_curve == t)[0]
+            segments = [np.column_stack((a_curves[i], r_curves[i]))
+                        for i in curves]
+            colours = [f"C{j % 10}" for j in range(len(curves))]
+            plt.figure(f"r_iso Intersections with T: {t}")
+            ax = plt.gca()
+            lines[t] = mcollections.LineCollection(segments, colors=colours,
+                                                   **kwargs)
+            ax.add_collection(lines[t])
+            ax.autoscale_view()
+            # A single collection has no entry per curve in the legend
+            handles = [mlines.Line2D([], [], color=c,
+                                     label=fr"$\rho$: {rho_curve[i]}  T: {t}")
+                       for c, i in zip(colours, curves)]
+            ax.legend(handles=handles, loc="best")
+        return lines
+
+
+def _intersect_state_point(task):
+    """
+    Worker of the headless intersection sweep. Runs in a separate process
+    and never touches matplotlib.
+    """
+    steps, particles, catalog, sim_name, rho, t, n_list, a = task
+    analysis = RDFAnalysis(steps, particles)
+    analysis.catalog = catalog
+    r_iso, rdf_iso = analysis.rdf_intersect(sim_name, rho, t, n_list, a,
+                                            r_lower=100, plot=False)
+    return rho, t, a, r_iso, rdf_iso
@@ -0,0 +1,190 @@
+import numpy as np
+from mdtools._lazy import lazy_import
+from mdtools.profiling import profiled, phase
+
+signal = lazy_import("scipy.signal")
+
+"""
+Batched version of RDFAnalysis.rdf_intersect.
+
+All the RDFs of a sweep are stacked into arrays of shape
+(rho, T, a, n, r) and every step of the intersection search (smoothing,
+resampling, mean/std across n, local extrema and the search for the
+minimum std between them) is done with whole-array operations,
+instead of once per state point.
+"""
+
+
+def batch_interp(x_new, x, y):
+    """
+    Linear interpolation of many curves in a single call.
+
+    @param x_new: 1D array with the common grid
+    @param x: (..., R) array, monotonically increasing along the last axis
+    @param y: (..., R) array with the values of the curves
+    @return: (..., len(x_new)) array of the curves sampled on x_new
+    """
+    lead = x.shape[:-1]
+    n_pts = x.shape[-1]
+    x2 = x.reshape(-1, n_pts)
+    y2 = y.reshape(-1, n_pts)
+    rows = x2.shape[0]
+
+    # Shift every row to its own disjoint interval, so that one
+    # searchsorted over the flattened array finds the brackets of all rows
+    x_min = min(x2.min(), x_new.min())
+    span = max(x2.max(), x_new.max()) - x_min + 1.
+    offset = np.arange(rows)[:, np.newaxis] * span
+    flat = (x2 - x_min + offset).ravel()
+    query = (x_new[np.newaxis, :] - x_min + offset)
+
+    idx = np.searchsorted(flat, query.ravel(), side='right') - 1
+    idx = idx.reshape(rows, -1)
+    row_start = np.arange(rows)[:, np.newaxis] * n_pts
+    idx = np.clip(idx, row_start, row_start + n_pts - 2)
+
+    x_flat, y_flat = x2.ravel(), y2.ravel()
+    x0, x1 = x_flat[idx], x_flat[idx + 1]
+    y0, y1 = y_flat[idx], y_flat[idx + 1]
+    weight = (x_new[np.newaxis, :] - x0) / (x1 - x0)
+    out = y0 + weight * (y1 - y0)
+    return out.reshape(lead + (len(x_new),))
+
+
+def batch_smooth(y, filter_order=3, filter_cutoff=0.09, ignore_zeroes=True):
+    """
+    Forward-backward low-pass filter applied along the last axis of y.
+    With ignore_zeroes the leading zeroes of every curve are excluded from
+    the filter and kept as they are, like rdf_interpolate_smooth does.
+    Curves with the same number of leading zeroes are filtered together.
+
+    @param y: (..., R) array of RDF curves
+    @param filter_order: order of the butterworth filter
+    @param filter_cutoff: normalised cut-off frequency of the filter
+    @param ignore_zeroes: do not filter the leading zeroes
+    @return: array with the same shape as y
+    """
+    b, a = signal.butter(filter_order, filter_cutoff)
+    if ignore_zeroes is False:
+        return signal.filtfilt(b, a, y, axis=-1)
+
+    y2 = y.reshape(-1, y.shape[-1])
+    smooth = y2.copy()
+    # Number of zeroes at the start of every curve
+    leading = np.argmax(y2 != 0, axis=-1)
+    for zeros in np.unique(leading):
+        rows = np.nonzero(leading == zeros)[0]
+        smooth[rows, zeros:] = signal.filtfilt(b, a, y2[rows, zeros:], axis=-1)
+    return smooth.reshape(y.shape)
+
+
+def local_extrema(y):
+    """
+    Boolean masks of the local maxima and minima along the last axis.
+    The last global minimum of every curve is added to the minima,
+    as in RDFAnalysis.find_local_min_max.
+
+    @param y: (..., R) array
+    @return: is_max, is_min boolean arrays of the same shape as y
+    """
+    is_max = np.zeros(y.shape, dtype=bool)
+    is_min = np.zeros(y.shape, dtype=bool)
+    is_max[signal.argrelextrema(y, np.greater, axis=-1)] = True
+    is_min[signal.argrelextrema(y, np.less, axis=-1)] = True
+
+    last_min = y.shape[-1] - 1 - np.argmin(y[..., ::-1], axis=-1)
+    np.put_along_axis(is_min, last_min[..., np.newaxis], True, axis=-1)
+    return is_max, is_min
+
+
+@profiled
+def find_intersections(r, rdf, range_refinement=2000, r_lower=0, r_higher=-1,
+                       intersections=1, filter_order=3, filter_cutoff=0.09,
+                       ignore_zeroes=True, tolerance=0.05):
+    """
+    Finds the intersections of the RDF curves of every state point at once.
+    The search is the same as RDFAnalysis.rdf_intersect: the curves are
+    smoothed and resampled, the local extrema of the last curve split the
+    r range into segments and in every segment with a large enough
+    variation, the points with the smallest std across n are intersections.
+
+    @param r: (rho, T, a, n, R) array with the radii of the RDFs
+    @param rdf: (rho, T, a, n, R) array with the RDF values
+    @param range_refinement: number of points of the common r grid
+    @param r_lower: lower index bound of the intersection search
+    @param r_higher: upper index bound of the intersection search
+    @param intersections: number of intersections sought in every segment
+    @param filter_order: order of the butterworth filter
+    @param filter_cutoff: normalised cut-off frequency of the filter
+    @param ignore_zeroes: do not filter the leading zeroes of the RDFs
+    @param tolerance: minimum variation of the mean RDF across a segment
+    @return: r_grid, r_iso, g_iso. r_iso and g_iso have shape
+             (rho, T, a, k) and hold the intersections of every state
+             point sorted by segment; missing entries are NaN
+    """
+    # Common grid, covering the range shared by every curve
+    r_grid = np.linspace(r[..., 0].max(), r[..., -1].min(), range_refinement)
+    phase("filter")
+    smooth = batch_smooth(rdf, filter_order, filter_cutoff, ignore_zeroes)
+    phase("interpolate")
+    smooth = batch_interp(r_grid, r, smooth)
+
+    window = slice(r_lower, r_higher)
+    curves = smooth[..., window]
+    r_window = r_grid[window]
+
+    # Single reductions across n over the 4-D (rho, T, a, r) arrays
+    mean = curves.mean(axis=-2)
+    std = curves.std(axis=-2)
+
+    # Extrema of the last curve in n
+    phase("extrema")
+    is_max, is_min = local_extrema(curves[..., -1, :])
+    phase("search")
+
+    points_shape = mean.shape[:-1]
+    n_r = mean.shape[-1]
+    mean2 = mean.reshape(-1, n_r)
+    std2 = std.reshape(-1, n_r)
+    bounds = (is_max | is_min).reshape(-1, n_r)
+
+    # Consecutive extrema of the same state point delimit the segments
+    point, col = np.nonzero(bounds)
+    same_point = point[1:] == point[:-1]
+    lo, hi, seg_point = col[:-1][same_point], col[1:][same_point], \
+        point[:-1][same_point]
+    valid = (np.abs(mean2[seg_point, hi] - mean2[seg_point, lo]) > tolerance) & \
+            (hi - lo >= range_refinement / 20)
+
+    # Label every r index with the segment it belongs to,
+    # segment k of a state point starts at its k-th extremum
+    seg_of = np.cumsum(bounds, axis=-1) - 1
+    keys = np.arange(bounds.shape[0])[:, np.newaxis] * (n_r + 1) + seg_of
+    valid_key = np.zeros(bounds.shape[0] * (n_r + 1), dtype=bool)
+    valid_key[keys[seg_point, lo][valid]] = True
+    in_segment = (seg_of >= 0) & valid_key[np.where(seg_of >= 0, keys, 0)]
+
+    # Sort the candidates by segment and std, keep the first k of every segment
+    cand_point, cand_col = np.nonzero(in_segment)
+    cand_keys = keys[cand_point, cand_col]
+    order = np.lexsort((std2[cand_point, cand_col], cand_keys))
+    cand_point, cand_col, cand_keys = \
+        cand_point[order], cand_col[order], cand_keys[order]
+    __, group_start, group_id = np.unique(cand_keys, return_index=True,
+                                          return_inverse=True)
+    rank = np.arange(len(cand_keys)) - group_start[group_id]
+    keep = rank < intersections
+    cand_point, cand_col = cand_point[keep], cand_col[keep]
+
+    # Scatter into a padded (points, k) table
+    counts = np.bincount(cand_point, minlength=bounds.shape[0])
+    width = max(int(counts.max()) if len(counts) else 0, 1)
+    first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    slot = np.arange(len(cand_point)) - first[cand_point]
+
+    r_iso = np.full((bounds.shape[0], width), np.nan)
+    g_iso = np.full((bounds.shape[0], width), np.nan)
+    r_iso[cand_point, slot] = r_window[cand_col]
+    g_iso[cand_point, slot] = mean2[cand_point, cand_col]
+    return r_grid, r_iso.reshape(points_shape + (width,)), \
+        g_iso.reshape(points_shape + (width,))
@@ -0,0 +1,132 @@
+import os
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+"""
+Memoisation of the processed RDFs.
+
+An entry is addressed by the path of the log, its modification time and
+size, and every parameter of the processing (e.g. range_refinement,
+iso_scale, the filter parameters). A log that is rewritten gets a new key,
+so stale results are never returned. The entries are kept in memory in
+least recently used order within a budget of bytes, and can optionally be
+spilled to .npz files, so that a new session does not reprocess them.
+"""
+
+# Default memory budget of a cache
+MAX_BYTES = 256 * 1024 * 1024
+# Name of the hidden directory, created next to the logs, for the disk tier
+CACHE_DIR = ".mdtools_cache"
+
+
+def make_key(fname, kind, **params):
+    """
+    @param fname: path to the log file the entry is derived from
+    @param kind: name of the processing step, e.g. "rdf" or "smooth"
+    @param params: every parameter that changes the result
+    @return: hashable key of the entry
+    """
+    st = os.stat(fname)
+    return (os.path.abspath(fname), st.st_mtime_ns, st.st_size, kind) + \
+        tuple(sorted(params.items()))
+
+
+class RDFCache(object):
+
+    def __init__(self, max_bytes=MAX_BYTES, disk=False):
+        """
+        @param max_bytes: memory budget of the cached arrays
+        @param disk: also store the entries as .npz files in a hidden
+                     directory next to the logs
+        """
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @staticmethod
+    def disk_path(key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        head, tail = os.path.split(key[0])
+        return os.path.join(head, CACHE_DIR, f"{tail}.{digest[:16]}.npz")
+
+    def get(self, key):
+        """
+        @param key: key from make_key
+        @return: tuple of read-only arrays, or None if not cached
+        """
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        if self.disk is True:
+            try:
+                with np.load(self.disk_path(key)) as npz:
+                    arrays = tuple(npz[f"arr_{i}"] for i in range(len(npz.files)))
+            except (OSError, ValueError, KeyError):
+                arrays = None
+            if arrays is not None:
+                self.hits += 1
+                return self._store(key, arrays)
+        self.misses += 1
+        return None
+
+    def put(self, key, arrays):
+        """
+        @param key: key from make_key
+        @param arrays: tuple of numpy.arrays, they must not be modified
+                       afterwards
+        @return: the cached tuple of read-only arrays
+        """
+        arrays = self._store(key, arrays)
+        if self.disk is True:
+            path = self.disk_path(key)
+            tmp_file = f"{path}.tmp.npz"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                np.savez(tmp_file, *arrays)
+                os.replace(tmp_file, path)
+            except OSError:
+                # Read-only or full directory, keep the arrays in memory only
+                try:
+                    os.remove(tmp_file)
+                except OSError:
+                    pass
+        return arrays
+
+    def get_or_compute(self, key, compute):
+        """
+        @param key: key from make_key
+        @param compute: function without arguments returning the arrays
+        @return: the cached tuple of read-only arrays
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = self.put(key, tuple(compute()))
+        return arrays
+
+    def _store(self, key, arrays):
+        arrays = tuple(np.asarray(a) for a in arrays)
+        for a in arrays:
+            a.setflags(write=False)
+        if key in self._entries:
+            self.nbytes -= sum(a.nbytes for a in self._entries.pop(key))
+        self._entries[key] = arrays
+        self.nbytes += sum(a.nbytes for a in arrays)
+        # Evict the least recently used entries, but keep the newest one
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            __, old = self._entries.popitem(last=False)
+            self.nbytes -= sum(a.nbytes for a in old)
+        return arrays
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
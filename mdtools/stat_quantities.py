@@ -1,6 +1,22 @@
+from collections import deque
 import numpy as np
-import scipy.stats as stats
-import matplotlib.pyplot as plt
+from mdtools._lazy import lazy_import
+from mdtools.log_cache import load_columns
+from mdtools.log_stream import stream_linregress, CHUNK_ROWS
+from mdtools.cell_list import compute_rdf
+from mdtools.trajectory import open_trajectory
+from mdtools.correlations import msd_fft, vaf_fft
+from mdtools.structure_factor import structure_factor
+from mdtools.error_analysis import bootstrap_linregress
+from mdtools.profiling import profiled, phase
+from mdtools.velocity_distribution import VelocityDistribution, \
+    maxwell_pdf, trajectory_velocity_distribution
+
+stats = lazy_import("scipy.stats")
+plt = lazy_import("matplotlib.pyplot")
+
+# Number of interpolated RDFs kept in StatQ.interpolated_data
+INTERPOLATED_HISTORY = 64
 
 
 class FileNaming(object):
@@ -11,6 +27,8 @@ class FileNaming(object):
         self.t_str = None
         self.n_str = None
         self.a_str = None
+        self.catalog = None  # Optional RunCatalog used to resolve the files
+        self.step = 0.005  # Integration time step
 
     def file_searcher(self, rho, t, n=None, alpha=None):
         """
@@ -41,6 +59,64 @@ class FileNaming(object):
 
         return name_id
 
+    def log_file(self, sim_name, kind, rho, t, n=None, alpha=None):
+        """
+        Path to a log of the simulation, e.g. kind="Data" for the
+        {sim_name}Data{file_id}.log file. If a catalog is attached the path
+        is resolved through it, otherwise the filename is relative to the
+        current working directory.
+
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param kind: RDF, Data, Positions_Velocities, x_data, y_data, z_data
+        @:param rho: density
+        @:param t:   temperature
+        @:param n:   potential strength
+        @:param alpha:   softness parameter
+        @:return: path to the log file
+        """
+        file_id = self.file_searcher(rho, t, n, alpha)
+        if self.catalog is not None:
+            path = self.catalog.find(sim_name, kind, self.steps_str, self.p_str,
+                                     rho, t, n, alpha)
+            if path is not None:
+                return path
+        return f"{sim_name}{kind}{file_id}.log"
+
+    @profiled
+    def trajectory(self, sim_name, rho, t, n=None, alpha=None,
+                   frame_interval=None, timed=False):
+        """
+        Opens the memory-mapped trajectory of the fluid, converting the
+        x, y, z text trajectories on the first call. The text trajectories
+        are resolved like the other logs, see log_file, and the store is
+        written next to them.
+
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param rho: density
+        @:param t:   temperature
+        @:param n:   potential strength
+        @:param alpha:   softness parameter
+        @:param frame_interval: Number of integration steps between two
+                               saved frames. If None the time between the
+                               frames recorded in the store is used
+        @:param timed: Raise a ValueError if the time between the frames
+                      is not known
+        @:return: Trajectory object, indexed as (frames, particles, 3)
+        """
+        sources = tuple(self.log_file(sim_name, f"{axis}_data", rho, t, n,
+                                      alpha) for axis in "xyz")
+        file_id = self.file_searcher(rho, t, n, alpha)
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+        time_step = None
+        if frame_interval is not None:
+            time_step = frame_interval * self.step / np.sqrt(t)
+        traj = open_trajectory(sim_name, file_id, box_length, time_step,
+                               sources)
+        if timed and traj.time_step <= 0:
+            raise ValueError(f"The time between the saved frames of "
+                             f"{traj.fname} is unknown, pass frame_interval")
+        return traj
+
     @staticmethod
     def get_label(file_id):
         name = file_id.replace("_", " ")
@@ -57,7 +133,8 @@ class StatQ(FileNaming):
         self.dif_err = np.array([])
         self.dif_y_int = np.array([])
         self.line_style = ['solid', 'dashed', 'dotted', 'dashdot']
-        self.interpolated_data = []
+        # Only the most recent interpolated RDFs are kept
+        self.interpolated_data = deque(maxlen=INTERPOLATED_HISTORY)
         self.step = 0.005
 
         # This is an iterator for the color array
@@ -74,6 +151,7 @@ class StatQ(FileNaming):
         self.iso = 0  # x-location for the theoretical isosbestic points
 
     # Radial Distribution Function
+    @profiled
     def rdf(self, sim_name, rho, t, power=None, par_a=None, iso_scale=False):
         """
         Reads the data corresponding to the Radial Distribution Function from
@@ -88,10 +166,12 @@ class StatQ(FileNaming):
         @:return: The numpy.array for the RDF data
 
         """
-        file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}RDF{file_id}.log"
+        data = self.log_file(sim_name, "RDF", rho, t, power, par_a)
+        load = phase("load", data)
         self.r, self.rdf_data = np.loadtxt(data, delimiter="\t",
-                                           usecols=(0, 1), comments="#")
+                                           usecols=(0, 1), comments="#",
+                                           unpack=True)
+        load.add(rows=len(self.r))
 
         # Isomorphic scaling of r for the isomorph plane
         if iso_scale is True:
@@ -100,6 +180,44 @@ class StatQ(FileNaming):
         # return the plotting lists
         return self.r, self.rdf_data
 
+    @profiled
+    def rdf_from_positions(self, sim_name, rho, t, power=None, par_a=None,
+                           dr=0.01, r_max=None, frames=None):
+        """
+        Computes the Radial Distribution Function from the particle
+        positions, instead of reading the RDF binned by the simulation.
+        This allows any bin width and cut-off radius up to half the box.
+        The pairs are found with a periodic cell list.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param dr: Width of the histogram bins
+        @:param r_max: Largest distance of the RDF, defaults to self.rg
+        @:param frames: If None the last snapshot, Positions_Velocities,
+                       is used. Otherwise a slice (or index) of the frames
+                       of the x, y, z trajectories to average over
+        @:return: The numpy.arrays of r and the RDF data
+        """
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+        if r_max is None:
+            r_max = self.rg
+
+        phase("load")
+        if frames is None:
+            data = self.log_file(sim_name, "Positions_Velocities",
+                                 rho, t, power, par_a)
+            positions = np.column_stack(load_columns(data, usecols=(0, 1, 2)))
+        else:
+            traj = self.trajectory(sim_name, rho, t, power, par_a)
+            positions = traj[frames]
+
+        phase("compute")
+        self.r, self.rdf_data = compute_rdf(positions, box_length, r_max, dr)
+        return self.r, self.rdf_data
+
+    @profiled
     def rdf_plot(self, sim_name, rho, t, power=None, par_a=None,
                  iso_scale=False, show_label=True, **kwargs):
         """
@@ -118,21 +236,32 @@ class StatQ(FileNaming):
         @:param show_label:
         """
         self.rdf(sim_name, rho, t, power, par_a, iso_scale)
-        plt.figure('Interpolated RDF')
-
-        max_scaling = np.max(self.rdf_data)  # Scaling the ymax
-
+        phase("plot")
         # Naming the curves
         file_id = self.file_searcher(rho, t, power, par_a)
-        name = self.get_label(file_id)
-        plt.plot(self.r, self.rdf_data, markersize=4, label=name, **kwargs)
+        self.draw_rdf(self.r, self.rdf_data, self.get_label(file_id),
+                      show_label, **kwargs)
+
+    def draw_rdf(self, r, rdf_data, label, show_label=True, **kwargs):
+        """
+        Draws a Radial Distribution Function, see rdf_plot.
+
+        @:param r: radius
+        @:param rdf_data: g(r)
+        @:param label: label of the curve
+        @:param show_label: Draw the legend
+        """
+        plt.figure('Interpolated RDF')
+
+        max_scaling = np.max(rdf_data)  # Scaling the ymax
+        plt.plot(r, rdf_data, markersize=4, label=label, **kwargs)
 
         # Plot labels
         plt.xlabel(r"$r$")
         plt.ylabel(r"$g(r)$")
 
         # Line through y = 1
-        plt.plot([0, self.r[-1]], [1, 1], '--', color='black', linewidth=0.5)
+        plt.plot([0, r[-1]], [1, 1], '--', color='black', linewidth=0.5)
 
         # Plot limits and legends
         plt.xlim(left=0, right=self.rg)
@@ -141,6 +270,35 @@ class StatQ(FileNaming):
             plt.legend(loc="best", fancybox=True, prop={'size': 8})
 
     # Velocity Autocorrelation Function
+    @profiled
+    def vaf_data(self, sim_name, rho, t, power=None, par_a=None,
+                 iso_scale=False):
+        """
+        Reads the Velocity Autocorrelation Function from the Data log.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param iso_scale: Scale the time on the isosbestic point
+        @:return: The numpy.arrays of the time and C(t)
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+
+        phase("load")
+        cr = load_columns(data, usecols=8)
+
+        num_lines = int(len(cr))
+        time_step = self.step / np.sqrt(t)
+        time_max = time_step * num_lines
+        time = np.linspace(0, time_max, num_lines)
+
+        # Scale the x-data on the isosbestic point
+        if iso_scale is True:
+            time = time * (rho ** (1.0 / 3.0)) * (t ** 0.5)
+        return time, cr
+
+    @profiled
     def vaf(self, sim_name, rho, t, power=None, par_a=None, iso_scale=False, **kwargs):
         """
         Creates a figure for the Velocity Autocorrelation Function of the fluid,
@@ -155,73 +313,242 @@ class StatQ(FileNaming):
         @:return: Nothing. Simply adds a plot on the corresponding canvas
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Data{file_id}.log"
+        time, cr = self.vaf_data(sim_name, rho, t, power, par_a, iso_scale)
 
-        cr = np.loadtxt(data, usecols=8, delimiter='\t',
-                        unpack=True, comments='#')
-
-        num_lines = int(len(cr))
-        time_step = self.step / np.sqrt(t)
-        time_max = time_step * num_lines
-        time = np.linspace(0, time_max, num_lines)
+        phase("plot")
+        self.draw_vaf(time, cr, self.get_label(file_id), **kwargs)
 
-        name = self.get_label(file_id)
+    @staticmethod
+    def draw_vaf(time, cr, label, **kwargs):
+        """
+        Draws a Velocity Autocorrelation Function against time.
 
+        @:param time: time
+        @:param cr: C(t)
+        @:param label: label of the curve
+        """
         plt.figure('Velocity Autocorrelation Function')
-        y = np.full(num_lines, 0)
+        plt.plot(time, np.zeros(len(time)), '--', color='black')
+        plt.plot(time, cr, label=label, **kwargs)
+        plt.xlabel(r"Time $t$", fontsize=16)
+        plt.ylabel(r"$C_r$", fontsize=16)
+
+        plt.xlim(left=time[0], right=time[-1])
+        plt.legend(loc="best", ncol=1)
+
+    @profiled
+    def vaf_multi_origin(self, sim_name, rho, t, power=None, par_a=None,
+                         iso_scale=False, max_lag=None, block=None,
+                         frame_interval=None, **kwargs):
+        """
+        Plots the normalised Velocity Autocorrelation Function computed from
+        the x, y, z trajectories and averaged over every time origin with
+        FFT correlations. The velocities are the finite differences of the
+        stored frames, so the time resolution is that of the trajectory.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param iso_scale: Scale the time on the isosbestic point, as in vaf
+        @:param max_lag: Largest lag used, defaults to half the frames
+        @:param block: Number of particles processed at once
+        @:param frame_interval: Number of integration steps between two
+                               saved frames, see trajectory
+        @:return: The numpy.arrays of the time and C(t)
+        """
+        file_id = self.file_searcher(rho, t, power, par_a)
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+        phase("load")
+        traj = self.trajectory(sim_name, rho, t, power, par_a,
+                               frame_interval, timed=True)
+        if max_lag is None:
+            max_lag = len(traj) // 2
+        phase("compute")
+
+        cr = vaf_fft(traj, block, max_lag, time_step=traj.time_step,
+                     box_length=box_length)
+        time = np.arange(len(cr)) * traj.time_step
 
         # Scale the x-data on the isosbestic point
         if iso_scale is True:
             time = time * (rho ** (1.0 / 3.0)) * (t ** 0.5)
 
-        plt.plot(time, y, '--', color='black')
-        plt.plot(time, cr, label=name, **kwargs)
-        plt.xlabel(r"Time $t$", fontsize=16)
-        plt.ylabel(r"$C_r$", fontsize=16)
+        phase("plot")
+        self.draw_vaf(time, cr, self.get_label(file_id), **kwargs)
 
-        plt.xlim(left=time[0], right=time[-1])
-        plt.legend(loc="best", ncol=1)
+        return time, cr
 
     # Mean Square Displacement
-    def msd(self, sim_name, rho, t, power=None, par_a=None, **kwargs):
+    @profiled
+    def msd_data(self, sim_name, rho, t, power=None, par_a=None):
         """
-        Plots the Mean Square Displacement for our fluid.
-        According to diffusion theory the slope of the MSD corresponds
-        to the inverse of the diffusion coefficient.
+        Reads the Mean Square Displacement from the Data log and fits
+        a line to it, whose slope is the diffusion coefficient.
 
         @:param rho: Density
         @:param t: Temperature
         @:param power: Pair potential strength
         @:param par_a: Softening parameter
-        @:return: msd list
+        @:return: The numpy.arrays of the time and the MSD, and the
+                 gradient, intercept and standard error of the fit
         """
-        file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Data{file_id}.log"
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
 
-        msd_data = np.loadtxt(data, usecols=7,
-                              delimiter='\t', unpack=True)
+        phase("load")
+        msd_data = load_columns(data, usecols=7)
 
+        phase("compute")
         num_lines = int(len(msd_data))
         step = self.step / np.sqrt(t)
         x = np.linspace(0*step, (num_lines - 1)*step, num=num_lines)
 
         # Perform a linear fit to the MSD data and get fit parameters
         grad, intercept, rms, p_val, std = stats.linregress(x, msd_data)
+        return x, msd_data, grad, intercept, std
+
+    @profiled
+    def msd(self, sim_name, rho, t, power=None, par_a=None, **kwargs):
+        """
+        Plots the Mean Square Displacement for our fluid.
+        According to diffusion theory the slope of the MSD corresponds
+        to the inverse of the diffusion coefficient.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:return: msd list
+        """
+        file_id = self.file_searcher(rho, t, power, par_a)
+        x, msd_data, grad, intercept, std = self.msd_data(sim_name, rho, t,
+                                                          power, par_a)
         self.dif_coef = np.append(self.dif_coef, grad)
         self.dif_err = np.append(self.dif_err, std)
         self.dif_y_int = np.append(self.dif_y_int, intercept)
 
-        name = self.get_label(file_id)
+        phase("plot")
+        self.draw_msd(x, msd_data, self.get_label(file_id), **kwargs)
+
+        return msd_data
+
+    @staticmethod
+    def draw_msd(x, msd_data, label, **kwargs):
+        """
+        Draws a Mean Square Displacement against time.
+
+        @:param x: time
+        @:param msd_data: MSD
+        @:param label: label of the curve
+        """
         plt.figure('Mean Square Displacement')
-        plt.plot(x, msd_data, label=name, **kwargs)
+        plt.plot(x, msd_data, label=label, **kwargs)
         plt.xlim(left=0, right=x[-1])
         plt.xlabel(r"$t$")
         plt.ylabel(r"$MSD$")
         plt.legend(loc="best", fancybox=True)
 
+    @profiled
+    def msd_multi_origin(self, sim_name, rho, t, power=None, par_a=None,
+                         unwrap_pbc=True, max_lag=None, block=None,
+                         frame_interval=None, **kwargs):
+        """
+        Plots the Mean Square Displacement computed from the x, y, z
+        trajectories, averaged over every time origin with the FFT
+        algorithm. It is far less noisy than the single origin MSD of the
+        Data log. The diffusion coefficient is fitted as in msd.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param unwrap_pbc: Unwrap the periodic boundary conditions
+        @:param max_lag: Largest lag used, defaults to half the frames,
+                        since the longer lags are averaged over few origins
+        @:param block: Number of particles processed at once
+        @:param frame_interval: Number of integration steps between two
+                               saved frames, see trajectory
+        @:return: msd list
+        """
+        file_id = self.file_searcher(rho, t, power, par_a)
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+        phase("load")
+        traj = self.trajectory(sim_name, rho, t, power, par_a,
+                               frame_interval, timed=True)
+        if max_lag is None:
+            max_lag = len(traj) // 2
+        phase("compute")
+
+        msd_data = msd_fft(traj, box_length, unwrap_pbc, block, max_lag)
+        x = np.arange(len(msd_data)) * traj.time_step
+
+        # Perform a linear fit to the MSD data and get fit parameters
+        grad, intercept, rms, p_val, std = stats.linregress(x, msd_data)
+        self.dif_coef = np.append(self.dif_coef, grad)
+        self.dif_err = np.append(self.dif_err, std)
+        self.dif_y_int = np.append(self.dif_y_int, intercept)
+
+        phase("plot")
+        self.draw_msd(x, msd_data, self.get_label(file_id), **kwargs)
+
         return msd_data
 
-    def diffusion_plot(self, sim_name, rho, t, power, my_list):
+    @profiled
+    def msd_fit(self, sim_name, rho, t, power=None, par_a=None,
+                chunk_rows=CHUNK_ROWS):
+        """
+        Performs the same linear fit to the MSD data as msd, but streams
+        the Data log in chunks, so it works on logs larger than the memory.
+        Nothing is plotted.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param chunk_rows: Maximum number of rows held in memory
+        @:return: gradient, intercept and standard error of the fit
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+
+        step = self.step / np.sqrt(t)
+        grad, intercept, rms, p_val, std = stream_linregress(
+            data, 7, dx=step, chunk_rows=chunk_rows)
+        self.dif_coef = np.append(self.dif_coef, grad)
+        self.dif_err = np.append(self.dif_err, std)
+        self.dif_y_int = np.append(self.dif_y_int, intercept)
+
+        return grad, intercept, std
+
+    @profiled
+    def diffusion_error(self, sim_name, rho, t, power=None, par_a=None,
+                        block_length=None, n_boot=1000, seed=None):
+        """
+        Gradient of the MSD with an error from a moving block bootstrap.
+        Unlike the standard error of linregress, it accounts for the
+        correlation of consecutive MSD samples.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param block_length: Number of samples of a bootstrap block,
+                             estimated by blocking the residuals if None
+        @:param n_boot: Number of bootstrap resamples
+        @:param seed: Seed of the random number generator
+        @:return: gradient, its error, intercept and its error
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+
+        phase("load")
+        msd_data = load_columns(data, usecols=7)
+        phase("compute")
+        step = self.step / np.sqrt(t)
+        x = np.arange(len(msd_data)) * step
+        return bootstrap_linregress(x, msd_data, block_length, n_boot, seed)
+
+    @profiled
+    def diffusion_plot(self, sim_name, rho, t, power, my_list, stream=False,
+                       multi_origin=False, frame_interval=None):
         """
         A graph of the Diffusion coefficients D against a list of parameter A
 
@@ -229,54 +556,117 @@ class StatQ(FileNaming):
         @:param t: Temperature
         @:param power: Potential strength parameter n
         @:param my_list: List of parameter A coefficients
+        @:param stream: Fit the MSD with msd_fit, without loading
+                        or plotting the whole MSD
+        @:param multi_origin: Fit the multi-origin MSD of the trajectories,
+                             see msd_multi_origin
+        @:param frame_interval: Number of integration steps between two
+                               saved frames, used with multi_origin
         @:return: Figure of D vs A for a given number of iterations
         """
 
         for i in my_list:
-            self.msd(sim_name, rho, t, power, i)
+            if multi_origin is True:
+                self.msd_multi_origin(sim_name, rho, t, power, i,
+                                      frame_interval=frame_interval)
+            elif stream is True:
+                self.msd_fit(sim_name, rho, t, power, i)
+            else:
+                self.msd(sim_name, rho, t, power, i)
             print("-----------------------------")
-        name = f"n: {power}"
+        phase("plot")
+        self.draw_diffusion(my_list, self.dif_coef, f"n: {power}",
+                            self.dif_err)
+
+        # Resetting the Best Fit model
+        self.dif_coef, self.dif_err, self.dif_y_int = np.array(
+            []), np.array([]), np.array([])
+        self.j += 15
+        self.v += 1
+
+    @staticmethod
+    def draw_diffusion(a_list, dif_coef, label, dif_err=None):
+        """
+        Draws the diffusion coefficients against the parameter A.
 
+        @:param a_list: values of A
+        @:param dif_coef: diffusion coefficients
+        @:param label: label of the curve
+        @:param dif_err: optional errors of the coefficients
+        """
         plt.figure('Diffusion coefficients D vs A')
-        plt.plot(my_list, self.dif_coef, '--o', label=name, markersize=3.5)
+        plt.errorbar(a_list, dif_coef, yerr=dif_err, fmt='--o', label=label,
+                     markersize=3.5)
         plt.xlabel(r"$a$")
         plt.ylabel(r"$D$")
         plt.legend(loc="best", fancybox=True, ncol=2)
-
-        # Resetting the Best Fit model
-        self.dif_coef, self.dif_err, self.dif_y_int = np.array(
-            []), np.array([]), np.array([])
         plt.ylim(bottom=0)
         plt.xlim(left=0)
-        self.j += 15
-        self.v += 1
 
-    def vel_dist(self, sim_name, rho, t, power=None, par_a=None):
+    @profiled
+    def vel_dist_data(self, sim_name, rho, t, power=None, par_a=None,
+                      bins=150):
+        """
+        Bins the velocities of the last saved position of the fluid,
+        see vel_dist.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param bins: Number of bins of every histogram
+        @:return: The VelocityDistribution of the snapshot
+        """
+        data = self.log_file(sim_name, "Positions_Velocities", rho, t, power, par_a)
+
+        phase("load")
+        velocities = np.column_stack(load_columns(data, usecols=(3, 4, 5)))
+
+        phase("compute")
+        # The range ends just above the fastest particle, so that every
+        # value falls inside the histograms
+        v_max = np.sqrt(np.einsum("ij,ij->i", velocities, velocities).max())
+        dist = VelocityDistribution(np.nextafter(v_max, np.inf), bins)
+        dist.update(velocities)
+        return dist
+
+    @profiled
+    def vel_dist(self, sim_name, rho, t, power=None, par_a=None, bins=150):
         """
         Plots the velocity distributions for the X, Y, Z and
         the combined velocity vector for the last saved position of the fluid.
+        The four histograms are binned in a single pass, and the Maxwell
+        distribution uses the closed form scale sqrt(<v^2> / 3).
 
         @:param rho: Density
         @:param t: Temperature
         @:param power: Pair potential strength
         @:param par_a: Softening parameter
-        @:return: Nothing. Simply adds a plot on the corresponding canvas
+        @:param bins: Number of bins of every histogram
+        @:return: The VelocityDistribution of the snapshot
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Positions_Velocities{file_id}.log"
+        dist = self.vel_dist_data(sim_name, rho, t, power, par_a, bins)
+
+        phase("plot")
+        self.draw_vel_dist(dist.density(), dist.component_edges,
+                           dist.speed_edges, dist.scale,
+                           self.get_label(file_id))
+        return dist
 
-        vx, vy, vz = np.loadtxt(data,
-                                usecols=(3, 4, 5),
-                                delimiter='\t',
-                                comments='#',
-                                unpack=True)
-        v = np.sqrt(np.square(vx) + np.square(vy) + np.square(vz))
+    @staticmethod
+    def draw_vel_dist(density, component_edges, speed_edges, scale, label):
+        """
+        Draws the velocity distributions of a snapshot, see vel_dist.
 
-        xmin, xmax = 0, max(v) + 1
-        x = np.linspace(xmin, xmax, len(v))
-        # m, var, skew, kurt = stats.maxwell.stats(moments='mvsk')
-        mean, std = stats.maxwell.fit(v, loc=0, scale=1)
-        pdf_mb = stats.maxwell.pdf(x, mean, std)
+        @:param density: VelocityDistribution.density() of vx, vy, vz and v
+        @:param component_edges: bin edges of vx, vy and vz
+        @:param speed_edges: bin edges of v
+        @:param scale: scale of the Maxwell distribution
+        @:param label: title of the figure
+        """
+        x = np.linspace(0, speed_edges[-1], 500)
+        pdf_mb = maxwell_pdf(x, scale)
 
         fig = plt.figure('Velocity Dist Vx, Vy, Vz, V')
 
@@ -285,26 +675,86 @@ class StatQ(FileNaming):
         vz_plot = plt.subplot2grid((2, 3), (0, 2), colspan=1)
         v_plot = plt.subplot2grid((2, 3), (1, 0), colspan=3)
 
-        vx_plot.hist(vx, 150, density=1)
-        vx_plot.set_title(r'$v_x$')
-        vy_plot.hist(vy, 150, density=1)
-        vy_plot.set_title(r'$v_y$')
-        vz_plot.hist(vz, 150, density=1)
-        vz_plot.set_title(r'$v_z$')
+        for i, ax in enumerate((vx_plot, vy_plot, vz_plot)):
+            ax.stairs(density[i], component_edges, fill=True)
+            ax.set_title(fr'$v_{"xyz"[i]}$')
 
-        v_plot.hist(v, 150, density=1, label='v')
+        v_plot.stairs(density[3], speed_edges, fill=True, label='v')
         v_plot.plot(x, pdf_mb, label='Theory')
 
         plt.xlim(left=0)
-        plt.title(self.get_label(file_id))
+        plt.title(label)
         plt.legend(loc='best', fancybox=True)
 
+    @profiled
+    def vel_dist_frames(self, sim_name, rho, t, power=None, par_a=None,
+                        bins=150, v_max=None, start=0, stop=None, stride=1,
+                        plot=True, frame_interval=None):
+        """
+        Velocity distribution of the whole run, accumulated frame by frame
+        from the x, y, z trajectories with finite difference velocities.
+        The KL divergence of every frame from the Maxwell-Boltzmann
+        distribution is plotted against time, to check the equilibration,
+        together with the distribution of the speeds of every frame.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param bins: Number of bins of every histogram
+        @:param v_max: Range of the histograms, see
+                      trajectory_velocity_distribution
+        @:param start: First frame
+        @:param stop: Last frame (excluded), defaults to the last saved frame
+        @:param stride: Step between the frames
+        @:param plot: If False nothing is drawn
+        @:param frame_interval: Number of integration steps between two
+                               saved frames, see trajectory
+        @:return: The VelocityDistribution, with the per frame Maxwell
+                 scales and KL divergences in frame_scale and frame_kl
+        """
+        file_id = self.file_searcher(rho, t, power, par_a)
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+        phase("load")
+        traj = self.trajectory(sim_name, rho, t, power, par_a,
+                               frame_interval, timed=True)
+
+        phase("compute")
+        frames, dist = trajectory_velocity_distribution(
+            traj, traj.time_step, box_length, v_max, bins, start, stop, stride)
+        if plot is False:
+            return dist
+
+        phase("plot")
+        name = self.get_label(file_id)
+        time = frames * traj.time_step
+        x = np.linspace(0, dist.v_max, 500)
+
+        fig = plt.figure('Velocity Distribution Equilibration')
+        kl_plot = fig.add_subplot(2, 1, 1)
+        kl_plot.plot(time, dist.frame_kl, label=name)
+        kl_plot.set_xlabel(r"Time $t$")
+        kl_plot.set_ylabel(r"$D_{KL}(P \,||\, P_{MB})$")
+        kl_plot.legend(loc='best', fancybox=True)
+
+        v_plot = fig.add_subplot(2, 1, 2)
+        fig.subplots_adjust(hspace=0.35)
+        v_plot.stairs(dist.density()[3], dist.speed_edges, fill=True,
+                      label='v')
+        v_plot.plot(x, maxwell_pdf(x, dist.scale), label='Theory')
+        v_plot.set_xlabel(r"$v$")
+        v_plot.set_xlim(left=0)
+        v_plot.legend(loc='best', fancybox=True)
+        return dist
+
+    @profiled
     def sf(self, sim_name, rho, t, power=None, par_a=None):
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Data{file_id}.log"
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
 
-        sf = np.loadtxt(data, usecols=(9, 10, 11),
-                        delimiter='\t', comments='#', unpack=True)
+        phase("load")
+        sf = load_columns(data, usecols=(9, 10, 11))
+        phase("plot")
 
         x = np.arange(1, len(sf[0]) + 1)
 
@@ -316,6 +766,64 @@ class StatQ(FileNaming):
             ax[i].legend(loc='best')
         ax[0].set_title(f'Structure Factor {file_id}')
 
+    @profiled
+    def structure_factor(self, sim_name, rho, t, power=None, par_a=None,
+                         k_max=10., dk=None, frames=None):
+        """
+        Computes the static structure factor S(k) from the particle
+        positions, on every wavevector allowed by the periodic box up to
+        k_max, averaged over shells of |k|.
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param k_max: Largest wavevector magnitude
+        @:param dk: Width of the |k| shells, defaults to 2 pi / box length
+        @:param frames: If None the last snapshot, Positions_Velocities,
+                       is used. Otherwise a slice (or index) of the frames
+                       of the x, y, z trajectories to average over
+        @:return: The numpy.arrays of k and S(k)
+        """
+        box_length = (int(self.p_str) / rho) ** (1. / 3.)
+
+        phase("load")
+        if frames is None:
+            data = self.log_file(sim_name, "Positions_Velocities",
+                                 rho, t, power, par_a)
+            positions = np.column_stack(load_columns(data, usecols=(0, 1, 2)))
+        else:
+            traj = self.trajectory(sim_name, rho, t, power, par_a)
+            positions = traj[frames]
+
+        phase("compute")
+        k, s_k, __, __ = structure_factor(positions, box_length, k_max, dk)
+        return k, s_k
+
+    @profiled
+    def structure_factor_plot(self, sim_name, rho, t, power=None, par_a=None,
+                              k_max=10., dk=None, frames=None, **kwargs):
+        """
+        Plots the shell averaged static structure factor S(k).
+
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening parameter
+        @:param k_max: Largest wavevector magnitude
+        @:param dk: Width of the |k| shells
+        @:param frames: Frames of the trajectory to average over
+        @:return: Nothing. Simply adds a plot on the corresponding canvas
+        """
+        k, s_k = self.structure_factor(sim_name, rho, t, power, par_a,
+                                       k_max, dk, frames)
+        phase("plot")
+        file_id = self.file_searcher(rho, t, power, par_a)
+        plt.figure('Structure Factor S(k)')
+        plt.plot(k, s_k, label=self.get_label(file_id), **kwargs)
+        plt.xlabel(r"$k$")
+        plt.ylabel(r"$S(k)$")
+
 
 # %%
 if __name__ == "__main__":
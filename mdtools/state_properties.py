@@ -1,6 +1,18 @@
-import matplotlib.pyplot as plt
 import numpy as np
+from mdtools._lazy import lazy_import
 from mdtools.stat_quantities import FileNaming
+from mdtools.log_cache import load_columns
+from mdtools.log_stream import iter_chunks, RunningMoments, CHUNK_ROWS
+from mdtools.log_follow import DataLogMonitor
+from mdtools.error_analysis import blocking, BlockingAccumulator, bootstrap_mean
+from mdtools.profiling import profiled, phase
+
+plt = lazy_import("matplotlib.pyplot")
+
+# Columns of the Data log that fluctuate around a stationary average. The
+# MSD and the VAF depend on the time, so their averages are meaningless
+AVERAGED_COLUMNS = {"T": 2, "U": 3, "K": 4, "Pc": 5, "Pk": 6,
+                    "SFx": 9, "SFy": 10, "SFz": 11}
 
 
 class StateProperties(FileNaming):
@@ -12,6 +24,27 @@ class StateProperties(FileNaming):
         self.p, self.c = 0, 0
         self.line_it = 0  # Index iterator for line styles
 
+    @profiled
+    def energy_data(self, sim_name, rho, t, power=None, par_a=None):
+        """
+        Reads the potential, kinetic and total energy from the Data log.
+
+        @param rho: Density
+        @param t: Temperature
+        @param power: Pair potential strength
+        @param par_a: Softening parameter
+        @return: the numpy.arrays of the time, U, K and U+K
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+
+        phase("load")
+        pot_en, kin_en = load_columns(data, usecols=(3, 4))
+        num_lines = int(len(pot_en))
+        time = num_lines * self.step
+        x = np.linspace(0, time, num_lines)
+        return x, pot_en, kin_en, pot_en + kin_en
+
+    @profiled
     def energy_plots(self, sim_name, rho, t, power=None, par_a=None):
         """
         Plots the average kinetic, potential and total energy.
@@ -23,17 +56,22 @@ class StateProperties(FileNaming):
         @param par_a: Softening parameter
         @return: Nothing. Simply adds a plot on the corresponding canvas
         """
-        file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Data{file_id}.log"
+        x, pot_en, kin_en, tot_en = self.energy_data(sim_name, rho, t, power,
+                                                     par_a)
+        phase("plot")
+        self.draw_energies(x, pot_en, kin_en, tot_en)
 
-        pot_en, kin_en = np.loadtxt(data, usecols=(3, 4),
-                                    delimiter='\t', comments='#', unpack=True)
-        num_lines = int(len(pot_en))
+    @staticmethod
+    def draw_energies(x, pot_en, kin_en, tot_en):
+        """
+        Draws the energies separately and in a combined graph,
+        see energy_plots.
 
-        tot_en = pot_en + kin_en
-        #  Plots the Energies
-        time = num_lines * self.step
-        x = np.linspace(0, time, num_lines)
+        @param x: time
+        @param pot_en: potential energy
+        @param kin_en: kinetic energy
+        @param tot_en: total energy
+        """
         fig = plt.figure('Energy Plots')
 
         kin_f = plt.subplot2grid((3, 2), (0, 0), colspan=1)
@@ -69,6 +107,113 @@ class StateProperties(FileNaming):
         all_f.plot(x, kin_en, 'r', x, pot_en, 'g', x, tot_en, 'b')
         all_f.set_ylim(top=5)
 
+    @staticmethod
+    def draw_energy(x, energy, label, quantity="U"):
+        """
+        Draws a single energy against time, one curve per state point.
+
+        @param x: time
+        @param energy: values of the energy
+        @param label: label of the curve
+        @param quantity: name of the energy, U, K or U+K
+        """
+        plt.figure(f'Energy {quantity}')
+        plt.plot(x, energy, label=f"{quantity} {label}")
+        plt.xlabel(r"Time $t$")
+        plt.ylabel("Energy units")
+        plt.legend(loc="best", fancybox=True)
+
+    @profiled
+    def energy_averages(self, sim_name, rho, t, power=None, par_a=None,
+                        chunk_rows=CHUNK_ROWS):
+        """
+        Averages and variances of the potential, kinetic and total energy
+        and of the configurational pressure. The Data log is streamed in
+        chunks so that logs larger than the memory can be reduced.
+
+        @param rho: Density
+        @param t: Temperature
+        @param power: Pair potential strength
+        @param par_a: Softening parameter
+        @param chunk_rows: Maximum number of rows held in memory
+        @return: dictionary of (mean, variance) tuples for U, K, U+K and Pc
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+
+        moments = RunningMoments()
+        for chunk in iter_chunks(data, (3, 4, 5), chunk_rows):
+            # Append U+K as a fourth column, reduced in the same pass
+            moments.update(np.column_stack((chunk, chunk[:, 0] + chunk[:, 1])))
+        mean, var = moments.mean, moments.var()
+        return {"U": (mean[0], var[0]), "K": (mean[1], var[1]),
+                "U+K": (mean[3], var[3]), "Pc": (mean[2], var[2])}
+
+    @profiled
+    def averages_with_errors(self, sim_name, rho, t, power=None, par_a=None,
+                             method="blocking", chunk_rows=None, n_boot=1000):
+        """
+        Averages of the columns of the Data log in AVERAGED_COLUMNS and of
+        the total energy U+K, with standard errors that account for the
+        correlation of consecutive samples.
+
+        @param rho: Density
+        @param t: Temperature
+        @param power: Pair potential strength
+        @param par_a: Softening parameter
+        @param method: "blocking" or "bootstrap" (moving block bootstrap)
+        @param chunk_rows: If given, the log is streamed in chunks of this
+                           many rows. Only used by the blocking method
+        @param n_boot: Number of bootstrap resamples
+        @return: dictionary of (mean, error) tuples for every name of
+                 AVERAGED_COLUMNS and U+K
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+        names = tuple(AVERAGED_COLUMNS)
+        usecols = tuple(AVERAGED_COLUMNS.values())
+        u, k = names.index("U"), names.index("K")
+
+        phase("compute")
+        if method == "blocking" and chunk_rows is not None:
+            acc = BlockingAccumulator()
+            for chunk in iter_chunks(data, usecols, chunk_rows):
+                acc.update(np.column_stack((chunk, chunk[:, u] + chunk[:, k])))
+            result = acc.result()
+            mean, err = result.mean, result.error
+        else:
+            series = np.column_stack(load_columns(data, usecols=usecols))
+            series = np.column_stack((series, series[:, u] + series[:, k]))
+            if method == "blocking":
+                result = blocking(series)
+                mean, err = result.mean, result.error
+            elif method == "bootstrap":
+                mean, err = bootstrap_mean(series, n_boot=n_boot)
+            else:
+                raise ValueError(f"Unknown error analysis method {method}")
+        return {name: (mean[i], err[i])
+                for i, name in enumerate(names + ("U+K",))}
+
+    def follow(self, sim_name, rho, t, power=None, par_a=None, interval=2000):
+        """
+        Live plots of the energies, Pc and MSD of a simulation that is still
+        running. Only the rows appended to the Data log since the previous
+        refresh are parsed, and the running averages and the MSD fit are
+        updated with them.
+
+        @param rho: Density
+        @param t: Temperature
+        @param power: Pair potential strength
+        @param par_a: Softening parameter
+        @param interval: Time between refreshes in ms
+        @return: the DataLogMonitor, its averages() and diffusion() hold the
+                 current estimates. A reference must be kept for the
+                 animation to run
+        """
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
+        monitor = DataLogMonitor(data, self.step, self.step / np.sqrt(t))
+        monitor.animate(interval)
+        return monitor
+
+    @profiled
     def potential_data(self, sim_name, rho, t, power=None, par_a=None):
         """
         Plots the average potential energy of the fluid.
@@ -80,10 +225,11 @@ class StateProperties(FileNaming):
         @return: Nothing. Simply adds a plot on the corresponding canvas
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Data{file_id}.log"
+        data = self.log_file(sim_name, "Data", rho, t, power, par_a)
 
-        rho_list, u = np.loadtxt(data, usecols=(1, 3),
-                                 delimiter='\t', comments='#', unpack=True)
+        phase("load")
+        rho_list, u = load_columns(data, usecols=(1, 3))
+        phase("plot")
         num_lines = int(len(u))
 
         #  Plots the Energies
@@ -94,20 +240,45 @@ class StateProperties(FileNaming):
         plt.plot(rho_list, u, label=name)
         plt.legend(loc='best', fancybox=True)
 
-    def pc(self, sim_name, rho, t, power=None, par_a=None):
-        file_id = self.file_searcher(rho, t, power, par_a)
-        pc_name = f"{sim_name}Data{file_id}.log"
+    @profiled
+    def pc_data(self, sim_name, rho, t, power=None, par_a=None):
+        """
+        Reads the configurational pressure from the Data log.
+
+        @param rho: Density
+        @param t: Temperature
+        @param power: Pair potential strength
+        @param par_a: Softening parameter
+        @return: the numpy.arrays of the time and Pc
+        """
+        pc_name = self.log_file(sim_name, "Data", rho, t, power, par_a)
 
-        pc_data = np.loadtxt(pc_name, usecols=5, delimiter='\t',
-                             comments='#', unpack=True)
+        phase("load")
+        pc_data = load_columns(pc_name, usecols=5)
         num_lines = int(len(pc_data))
 
         time = num_lines * self.step
         x = np.linspace(0, time, num=num_lines)
+        return x, pc_data
 
-        name = self.get_label(file_id)
+    @profiled
+    def pc(self, sim_name, rho, t, power=None, par_a=None):
+        file_id = self.file_searcher(rho, t, power, par_a)
+        x, pc_data = self.pc_data(sim_name, rho, t, power, par_a)
+        phase("plot")
+        self.draw_pc(x, pc_data, self.get_label(file_id))
+
+    @staticmethod
+    def draw_pc(x, pc_data, label):
+        """
+        Draws the configurational pressure against time.
+
+        @param x: time
+        @param pc_data: configurational pressure
+        @param label: label of the curve
+        """
         plt.figure('Configurational Pressure')
-        plt.plot(x, pc_data, label=name)
+        plt.plot(x, pc_data, label=label)
         plt.xlabel(r"Time $t$", size=18)
         plt.ylabel(r"Configurational Pressure $P_C$", size=18)
         plt.legend(loc="best", prop={'size': 12},
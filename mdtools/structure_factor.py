@@ -0,0 +1,115 @@
+import numpy as np
+
+"""
+Static structure factor S(k) = <|rho(k)|^2> / N of a periodic fluid,
+with rho(k) = sum_j exp(-i k . r_j), evaluated on every wavevector allowed
+by the box, k = 2 pi n / L, up to k_max.
+
+The exponentials are separable, exp(-i k . r) = e_x[n_x] e_y[n_y] e_z[n_z],
+so only one table of phases per Cartesian axis is computed for each
+particle. For every (n_x, n_y) pair the sum over the particles for all n_z
+at once is then a complex matrix product, which runs through BLAS.
+The particles and the (n_x, n_y) pairs are processed in chunks, so the
+memory used does not grow with the system size.
+"""
+
+# Maximum number of complex values of a work array
+MAX_CHUNK_VALUES = 1 << 22
+
+
+def k_vectors(box_length, k_max):
+    """
+    The wavevectors allowed by the periodic box, with 0 < |k| <= k_max.
+    Since S(k) = S(-k) only one of every +k/-k pair is returned.
+
+    @param box_length: length of the periodic cubic box
+    @param k_max: largest wavevector magnitude
+    @return: (K, 3) integer array n, with k = 2 pi n / box_length
+    """
+    n_max = int(np.floor(k_max * box_length / (2. * np.pi)))
+    m = np.arange(-n_max, n_max + 1)
+    n = np.stack(np.meshgrid(m, m, m, indexing='ij'), axis=-1).reshape(-1, 3)
+    # Half space: first non-zero component positive
+    half = (n[:, 0] > 0) | ((n[:, 0] == 0) & (n[:, 1] > 0)) | \
+           ((n[:, 0] == 0) & (n[:, 1] == 0) & (n[:, 2] > 0))
+    n = n[half]
+    k_sq = np.square(2. * np.pi / box_length) * np.sum(n * n, axis=1)
+    return n[k_sq <= k_max * k_max * (1. + 1e-12)]
+
+
+def density_modes(positions, box_length, n_vectors, chunk=MAX_CHUNK_VALUES):
+    """
+    Collective density modes rho(k) = sum_j exp(-i k . r_j).
+
+    @param positions: (N, 3) array of particle positions
+    @param box_length: length of the periodic cubic box
+    @param n_vectors: (K, 3) integer array from k_vectors
+    @param chunk: maximum number of complex values of a work array
+    @return: (K,) complex array
+    """
+    positions = np.asarray(positions, dtype=np.float64)
+    n_particles = len(positions)
+    if len(n_vectors) == 0:
+        return np.zeros(0, dtype=np.complex128)
+    n_max = int(np.abs(n_vectors).max())
+    m = np.arange(-n_max, n_max + 1)
+
+    # Unique (n_x, n_y) pairs; every k is (pair, n_z)
+    pairs, pair_of = np.unique(n_vectors[:, :2], axis=0, return_inverse=True)
+    pair_of = pair_of.ravel()
+    z_col = n_vectors[:, 2] + n_max
+
+    p_chunk = max(1, chunk // (3 * len(m)))
+    q_chunk = max(1, chunk // p_chunk)
+    modes = np.zeros((len(pairs), len(m)), dtype=np.complex128)
+    for p0 in range(0, n_particles, p_chunk):
+        phase = (-2j * np.pi / box_length) * positions[p0:p0 + p_chunk]
+        # (particles, 2 n_max + 1) table of phases for every axis
+        e_x, e_y, e_z = (np.exp(phase[:, ax, np.newaxis] * m) for ax in range(3))
+        for q0 in range(0, len(pairs), q_chunk):
+            q = pairs[q0:q0 + q_chunk] + n_max
+            e_xy = e_x[:, q[:, 0]] * e_y[:, q[:, 1]]
+            modes[q0:q0 + q_chunk] += e_xy.T @ e_z
+    return modes[pair_of, z_col]
+
+
+def structure_factor(positions, box_length, k_max, dk=None,
+                     chunk=MAX_CHUNK_VALUES):
+    """
+    Shell averaged structure factor S(|k|) of one or many snapshots.
+
+    @param positions: (N, 3) array, or (frames, N, 3) array (or Trajectory)
+    @param box_length: length of the periodic cubic box
+    @param k_max: largest wavevector magnitude
+    @param dk: width of the |k| shells, defaults to 2 pi / box_length
+    @param chunk: maximum number of complex values of a work array
+    @return: shell centres k, S(k) of every shell, and the magnitudes and
+             S of every individual wavevector
+    """
+    # Trajectory objects are indexed lazily, do not convert them to arrays
+    if len(getattr(positions, "shape", np.shape(positions))) == 2:
+        positions = np.asarray(positions)[np.newaxis]
+    if dk is None:
+        dk = 2. * np.pi / box_length
+
+    n_vectors = k_vectors(box_length, k_max)
+    if len(n_vectors) == 0:
+        raise ValueError(f"k_max = {k_max} is below the smallest wavevector "
+                         f"of the box, 2 pi / L = {2. * np.pi / box_length}")
+    k_mag = 2. * np.pi / box_length * np.sqrt(np.sum(n_vectors ** 2, axis=1))
+
+    s_k = np.zeros(len(n_vectors))
+    n_frames = len(positions)
+    for frame in range(n_frames):
+        pos = np.asarray(positions[frame])
+        rho_k = density_modes(pos, box_length, n_vectors, chunk)
+        s_k += np.square(np.abs(rho_k)) / len(pos)
+    s_k /= n_frames
+
+    # Average over the shells of |k|
+    shell = np.floor(k_mag / dk).astype(np.int64)
+    counts = np.bincount(shell)
+    filled = counts > 0
+    s_shell = np.bincount(shell, weights=s_k)[filled] / counts[filled]
+    k_shell = np.bincount(shell, weights=k_mag)[filled] / counts[filled]
+    return k_shell, s_shell, k_mag, s_k
@@ -0,0 +1,275 @@
+import os
+import queue
+import struct
+import itertools
+import threading
+import numpy as np
+from mdtools.profiling import span
+
+"""
+Binary trajectory store.
+
+The x, y, z text trajectories written by the simulation (one frame per line,
+one particle per column) are converted once into a single file made of a
+64 byte header followed by a C-ordered float32 array of shape
+(frames, particles, 3). The array is memory-mapped on read, so only the
+pages of the frames that are accessed are ever loaded into memory.
+
+The simulation does not necessarily save every integration step, so the
+time between two saved frames is not derived from the integration step: it
+is given when the store is converted and recorded in the header, and may be
+overridden in memory when the store is opened.
+"""
+
+MAGIC = b"MDTRAJ01"
+# magic, frames, particles, box length, time between two saved frames
+HEADER_FORMAT = "<8sqqdd"
+HEADER_SIZE = 64
+DTYPE = np.dtype("<f4")
+
+
+def trajectory_file(sim_name, file_id):
+    """
+    @param sim_name: simulation name used as the prefix in the log files
+    @param file_id: file signature generated by FileNaming.file_searcher
+    @return: filename of the binary trajectory store
+    """
+    return f"{sim_name}Trajectory{file_id}.traj"
+
+
+def xyz_files(sim_name, file_id):
+    """
+    @param sim_name: simulation name used as the prefix in the log files
+    @param file_id: file signature generated by FileNaming.file_searcher
+    @return: the filenames of the x, y and z text trajectories
+    """
+    return tuple(f"{sim_name}{axis}_data{file_id}.log" for axis in "xyz")
+
+
+def _write_header(f, frames, particles, box_length, time_step):
+    header = struct.pack(HEADER_FORMAT, MAGIC, frames, particles,
+                         box_length, time_step)
+    f.seek(0)
+    f.write(header.ljust(HEADER_SIZE, b"\0"))
+
+
+def convert_xyz(x_file, y_file, z_file, out_file, box_length, time_step,
+                chunk_frames=256):
+    """
+    Converts the text trajectories into a binary trajectory store.
+    The text files are streamed in blocks of frames, so the conversion
+    never holds more than chunk_frames frames in memory.
+
+    @param x_file: text file with the x coordinates
+    @param y_file: text file with the y coordinates
+    @param z_file: text file with the z coordinates
+    @param out_file: filename of the binary trajectory store
+    @param box_length: length of the periodic simulation box
+    @param time_step: time between two consecutive saved frames
+    @param chunk_frames: number of frames parsed at once
+    @return: the number of frames and particles written
+    """
+    frames, particles = 0, 0
+    tmp_file = f"{out_file}.tmp"
+    with open(x_file, "r") as fx, open(y_file, "r") as fy, \
+            open(z_file, "r") as fz, open(tmp_file, "wb") as out:
+        _write_header(out, 0, 0, box_length, time_step)
+        while True:
+            lines = [list(itertools.islice(f, chunk_frames))
+                     for f in (fx, fy, fz)]
+            if not lines[0]:
+                break
+            block = [np.loadtxt(l, dtype=DTYPE, ndmin=2) for l in lines]
+            if not (block[0].shape == block[1].shape == block[2].shape):
+                raise ValueError("x, y and z trajectories are not aligned")
+            if particles == 0:
+                particles = block[0].shape[1]
+            elif block[0].shape[1] != particles:
+                raise ValueError("Varying number of particles between frames")
+            out.write(np.stack(block, axis=-1).tobytes())
+            frames += block[0].shape[0]
+        _write_header(out, frames, particles, box_length, time_step)
+    os.replace(tmp_file, out_file)
+    return frames, particles
+
+
+class Trajectory(object):
+    """
+    Read-only, lazily loaded view of a binary trajectory store.
+    Indexing behaves like a numpy array of shape (frames, particles, 3).
+    """
+
+    def __init__(self, fname, time_step=None):
+        """
+        @param fname: path to the trajectory store
+        @param time_step: time between two consecutive saved frames,
+                          overrides the one of the header, which is not
+                          modified
+        """
+        self.fname = fname
+        with open(fname, "rb") as f:
+            magic, frames, particles, box_length, stored = struct.unpack(
+                HEADER_FORMAT, f.read(struct.calcsize(HEADER_FORMAT)))
+        if magic != MAGIC:
+            raise ValueError(f"{fname} is not a trajectory store")
+        self.n_frames = frames
+        self.particles = particles
+        self.box_length = box_length
+        # Between two saved frames, 0 if unknown
+        self.time_step = stored if time_step is None else time_step
+        self.data = np.memmap(fname, dtype=DTYPE, mode="r",
+                              offset=HEADER_SIZE,
+                              shape=(frames, particles, 3))
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, item):
+        return self.data[item]
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def frame(self, num):
+        """
+        @param num: frame index
+        @return: (particles, 3) array with the positions of the frame
+        """
+        return self.data[num]
+
+    def iter_frames(self, start=0, stop=None, stride=1):
+        """
+        Iterates over a range of frames, one frame at a time.
+
+        @param start: first frame
+        @param stop: last frame (excluded), defaults to the last saved frame
+        @param stride: step between the frames
+        """
+        for num in range(*slice(start, stop, stride).indices(self.n_frames)):
+            yield self.data[num]
+
+    def particle_block(self, start, stop):
+        """
+        All the frames for a contiguous block of particles.
+
+        @param start: first particle
+        @param stop: last particle (excluded)
+        @return: (frames, stop - start, 3) float64 array
+        """
+        return np.asarray(self.data[:, start:stop, :], dtype=np.float64)
+
+    def times(self):
+        """
+        @return: the time of every frame
+        """
+        return np.arange(self.n_frames) * self.time_step
+
+
+class FramePrefetcher(object):
+    """
+    Reads frames of a trajectory ahead of their consumer in a background
+    thread, holding at most `buffer` frames in memory. An optional function
+    is applied to every frame in the same thread, so that per-frame analysis
+    also runs ahead of e.g. the renderer.
+
+    Iterating yields (frame number, positions, process(positions)) tuples,
+    and ends early once the prefetcher is closed.
+    """
+
+    _DONE = object()
+
+    def __init__(self, traj, frames, buffer=8, process=None):
+        """
+        @param traj: Trajectory, or any array of shape (frames, particles, 3)
+        @param frames: iterable with the frame numbers to read
+        @param buffer: maximum number of frames read ahead
+        @param process: optional function of the positions of a frame
+        """
+        self.traj = traj
+        self.frames = frames
+        self.process = process
+        self._queue = queue.Queue(maxsize=max(int(buffer), 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._worker, daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        # Wait for free space, but give up when the consumer has stopped
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self):
+        try:
+            for num in self.frames:
+                # Copy out of the memory map, so that the pages are read here
+                positions = np.array(self.traj[num], dtype=np.float64)
+                extra = None if self.process is None \
+                    else self.process(positions)
+                if not self._put((num, positions, extra)):
+                    return
+        except Exception as err:
+            self._put(err)
+            return
+        self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                # The worker gives up without _DONE once closed
+                if self._stop.is_set():
+                    return
+                continue
+            if item is self._DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def open_trajectory(sim_name, file_id, box_length, time_step=None,
+                    sources=None):
+    """
+    Opens the binary trajectory store of a run, converting the text
+    trajectories first if the store is missing or older than them.
+
+    @param sim_name: simulation name used as the prefix in the log files
+    @param file_id: file signature generated by FileNaming.file_searcher
+    @param box_length: length of the periodic simulation box
+    @param time_step: time between two consecutive saved frames. It is
+                      recorded in the header of a new store, and overrides
+                      the recorded one of an existing store in memory only.
+                      If None a new store records 0, for unknown
+    @param sources: paths of the x, y and z text trajectories, defaults to
+                    xyz_files. The store is kept in the directory of the
+                    x trajectory
+    @return: Trajectory object
+    """
+    out_file = trajectory_file(sim_name, file_id)
+    if sources is None:
+        sources = xyz_files(sim_name, file_id)
+    else:
+        out_file = os.path.join(os.path.dirname(sources[0]),
+                                os.path.basename(out_file))
+    if os.path.exists(out_file):
+        existing = [f for f in sources if os.path.exists(f)]
+        if all(os.path.getmtime(out_file) >= os.path.getmtime(f)
+               for f in existing):
+            return Trajectory(out_file, time_step)
+    with span("convert_xyz", sources) as s:
+        frames, __ = convert_xyz(*sources, out_file, box_length,
+                                 0. if time_step is None else time_step)
+        # One line per frame in each of the three files
+        s.add(rows=3 * frames)
+    return Trajectory(out_file)
@@ -0,0 +1,208 @@
+import numpy as np
+from mdtools._lazy import lazy_import
+from mdtools.correlations import velocities_from_positions
+
+"""
+Velocity distributions of the fluid, and how far they are from
+Maxwell-Boltzmann.
+
+The histograms of vx, vy, vz and |v| are built together: the bin index of
+every value is computed on a single (4, particles) array, offset by the
+quantity it belongs to, and counted with one np.bincount call. Values
+outside the range go into an underflow and an overflow bin, so the counts
+always add up to the number of particles.
+
+The Maxwell scale a = sqrt(kT/m) follows in closed form from the second
+moment, <v^2> = 3 a^2, instead of the iterative maximum likelihood fit of
+scipy.stats.maxwell.fit. The counts are accumulated frame by frame, and the
+Kullback-Leibler divergence of every frame from the Maxwell distribution
+with its own scale is kept, which shows whether the run has equilibrated.
+For a sample of N speeds the divergence has a positive bias of about
+(bins - 1) / (2 N), so it levels off at that value rather than at zero.
+"""
+
+special = lazy_import("scipy.special")
+
+# Labels of the four histograms, in the order of VelocityDistribution.counts
+QUANTITIES = ("vx", "vy", "vz", "v")
+
+
+def maxwell_scale(velocities):
+    """
+    @param velocities: (particles, 3) array
+    @return: scale a of the Maxwell distribution, sqrt(<v^2> / 3)
+    """
+    velocities = np.asarray(velocities, dtype=np.float64)
+    return np.sqrt(np.einsum("ij,ij->", velocities, velocities)
+                   / (3. * len(velocities)))
+
+
+def maxwell_pdf(v, scale):
+    """
+    @param v: speeds
+    @param scale: scale a of the distribution
+    @return: Maxwell probability density of the speeds
+    """
+    x = np.asarray(v, dtype=np.float64) / scale
+    return np.sqrt(2. / np.pi) * x * x * np.exp(-0.5 * x * x) / scale
+
+
+def maxwell_cdf(v, scale):
+    """
+    @param v: speeds
+    @param scale: scale a of the distribution
+    @return: Maxwell cumulative distribution of the speeds
+    """
+    x = np.asarray(v, dtype=np.float64) / scale
+    return special.erf(x / np.sqrt(2.)) - \
+        np.sqrt(2. / np.pi) * x * np.exp(-0.5 * x * x)
+
+
+def kl_from_maxwell(speed_counts, speed_edges, scale):
+    """
+    Kullback-Leibler divergence D(P || Q) of a histogram of speeds P from
+    the Maxwell distribution Q, integrated over the same bins.
+
+    @param speed_counts: counts of the bins, followed by the count of the
+                         speeds above the last edge
+    @param speed_edges: edges of the bins, starting at 0
+    @param scale: scale a of the Maxwell distribution
+    @return: the divergence in nats
+    """
+    cdf = maxwell_cdf(speed_edges, scale)
+    q = np.append(np.diff(cdf), 1. - cdf[-1])
+    p = speed_counts / speed_counts.sum()
+    used = p > 0
+    # A non empty bin where the Maxwell probability vanishes numerically
+    q = np.maximum(q[used], np.finfo(np.float64).tiny)
+    return float(np.sum(p[used] * np.log(p[used] / q)))
+
+
+class VelocityDistribution(object):
+    """
+    Histograms of vx, vy, vz and |v| accumulated over many frames, with the
+    Maxwell scale and the KL divergence of every frame.
+    """
+
+    def __init__(self, v_max, bins=150):
+        """
+        @param v_max: the components are binned in [-v_max, v_max] and the
+                      speeds in [0, v_max]
+        @param bins: number of bins of every histogram
+        """
+        self.v_max = float(v_max)
+        self.bins = bins
+        self.component_edges = np.linspace(-self.v_max, self.v_max, bins + 1)
+        self.speed_edges = np.linspace(0., self.v_max, bins + 1)
+        self._low = np.array([-self.v_max] * 3 + [0.])[:, np.newaxis]
+        self._inv_width = bins / np.array([2. * self.v_max] * 3
+                                          + [self.v_max])[:, np.newaxis]
+        # Bins 1..bins of every row hold the range, 0 and bins + 1 the
+        # values below and above it
+        self.counts = np.zeros((4, bins + 2), dtype=np.int64)
+        self.count = 0  # Number of velocity vectors
+        self.sum_v2 = 0.
+        self.frame_scale = []
+        self.frame_kl = []
+
+    def bin_counts(self, velocities):
+        """
+        @param velocities: (particles, 3) array
+        @return: (4, bins + 2) counts of vx, vy, vz and |v|, with the
+                 underflow and overflow bins
+        """
+        velocities = np.asarray(velocities, dtype=np.float64)
+        values = np.empty((4, len(velocities)))
+        values[:3] = velocities.T
+        np.sqrt(np.einsum("ij,ij->i", velocities, velocities), out=values[3])
+        idx = np.floor((values - self._low) * self._inv_width)
+        np.clip(idx, -1, self.bins, out=idx)
+        idx = idx.astype(np.intp) + 1
+        idx += (self.bins + 2) * np.arange(4)[:, np.newaxis]
+        return np.bincount(idx.ravel(), minlength=4 * (self.bins + 2)) \
+            .reshape(4, self.bins + 2)
+
+    def update(self, velocities):
+        """
+        Adds a frame of velocities.
+
+        @param velocities: (particles, 3) array
+        @return: the KL divergence of the frame from Maxwell-Boltzmann
+        """
+        velocities = np.asarray(velocities, dtype=np.float64)
+        counts = self.bin_counts(velocities)
+        self.counts += counts
+        v2 = np.einsum("ij,ij->", velocities, velocities)
+        self.sum_v2 += v2
+        self.count += len(velocities)
+
+        scale = np.sqrt(v2 / (3. * len(velocities)))
+        kl = kl_from_maxwell(counts[3, 1:], self.speed_edges, scale)
+        self.frame_scale.append(scale)
+        self.frame_kl.append(kl)
+        return kl
+
+    @property
+    def scale(self):
+        """
+        Maxwell scale a = sqrt(kT/m) of all the velocities so far
+        """
+        return np.sqrt(self.sum_v2 / (3. * self.count))
+
+    def density(self):
+        """
+        @return: (4, bins) probability densities of vx, vy, vz and |v|,
+                 normalised by every value, including those out of range
+        """
+        widths = 1. / self._inv_width
+        return self.counts[:, 1:-1] / (self.count * widths)
+
+    def kl_divergence(self):
+        """
+        @return: KL divergence of the accumulated speeds from the Maxwell
+                 distribution with the accumulated scale
+        """
+        return kl_from_maxwell(self.counts[3, 1:], self.speed_edges,
+                               self.scale)
+
+
+def trajectory_velocity_distribution(traj, time_step, box_length, v_max=None,
+                                     bins=150, start=0, stop=None, stride=1):
+    """
+    Streams the velocity distribution of a trajectory. The velocities of a
+    frame are the finite differences to the next frame, so only two frames
+    are held in memory at once. With stride 1 the next frame is kept for
+    the following iteration, so every frame is read once.
+
+    @param traj: Trajectory, or any array of shape (frames, particles, 3)
+    @param time_step: time between two consecutive frames
+    @param box_length: length of the periodic box
+    @param v_max: range of the histograms, defaults to 6 times the Maxwell
+                  scale of the first frame, where the tail is below 10^-6
+    @param bins: number of bins of every histogram
+    @param start: first frame
+    @param stop: last frame (excluded), defaults to the last saved frame
+    @param stride: step between the frames
+    @return: the frame numbers and the VelocityDistribution
+    """
+    # The last frame has no next frame to difference with
+    frames = range(*slice(start, stop, stride).indices(max(len(traj) - 1, 0)))
+    if len(frames) == 0:
+        raise ValueError(f"No frame with a next frame among the {len(traj)} "
+                         f"between start={start}, stop={stop} with "
+                         f"stride={stride}")
+    dist = None
+    previous, previous_num = None, None
+    for num in frames:
+        current = previous if previous_num == num \
+            else np.asarray(traj[num], dtype=np.float64)
+        following = np.asarray(traj[num + 1], dtype=np.float64)
+        velocities = velocities_from_positions(
+            np.stack((current, following)), time_step, box_length)[0]
+        previous, previous_num = following, num + 1
+        if dist is None:
+            if v_max is None:
+                v_max = 6. * maxwell_scale(velocities)
+            dist = VelocityDistribution(v_max, bins)
+        dist.update(velocities)
+    return np.asarray(frames), dist
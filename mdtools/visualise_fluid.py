@@ -1,16 +1,22 @@
 from mdtools.stat_quantities import FileNaming
+from mdtools.trajectory import FramePrefetcher
+from mdtools.movie import ParticleScene, export_movie, neighbour_colouring, \
+    COLOUR_LABELS
+from mdtools._lazy import lazy_import
 import numpy as np
-from matplotlib import cm
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-from matplotlib.animation import FuncAnimation
+from mdtools.profiling import profiled, phase
+
+cm = lazy_import("matplotlib.cm")
+plt = lazy_import("matplotlib.pyplot")
+animation = lazy_import("matplotlib.animation")
 
 
 class ParticleVisualisation(FileNaming):
     def __init__(self, steps, particles):
         super().__init__(steps, particles)
-        # Do some initialisation here if needed
+        self.step = 0.005
 
+    @profiled
     def particle_plot(self, sim_name, rho, t, power=None, par_a=None):
         """
         Creates a 3D plot for the particles in the fluid.
@@ -24,10 +30,13 @@ class ParticleVisualisation(FileNaming):
         @:return: Nothing. Simply adds a plot on the corresponding canvas
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Positions_Velocities{file_id}.log"
+        data = self.log_file(sim_name, "Positions_Velocities", rho, t, power, par_a)
 
+        load = phase("load", data)
         rx, ry, rz = np.loadtxt(data, usecols=(0, 1, 2), delimiter='\t',
                                 comments='#', unpack=True)
+        load.add(rows=len(rx))
+        phase("plot")
         name = self.get_label(file_id)
         fig = plt.figure('3D Scatter Plot')
         ax = fig.add_subplot(111, projection='3d')
@@ -35,6 +44,7 @@ class ParticleVisualisation(FileNaming):
         ax.legend(loc='best', fancybox=True)
         fig.colorbar(s)
 
+    @profiled
     def vector_field(self, sim_name, rho, t, power=None, par_a=None):
         """
         Creates a 2D projection of the of the loaded files of the fluid for
@@ -48,15 +58,18 @@ class ParticleVisualisation(FileNaming):
         @:return: Nothing. Simply adds a plot on the corresponding canvas
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Positions_Velocities{file_id}.log"
+        data = self.log_file(sim_name, "Positions_Velocities", rho, t, power, par_a)
 
+        load = phase("load", data)
         rx, ry, rz, vx, vy, vz = np.loadtxt(data,
                                             # redundant
                                             usecols=(0, 1, 2, 3, 4, 5),
                                             delimiter='\t',
                                             comments='#',
                                             unpack=True)
+        load.add(rows=len(rx))
 
+        phase("plot")
         name = self.get_label(file_id)
         plt.figure('2D Vector Field of particles')
         q = plt.quiver(rx, ry, vx, vy, rz, pivot='mid',
@@ -65,6 +78,7 @@ class ParticleVisualisation(FileNaming):
         plt.colorbar(q)
 
     # 3D visualisation of the fluid with vector arrows
+    @profiled
     def vector_field_3d(self, sim_name, rho, t, power=None, par_a=None):
         """
         Creates a 3D projection based on the last iteration of the MD algorithm
@@ -78,15 +92,18 @@ class ParticleVisualisation(FileNaming):
         @:return: Nothing. Simply adds a plot on the corresponding canvas
         """
         file_id = self.file_searcher(rho, t, power, par_a)
-        data = f"{sim_name}Positions_Velocities{file_id}.log"
+        data = self.log_file(sim_name, "Positions_Velocities", rho, t, power, par_a)
 
+        load = phase("load", data)
         rx, ry, rz, vx, vy, vz = np.loadtxt(data,
                                             # redundant
                                             usecols=(0, 1, 2, 3, 4, 5),
                                             delimiter='\t',
                                             comments='#',
                                             unpack=True)
+        load.add(rows=len(rx))
 
+        phase("plot")
         name = self.get_label(file_id)
         fig = plt.figure('3D Vector Field of particles')
         ax = fig.gca(projection='3d')
@@ -101,38 +118,88 @@ class ParticleVisualisation(FileNaming):
         fig.colorbar(q, cmap=cm.get_cmap('viridis'))
         plt.legend(loc='best')
 
-    def animation3D(self, sim_name, rho, t, power=None, par_a=None, save=False):
-
-        file_id = self.file_searcher(rho, t, power, par_a)
+    @profiled
+    def animation3D(self, sim_name, rho, t, power=None, par_a=None, save=False,
+                    start=0, stop=None, stride=1, buffer=8, fps=60,
+                    workers=0, colour_by=None):
+        """
+        Animates the particles of the trajectory store. The frames are read
+        from disk on demand by a background thread, at most buffer frames
+        ahead of the display, and only the particles and the frame counter
+        are redrawn (blitting).
 
-        x_all = np.loadtxt(f"{sim_name}x_data{file_id}.log")
-        y_all = np.loadtxt(f"{sim_name}y_data{file_id}.log")
-        z_all = np.loadtxt(f"{sim_name}z_data{file_id}.log")
+        @:param sim_name: simulation name used as the prefix in the log files
+        @:param rho: Density
+        @:param t: Temperature
+        @:param power: Pair potential strength
+        @:param par_a: Softening @:parameter
+        @:param save: Render the movie {sim_name}.mp4 instead of displaying it
+        @:param start: First frame
+        @:param stop: Last frame (excluded), defaults to the last saved frame
+        @:param stride: Step between the frames shown
+        @:param buffer: Number of frames read ahead of the display
+        @:param fps: Frames per second of the saved movie
+        @:param workers: Number of processes rendering the movie, all the
+                        cores if < 1 and serially if None
+        @:param colour_by: Colour the particles by their nearest neighbour
+                          distance, "nn", or coordination number,
+                          "coordination". The neighbour search runs in the
+                          thread that reads the frames, ahead of the display
+        @:return: The animation, a reference must be kept while it is shown
+        """
+        phase("load")
+        traj = self.trajectory(sim_name, rho, t, power, par_a)
+        frames = range(*slice(start, stop, stride).indices(len(traj)))
+        if len(frames) == 0:
+            raise ValueError(f"No frames of the {len(traj)} saved between "
+                             f"start={start}, stop={stop} with "
+                             f"stride={stride}")
 
-        fig = plt.figure(figsize=(10, 10))
-        ax = fig.add_subplot(111, projection="3d")
-        graph = ax.scatter(x_all[0], y_all[0], z_all[0], color='orange')
-        text = fig.text(0, 1, "TEXT", va='top')  # displays the frames
-
-        box_length = (int(self.p_str) / rho) ** (1./3.)
-
-        ax.set_xlim3d(0, box_length)
-        ax.set_ylim3d(0, box_length)
-        ax.set_zlim3d(0, box_length)
-
-        # Mock function for animation frame generation
-        def update_figure(num):
-            x = x_all[num]
-            y = y_all[num]
-            z = z_all[num]
-            # TODO: NN calculation between all particles & -> assign colormap
-            text.set_text(f"Frame: {num}")
-            graph._offsets3d = (x, y, z)
-            return graph
-
-        ani = FuncAnimation(fig, update_figure,
-                            frames=int(self.steps_str), interval=0, blit=False)
         if save:
-            ani.save(f"{sim_name}.mp4", fps=60)
+            return export_movie(traj.fname, f"{sim_name}.mp4", frames,
+                                fps=fps, workers=workers, colour_by=colour_by)
+
+        phase("plot")
+        # Colour scale from the first frame, with its own neighbour search
+        first = np.asarray(traj.frame(frames[0]), dtype=np.float64)
+        values = None
+        if colour_by is not None:
+            values = neighbour_colouring(traj.box_length, colour_by)(first)
+        fig = plt.figure(figsize=(10, 10))
+        scene = ParticleScene(fig, traj.box_length, first, values=values,
+                              label=COLOUR_LABELS.get(colour_by))
+
+        def update_figure(item):
+            num, frame, colours = item
+            return scene.update(num, frame, colours)
+
+        # Every pass of the animation reads through its own prefetcher,
+        # started by the first frame it asks for and closed when it ends
+        live = set()
+
+        def frame_source():
+            prefetch = FramePrefetcher(
+                traj, frames, buffer,
+                process=neighbour_colouring(traj.box_length, colour_by))
+            live.add(prefetch)
+            try:
+                yield from prefetch
+            finally:
+                live.discard(prefetch)
+                prefetch.close()
+
+        def close_prefetch(*args):
+            for prefetch in list(live):
+                prefetch.close()
+
+        ani = animation.FuncAnimation(fig, update_figure,
+                                      frames=frame_source,
+                                      init_func=lambda: scene.update(
+                                          frames[0], first, values),
+                                      interval=0, blit=True,
+                                      save_count=len(frames),
+                                      cache_frame_data=False)
+        fig.canvas.mpl_connect("close_event", close_prefetch)
 
         plt.show()
+        return ani